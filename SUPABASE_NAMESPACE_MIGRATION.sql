@@ -66,6 +66,16 @@ ON snapchat_processed_stories(project_namespace, username);
 CREATE INDEX IF NOT EXISTS idx_snapchat_recent_stories_cache_namespace_username 
 ON snapchat_recent_stories_cache(project_namespace, username);
 
+CREATE INDEX IF NOT EXISTS idx_snapchat_cache_cleanup_log_namespace_cleaned_at 
+ON snapchat_cache_cleanup_log(project_namespace, cleaned_at DESC);
+
+-- One row per cached user, so the service lists usernames without reading every cached story
+CREATE OR REPLACE VIEW snapchat_cached_usernames AS
+SELECT DISTINCT project_namespace, username
+FROM snapchat_recent_stories_cache;
+
+GRANT SELECT ON snapchat_cached_usernames TO anon, authenticated, service_role;
+
 -- ============================================
 -- UPDATE EXISTING DATA (Optional)
 -- ============================================
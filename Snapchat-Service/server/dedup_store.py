@@ -0,0 +1,454 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from loguru import logger
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS processed_stories (
+    username TEXT NOT NULL,
+    snap_id TEXT NOT NULL,
+    story_url TEXT,
+    story_type TEXT,
+    processed_at TEXT NOT NULL,
+    synced INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (username, snap_id)
+);
+CREATE INDEX IF NOT EXISTS processed_pending ON processed_stories (synced) WHERE synced = 0;
+CREATE TABLE IF NOT EXISTS recent_stories (
+    username TEXT NOT NULL,
+    story_order INTEGER NOT NULL,
+    snap_id TEXT,
+    story_url TEXT,
+    story_type TEXT,
+    cached_at TEXT NOT NULL,
+    PRIMARY KEY (username, story_order)
+);
+CREATE TABLE IF NOT EXISTS recent_stories_users (
+    username TEXT PRIMARY KEY,
+    dirty INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS pending_clears (
+    username TEXT PRIMARY KEY,
+    cache INTEGER NOT NULL DEFAULT 0,
+    processed INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+# Rows pushed to Supabase per sync pass
+SYNC_BATCH = 200
+
+
+class DedupStore:
+    """Local write-through store for processed snap_ids and recent-stories caches
+
+    Every dedup check is answered from memory (a set of ``(username, snap_id)``
+    and the cached story lists per user), backed by a local SQLite file so it
+    survives restarts. Writes land locally first and are pushed to Supabase by
+    :meth:`run` in the background, so polling keeps deduplicating while
+    Supabase is unreachable and catches up once it is back.
+
+    Supabase stays the shared copy: processed snap_ids are pulled once per
+    process on the first successful sync, and a user's recent-stories cache
+    is read from Supabase the first time it is needed and not known locally.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._processed: Set[Tuple[str, str]] = set()
+        self._recent: Dict[str, List[Dict[str, Any]]] = {}
+        # username -> version of the local cache not yet pushed
+        self._dirty: Dict[str, int] = {}
+        self._pending = 0
+        self._seeded = False
+        self._wake: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.lookups = 0
+        self.pushed_processed = 0
+        self.pushed_caches = 0
+        self.unchanged_caches = 0
+        self.sync_failures = 0
+        self.last_sync: Optional[float] = None
+        self._load()
+
+    def _load(self):
+        with self._lock:
+            for username, snap_id, synced in self._conn.execute(
+                "SELECT username, snap_id, synced FROM processed_stories"
+            ):
+                self._processed.add((username, snap_id))
+                self._pending += not synced
+            for (username, dirty) in self._conn.execute("SELECT username, dirty FROM recent_stories_users"):
+                self._recent[username] = []
+                if dirty:
+                    self._dirty[username] = 1
+            for username, order, snap_id, url, story_type, cached_at in self._conn.execute(
+                "SELECT username, story_order, snap_id, story_url, story_type, cached_at"
+                " FROM recent_stories ORDER BY username, story_order"
+            ):
+                self._recent.setdefault(username, []).append({
+                    "story_url": url,
+                    "snap_id": snap_id,
+                    "story_type": story_type,
+                    "story_order": order,
+                    "cached_at": cached_at,
+                })
+        logger.info(
+            f"📊 [DEDUP] Loaded {len(self._processed)} processed stories and "
+            f"{len(self._recent)} cached users from {self.path}"
+        )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _notify(self):
+        """Wake the sync loop (safe from any thread)"""
+        if self._wake is not None and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    # ----- processed stories -----
+
+    def is_processed(self, snap_id: str, username: str) -> bool:
+        self.lookups += 1
+        return (username, snap_id) in self._processed
+
+    def mark_processed(self, snap_id: str, username: str, story_url: str, story_type: str) -> bool:
+        """Record a processed story locally; returns False if it was already recorded"""
+        key = (username, snap_id)
+        with self._lock:
+            if key in self._processed:
+                return False
+            self._conn.execute(
+                "INSERT OR IGNORE INTO processed_stories"
+                " (username, snap_id, story_url, story_type, processed_at) VALUES (?, ?, ?, ?, ?)",
+                (username, snap_id, story_url, story_type, datetime.now().isoformat()),
+            )
+            self._processed.add(key)
+            self._pending += 1
+        self._notify()
+        return True
+
+    def mark_many(self, username: str, stories: List[Dict[str, Any]]) -> int:
+        """Record several processed stories in one transaction; returns how many were new"""
+        processed_at = datetime.now().isoformat()
+        with self._lock:
+            fresh = {}
+            for story in stories:
+                snap_id = story.get("snap_id")
+                if snap_id and (username, snap_id) not in self._processed:
+                    fresh[snap_id] = (username, snap_id, story.get("url"), story.get("type", "photo"), processed_at)
+            if fresh:
+                self._conn.execute("BEGIN")
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO processed_stories"
+                    " (username, snap_id, story_url, story_type, processed_at) VALUES (?, ?, ?, ?, ?)",
+                    list(fresh.values()),
+                )
+                self._conn.execute("COMMIT")
+                self._processed.update((username, snap_id) for snap_id in fresh)
+                self._pending += len(fresh)
+        if fresh:
+            self._notify()
+        return len(fresh)
+
+    def merge_processed(self, rows: List[Dict[str, Any]]) -> int:
+        """Add processed stories already stored in Supabase; returns how many were new here"""
+        added = 0
+        with self._lock:
+            cleared = {username for (username,) in self._conn.execute(
+                "SELECT username FROM pending_clears WHERE processed = 1"
+            )}
+            fresh = [
+                row for row in rows
+                if row.get("snap_id") and row.get("username") not in cleared
+                and (row["username"], row["snap_id"]) not in self._processed
+            ]
+            if fresh:
+                self._conn.execute("BEGIN")
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO processed_stories"
+                    " (username, snap_id, story_url, story_type, processed_at, synced)"
+                    " VALUES (?, ?, ?, ?, ?, 1)",
+                    [
+                        (row["username"], row["snap_id"], row.get("story_url"), row.get("story_type"),
+                         row.get("processed_at") or datetime.now().isoformat())
+                        for row in fresh
+                    ],
+                )
+                self._conn.execute("COMMIT")
+                for row in fresh:
+                    self._processed.add((row["username"], row["snap_id"]))
+                added = len(fresh)
+        return added
+
+    # ----- recent-stories cache -----
+
+    def has_recent(self, username: str) -> bool:
+        return username in self._recent
+
+    def recent_stories(self, username: str) -> Optional[List[Dict[str, Any]]]:
+        """Cached stories for ``username`` (Supabase row shape), or None if not known locally"""
+        self.lookups += 1
+        stories = self._recent.get(username)
+        return None if stories is None else [dict(story) for story in stories]
+
+    @staticmethod
+    def _same_stories(current: List[Dict[str, Any]], rows: List[Dict[str, Any]]) -> bool:
+        return [(row["snap_id"], row["story_url"], row["story_type"]) for row in current] == [
+            (row["snap_id"], row["story_url"], row["story_type"]) for row in rows
+        ]
+
+    def set_recent_stories(self, username: str, stories: List[Dict[str, Any]], dirty: bool = True):
+        """Replace the cached stories of ``username`` (``url``/``snap_id``/``type`` dicts)"""
+        cached_at = datetime.now().isoformat()
+        rows = [
+            {
+                "story_url": story.get("url") or story.get("story_url"),
+                "snap_id": story.get("snap_id"),
+                "story_type": story.get("type") or story.get("story_type") or "photo",
+                "story_order": i + 1,
+                "cached_at": story.get("cached_at") or cached_at,
+            }
+            for i, story in enumerate(stories)
+        ]
+        with self._lock:
+            current = self._recent.get(username)
+            if current is not None and self._same_stories(current, rows):
+                # Idle poll: nothing to write locally or to push
+                self.unchanged_caches += 1
+                return
+            self._conn.execute("BEGIN")
+            self._conn.execute("DELETE FROM recent_stories WHERE username = ?", (username,))
+            self._conn.executemany(
+                "INSERT INTO recent_stories (username, story_order, snap_id, story_url, story_type, cached_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                [(username, row["story_order"], row["snap_id"], row["story_url"], row["story_type"], row["cached_at"])
+                 for row in rows],
+            )
+            self._conn.execute(
+                "INSERT INTO recent_stories_users (username, dirty) VALUES (?, ?)"
+                " ON CONFLICT (username) DO UPDATE SET dirty = excluded.dirty",
+                (username, int(dirty)),
+            )
+            self._conn.execute("COMMIT")
+            self._recent[username] = rows
+            if dirty:
+                self._dirty[username] = self._dirty.get(username, 0) + 1
+            else:
+                self._dirty.pop(username, None)
+        if dirty:
+            self._notify()
+
+    # ----- clearing -----
+
+    def clear_user(self, username: str, cache: bool = True, processed: bool = True, pending: bool = False) -> Dict[str, int]:
+        """Drop a user's local data; with ``pending`` the Supabase delete is queued
+
+        A queued delete is settled by :meth:`push_clear`, or by the next sync.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN")
+            cache_deleted = processed_deleted = 0
+            if cache:
+                cache_deleted = len(self._recent.pop(username, None) or ())
+                self._dirty.pop(username, None)
+                self._conn.execute("DELETE FROM recent_stories WHERE username = ?", (username,))
+                self._conn.execute("DELETE FROM recent_stories_users WHERE username = ?", (username,))
+            if processed:
+                keys = [key for key in self._processed if key[0] == username]
+                self._pending -= self._conn.execute(
+                    "SELECT COUNT(*) FROM processed_stories WHERE username = ? AND synced = 0", (username,)
+                ).fetchone()[0]
+                self._conn.execute("DELETE FROM processed_stories WHERE username = ?", (username,))
+                self._processed.difference_update(keys)
+                processed_deleted = len(keys)
+            if pending:
+                self._conn.execute(
+                    "INSERT INTO pending_clears (username, cache, processed) VALUES (?, ?, ?)"
+                    " ON CONFLICT (username) DO UPDATE SET"
+                    " cache = MAX(cache, excluded.cache), processed = MAX(processed, excluded.processed)",
+                    (username, int(cache), int(processed)),
+                )
+            self._conn.execute("COMMIT")
+        if pending:
+            self._notify()
+        return {"processed_deleted": processed_deleted, "cache_deleted": cache_deleted}
+
+    async def push_clear(self, supabase_manager, username: str, cache: bool = True, processed: bool = True) -> Optional[Dict[str, int]]:
+        """Delete a user's Supabase rows, then settle the matching pending clear
+
+        Returns the Supabase deleted counts, or None when a delete failed: the
+        pending clear then stays queued and the next sync retries it.
+        """
+        result = {"processed_deleted": 0, "cache_deleted": 0}
+        if cache:
+            result["cache_deleted"] = await supabase_manager.clear_user_cache(username)
+            if result["cache_deleted"] is None:
+                return None
+        if processed:
+            result["processed_deleted"] = await supabase_manager.clear_user_processed_stories(username)
+            if result["processed_deleted"] is None:
+                return None
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "UPDATE pending_clears SET cache = cache AND NOT ?, processed = processed AND NOT ? WHERE username = ?",
+                (int(cache), int(processed), username),
+            )
+            self._conn.execute("DELETE FROM pending_clears WHERE username = ? AND NOT cache AND NOT processed", (username,))
+            self._conn.execute("COMMIT")
+        return result
+
+    def expire(self, before: datetime) -> Dict[str, int]:
+        """Forget synced entries recorded before ``before`` (mirrors the Supabase cleanup)"""
+        cutoff = before.isoformat()
+        with self._lock:
+            expired = self._conn.execute(
+                "SELECT username, snap_id FROM processed_stories WHERE synced = 1 AND processed_at < ?", (cutoff,)
+            ).fetchall()
+            stale_users = [
+                username for (username,) in self._conn.execute(
+                    "SELECT DISTINCT username FROM recent_stories WHERE cached_at < ?", (cutoff,)
+                )
+                if username not in self._dirty
+            ]
+            self._conn.execute("BEGIN")
+            self._conn.execute("DELETE FROM processed_stories WHERE synced = 1 AND processed_at < ?", (cutoff,))
+            for username in stale_users:
+                self._conn.execute("DELETE FROM recent_stories WHERE username = ?", (username,))
+                self._conn.execute("DELETE FROM recent_stories_users WHERE username = ?", (username,))
+                self._recent.pop(username, None)
+            self._conn.execute("COMMIT")
+            self._processed.difference_update((username, snap_id) for username, snap_id in expired)
+        return {"processed_removed": len(expired), "users_removed": len(stale_users)}
+
+    # ----- Supabase sync -----
+
+    @property
+    def has_backlog(self) -> bool:
+        return bool(self._pending or self._dirty) or self._has_pending_clears()
+
+    def _has_pending_clears(self) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM pending_clears LIMIT 1").fetchone() is not None
+
+    async def sync(self, supabase_manager) -> bool:
+        """Push local changes to Supabase (and pull processed snap_ids once); returns True when fully synced"""
+        if not supabase_manager.is_connected:
+            return False
+        with self._lock:
+            clears = self._conn.execute("SELECT username, cache, processed FROM pending_clears").fetchall()
+        # Seeding below must not pull back rows a queued clear is meant to delete
+        for username, cache, processed in clears:
+            if await self.push_clear(supabase_manager, username, bool(cache), bool(processed)) is None:
+                return False
+
+        if not self._seeded:
+            rows = await supabase_manager.get_processed_stories()
+            if rows is None:
+                return False
+            added = self.merge_processed(rows)
+            self._seeded = True
+            logger.info(f"📥 [DEDUP] Pulled {len(rows)} processed stories from Supabase ({added} new locally)")
+
+        with self._lock:
+            pending = self._conn.execute(
+                "SELECT username, snap_id, story_url, story_type, processed_at FROM processed_stories"
+                " WHERE synced = 0 ORDER BY username LIMIT ?",
+                (SYNC_BATCH,),
+            ).fetchall()
+        by_user: Dict[str, List[Dict[str, Any]]] = {}
+        for username, snap_id, story_url, story_type, processed_at in pending:
+            by_user.setdefault(username, []).append(
+                {"snap_id": snap_id, "url": story_url, "type": story_type, "processed_at": processed_at}
+            )
+        for username, stories in by_user.items():
+            # Rows are unique per snap_id, so the stored count is a prefix of ``stories``
+            stored = await supabase_manager.mark_stories_processed(username, stories)
+            with self._lock:
+                self._conn.execute("BEGIN")
+                updated = sum(
+                    self._conn.execute(
+                        "UPDATE processed_stories SET synced = 1 WHERE username = ? AND snap_id = ? AND synced = 0",
+                        (username, story["snap_id"]),
+                    ).rowcount
+                    for story in stories[:stored]
+                )
+                self._conn.execute("COMMIT")
+                self._pending -= updated
+            self.pushed_processed += stored
+            if stored < len(stories):
+                self.sync_failures += 1
+                return False
+
+        for username, version in list(self._dirty.items()):
+            stories = [
+                {"url": story["story_url"], "snap_id": story["snap_id"], "type": story["story_type"]}
+                for story in self._recent.get(username, ())
+            ]
+            if not await supabase_manager.update_recent_stories_cache(username, stories):
+                self.sync_failures += 1
+                return False
+            with self._lock:
+                # Only settle the version that was pushed; a newer one syncs next pass
+                if self._dirty.get(username) == version:
+                    del self._dirty[username]
+                    self._conn.execute("UPDATE recent_stories_users SET dirty = 0 WHERE username = ?", (username,))
+            self.pushed_caches += 1
+
+        self.last_sync = time.time()
+        return not self.has_backlog
+
+    async def run(self, supabase_manager, interval: float = 5.0, reconnect_interval: float = 60.0):
+        """Background sync loop: push on every local write, retry every ``interval`` seconds"""
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        last_connect = time.monotonic()
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                if not supabase_manager.is_connected:
+                    if time.monotonic() - last_connect < reconnect_interval:
+                        continue
+                    last_connect = time.monotonic()
+                    logger.info("🔌 [DEDUP] Supabase disconnected - trying to reconnect...")
+                    if not await supabase_manager.connect():
+                        continue
+                if self.has_backlog or not self._seeded:
+                    await self.sync(supabase_manager)
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                self.sync_failures += 1
+                logger.error(f"❌ [DEDUP] Supabase sync failed: {error}")
+
+    def stats(self) -> dict:
+        return {
+            "processed": len(self._processed),
+            "cached_users": len(self._recent),
+            "pending_processed": self._pending,
+            "pending_caches": len(self._dirty),
+            "pending_clears": self._has_pending_clears(),
+            "seeded": self._seeded,
+            "lookups": self.lookups,
+            "pushed_processed": self.pushed_processed,
+            "pushed_caches": self.pushed_caches,
+            "unchanged_caches": self.unchanged_caches,
+            "sync_failures": self.sync_failures,
+            "last_sync": self.last_sync,
+        }
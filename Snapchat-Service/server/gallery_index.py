@@ -0,0 +1,547 @@
+import asyncio
+import base64
+import calendar
+import json
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from loguru import logger
+
+from snapchat_dl.media_index import filename_timestamp
+from server.search_index import SearchIndex
+
+try:
+    from watchfiles import awatch, Change
+except ImportError:  # optional filesystem watcher
+    awatch = None
+    Change = None
+
+MEDIA_TYPES = ("stories", "highlights", "spotlights")
+
+# sort_by -> (key column, descending)
+SORT_ORDERS = {
+    "date_desc": ("date", True),
+    "date_asc": ("date", False),
+    "filename_asc": ("name", False),
+    "filename_desc": ("name", True),
+    "type": ("type", False),
+}
+COLUMNS = ("date", "name", "type")
+
+# Timestamp of files whose name carries no date; sorts before every real date
+NO_DATE = -(2 ** 53)
+DAY_SECONDS = 86400
+# A search whose rarest trigram covers at most 1/SPARSE_SEARCH of the range
+# sorts its matches instead of walking the range with a substring check
+SPARSE_SEARCH = 4
+
+
+class InvalidCursor(ValueError):
+    """A pagination cursor that does not belong to this query"""
+
+
+def resolve_thumbnail_url(username: str, media_type: str, item: dict) -> str:
+    """Pick the thumbnail the gallery shows for a metadata item"""
+    file_url = f"/downloads/{username}/{media_type}/{item['filename']}"
+    thumbnail_url = item.get("thumbnail_url")
+
+    # Handle thumbnail_url being a dict with 'value' key (legacy format)
+    if isinstance(thumbnail_url, dict):
+        thumbnail_url = thumbnail_url.get("value", "")
+
+    if item.get("type") == "video":
+        # External preview URLs (Snapchat CDN) are used directly; anything
+        # else is generated from the video itself
+        if not (isinstance(thumbnail_url, str) and thumbnail_url.startswith("http")) \
+                or thumbnail_url == item.get("download_url") or thumbnail_url.endswith(".mp4"):
+            thumbnail_url = f"/thumbnail/{username}/{media_type}/{item['filename']}"
+    return thumbnail_url or file_url
+
+
+def parse_day(value: str) -> int:
+    """UTC midnight of a YYYY-MM-DD date as a unix timestamp (raises ValueError)"""
+    return calendar.timegm(datetime.strptime(value, "%Y-%m-%d").timetuple())
+
+
+def capture_timestamp(filename: str) -> int:
+    """Capture time from a YYYY-MM-DD_HH-MM-SS_... filename
+
+    Falls back to midnight when only the date part parses, and to NO_DATE
+    when the name carries no date at all.
+    """
+    timestamp = filename_timestamp(filename)
+    if timestamp is not None:
+        return timestamp
+    prefix = filename.split("_")[0]
+    try:
+        return calendar.timegm(date.fromisoformat(prefix).timetuple())
+    except ValueError:
+        pass
+    try:
+        return parse_day(prefix)
+    except ValueError:
+        return NO_DATE
+
+
+def encode_cursor(column: str, key: Tuple) -> str:
+    raw = json.dumps([column, *key], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, column: str) -> Tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+    except ValueError:
+        raise InvalidCursor("Malformed cursor")
+    if not isinstance(data, list) or len(data) != 4 or data[0] != column:
+        raise InvalidCursor("Cursor does not match this sort order")
+    return tuple(data[1:])
+
+
+@dataclass
+class GalleryEntry:
+    username: str
+    media_type: str
+    filename: str
+    type: str
+    thumbnail_url: str
+    download_status: str
+    progress: Optional[int]
+    download_url: str
+    timestamp: int
+    search_text: str
+
+    @classmethod
+    def from_item(cls, username: str, media_type: str, item: dict) -> "GalleryEntry":
+        filename = item["filename"]
+        return cls(
+            username=username,
+            media_type=media_type,
+            filename=filename,
+            type=item.get("type") or "image",
+            thumbnail_url=resolve_thumbnail_url(username, media_type, item),
+            download_status=item.get("download_status") or "complete",
+            progress=item.get("progress"),
+            download_url=f"/downloads/{username}/{media_type}/{filename}",
+            timestamp=capture_timestamp(filename),
+            search_text=SearchIndex.text_for(filename, username),
+        )
+
+    def sort_key(self, column: str) -> Tuple:
+        """Key in one sort column; every key ends with (filename, username)"""
+        if column == "date":
+            return (self.timestamp, self.filename, self.username)
+        if column == "name":
+            return (self.filename.lower(), self.filename, self.username)
+        return (self.type != "video", self.filename, self.username)
+
+
+class _SortedKeys:
+    """Sort keys of one bucket of entries, one sorted list per column"""
+
+    def __init__(self, columns: Tuple[str, ...] = COLUMNS):
+        self.columns: Dict[str, List[Tuple]] = {column: [] for column in columns}
+
+    def add(self, entry: GalleryEntry):
+        for column, keys in self.columns.items():
+            insort(keys, entry.sort_key(column))
+
+    def discard(self, entry: GalleryEntry):
+        for column, keys in self.columns.items():
+            key = entry.sort_key(column)
+            i = bisect_left(keys, key)
+            if i < len(keys) and keys[i] == key:
+                del keys[i]
+
+    def __len__(self) -> int:
+        return len(self.columns["date"])
+
+
+@dataclass
+class _Plan:
+    """Where a query's matches live: a [lo, hi) range of one sorted column"""
+    media_type: str
+    column: str
+    descending: bool
+    keys: List[Tuple]
+    lo: int
+    hi: int
+    predicate: Optional[Callable[[GalleryEntry], bool]]
+    counter: Optional[Callable[[], int]] = None
+
+
+class GalleryIndex:
+    """In-memory view of every gallery item, kept in sort order
+
+    Built once from the media index (one directory listing per folder) and
+    then updated item by item from media index change notifications, so
+    gallery requests never walk the downloads folder or reload metadata.
+    Filename searches go through a trigram index per media type.
+
+    Sort keys are bucketed by media type, by (media type, username) and by
+    (media type, image/video), so username and type filters pick a bucket
+    instead of scanning; date filters on the date orders are a bisect on
+    integer capture timestamps parsed once at ingest. Pages are found by
+    seeking to a cursor (the last key served), so deep pages cost the same
+    as page 1. Totals that need a residual scan are cached until the index
+    changes.
+
+    Updates only come from this process's media index listeners, so the
+    server must run a single worker: items another process writes to the
+    shared SQLite index are not seen until the next rebuild (with
+    GALLERY_WATCH, their files appearing or disappearing still are).
+    """
+
+    def __init__(self, media_index, downloads_dir: str):
+        self.media_index = media_index
+        self.downloads_dir = downloads_dir
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()
+        self._entries: Dict[Tuple[str, str, str], GalleryEntry] = {}
+        self._buckets: Dict[Tuple[str, Optional[str], Optional[str]], _SortedKeys] = {}
+        self._counts: Dict[Tuple, int] = {}
+        self._searches: Dict[Tuple, List[Tuple]] = {}
+        self._search = {media_type: SearchIndex() for media_type in MEDIA_TYPES}
+        self._built = False
+        self._rebuilding = False
+        self._dirty: List[Tuple[str, str, Optional[List[str]]]] = []
+        self.rebuilds = 0
+        self.updates = 0
+        media_index.add_listener(self.on_change)
+
+    # ----- building and incremental updates -----
+
+    @staticmethod
+    def _bucket_keys(entry: GalleryEntry):
+        """Buckets an entry belongs to, with the columns each one keeps"""
+        return (
+            ((entry.media_type, None, None), COLUMNS),
+            ((entry.media_type, entry.username, None), COLUMNS),
+            # Type-filtered queries only get a bucket for the date orders
+            ((entry.media_type, None, entry.type), ("date",)),
+        )
+
+    def _file_exists(self, username: str, media_type: str, filename: str) -> bool:
+        return os.path.isfile(os.path.join(self.downloads_dir, username, media_type, filename))
+
+    def rebuild(self):
+        """Load every indexed item whose file exists"""
+        with self._build_lock:
+            self._rebuild()
+
+    def _rebuild(self):
+        started = time.perf_counter()
+        with self._lock:
+            self._rebuilding = True
+            self._dirty = []
+        try:
+            entries = {}
+            for username, media_type in self.media_index.groups():
+                if media_type not in MEDIA_TYPES:
+                    continue
+                # One directory listing per folder instead of a stat per item
+                try:
+                    present = set(os.listdir(os.path.join(self.downloads_dir, username, media_type)))
+                except OSError:
+                    continue
+                for item in self.media_index.items(username, media_type):
+                    filename = item.get("filename")
+                    if filename not in present:
+                        continue
+                    entries[(username, media_type, filename)] = GalleryEntry.from_item(username, media_type, item)
+            # Append then sort once instead of inserting one by one
+            buckets = {}
+            for entry in entries.values():
+                for bucket_key, columns in self._bucket_keys(entry):
+                    bucket = buckets.get(bucket_key)
+                    if bucket is None:
+                        bucket = buckets[bucket_key] = _SortedKeys(columns)
+                    for column, keys in bucket.columns.items():
+                        keys.append(entry.sort_key(column))
+            for bucket in buckets.values():
+                for keys in bucket.columns.values():
+                    keys.sort()
+            search = {media_type: SearchIndex() for media_type in MEDIA_TYPES}
+            for (username, media_type, filename), entry in entries.items():
+                search[media_type].add((username, filename), entry, entry.search_text)
+        except Exception:
+            with self._lock:
+                self._rebuilding = False
+            raise
+        with self._lock:
+            self._rebuilding = False
+            self._entries = entries
+            self._buckets = buckets
+            self._search = search
+            self._counts = {}
+            self._searches = {}
+            self._built = True
+            self.rebuilds += 1
+            # Changes that raced with the build are applied on top of it
+            dirty, self._dirty = self._dirty, []
+            for username, media_type, filenames in dirty:
+                self._apply(username, media_type, filenames)
+        logger.info(f"🖼️ [GALLERY] Indexed {len(entries)} items in {(time.perf_counter() - started) * 1000:.0f}ms")
+
+    def _ensure_built(self):
+        # Requests that arrive before the startup build wait for it
+        if not self._built:
+            with self._build_lock:
+                if not self._built:
+                    self._rebuild()
+
+    async def ready(self):
+        """Wait off the event loop until the index is built
+
+        Requests that arrive before the startup build finishes wait for it
+        (or build it, if that failed) in a worker thread.
+        """
+        if not self._built:
+            await asyncio.to_thread(self._ensure_built)
+
+    def on_change(self, username: str, media_type: str, filenames: Optional[List[str]]):
+        """Media index listener: refresh the changed items"""
+        if media_type not in MEDIA_TYPES:
+            return
+        with self._lock:
+            if self._rebuilding:
+                self._dirty.append((username, media_type, filenames))
+                return
+            if self._built:
+                self._apply(username, media_type, filenames)
+
+    def _apply(self, username: str, media_type: str, filenames: Optional[List[str]]):
+        if filenames is None:
+            for key in [k for k in self._entries if k[0] == username and k[1] == media_type]:
+                self._discard(key)
+            items = self.media_index.items(username, media_type)
+        else:
+            items = []
+            for filename in filenames:
+                self._discard((username, media_type, filename))
+                item = self.media_index.get(username, media_type, filename)
+                if item is not None:
+                    items.append(item)
+        for item in items:
+            if self._file_exists(username, media_type, item["filename"]):
+                entry = GalleryEntry.from_item(username, media_type, item)
+                self._entries[(username, media_type, entry.filename)] = entry
+                for bucket_key, columns in self._bucket_keys(entry):
+                    bucket = self._buckets.get(bucket_key)
+                    if bucket is None:
+                        bucket = self._buckets[bucket_key] = _SortedKeys(columns)
+                    bucket.add(entry)
+                self._search[media_type].add((username, entry.filename), entry, entry.search_text)
+        self._counts = {}
+        self._searches = {}
+        self.updates += 1
+
+    def _discard(self, key: Tuple[str, str, str]):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._search[entry.media_type].discard((entry.username, entry.filename))
+        for bucket_key, _ in self._bucket_keys(entry):
+            bucket = self._buckets.get(bucket_key)
+            if bucket is not None:
+                bucket.discard(entry)
+                if not len(bucket) and bucket_key[1:] != (None, None):
+                    del self._buckets[bucket_key]
+
+    def refresh_file(self, path: str):
+        """Re-check one file under the downloads folder (watcher entry point)"""
+        rel = os.path.relpath(path, self.downloads_dir)
+        parts = rel.split(os.sep)
+        if len(parts) != 3 or parts[1] not in MEDIA_TYPES or parts[2].startswith(".") or parts[2].endswith(".part"):
+            return
+        self.on_change(parts[0], parts[1], [parts[2]])
+
+    async def watch(self):
+        """Follow files created or deleted outside the app (requires watchfiles)"""
+        if awatch is None:
+            logger.warning("⚠️ [GALLERY] watchfiles is not installed; filesystem watcher disabled")
+            return
+        logger.info(f"👀 [GALLERY] Watching {self.downloads_dir} for changes")
+        async for changes in awatch(self.downloads_dir):
+            for change, path in changes:
+                if change in (Change.added, Change.deleted):
+                    await asyncio.to_thread(self.refresh_file, path)
+
+    # ----- queries -----
+
+    def _plan(
+        self,
+        media_type: str,
+        username: Optional[str] = None,
+        search: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        type_filter: Optional[str] = None,
+        sort_by: str = "date_desc",
+    ) -> _Plan:
+        """Pick the bucket and key range for a query; whatever is left becomes a predicate"""
+        column, descending = SORT_ORDERS.get(sort_by, SORT_ORDERS["date_desc"])
+
+        ts_from = ts_to = None
+        if date_from or date_to:
+            # Dates are compared as integers; files without a date never match
+            ts_from = parse_day(date_from) if date_from else NO_DATE + 1
+            ts_to = parse_day(date_to) + DAY_SECONDS if date_to else None
+
+        residual_type = type_filter
+        if username:
+            bucket = self._buckets.get((media_type, username, None))
+        elif type_filter and column == "date":
+            bucket = self._buckets.get((media_type, None, type_filter))
+            residual_type = None
+        else:
+            bucket = self._buckets.get((media_type, None, None))
+        keys = bucket.columns[column] if bucket is not None else []
+
+        lo, hi = 0, len(keys)
+        residual_from, residual_to = ts_from, ts_to
+        if ts_from is not None and column == "date":
+            lo = bisect_left(keys, (ts_from,))
+            if ts_to is not None:
+                hi = bisect_left(keys, (ts_to,))
+            residual_from = residual_to = None
+
+        needle = search.lower() if search else None
+        index = self._search[media_type]
+        if needle and index.candidates(needle) * SPARSE_SEARCH <= hi - lo:
+            # Few candidates: filter and sort the matches rather than walk the range
+            search_key = (media_type, column, username, type_filter, ts_from, ts_to, needle)
+            keys = self._searches.get(search_key)
+            if keys is None:
+                keys = sorted(
+                    entry.sort_key(column) for entry in index.search(needle)
+                    if (not username or entry.username == username)
+                    and (not type_filter or entry.type == type_filter)
+                    and (ts_from is None or entry.timestamp >= ts_from)
+                    and (ts_to is None or entry.timestamp < ts_to)
+                )
+                self._searches[search_key] = keys
+            return _Plan(media_type, column, descending, keys, 0, len(keys), None)
+
+        checks = []
+        if residual_type:
+            checks.append(lambda entry: entry.type == residual_type)
+        if residual_from is not None:
+            checks.append(lambda entry: entry.timestamp >= residual_from)
+        if residual_to is not None:
+            checks.append(lambda entry: entry.timestamp < residual_to)
+        counter = None
+        if needle:
+            checks.append(lambda entry: needle in entry.search_text)
+            if not (username or type_filter or ts_from is not None):
+                # The search is the only filter: the index counts it faster than a scan
+                counter = lambda: len(index.search(needle))
+
+        predicate = None
+        if len(checks) == 1:
+            predicate = checks[0]
+        elif checks:
+            predicate = lambda entry: all(check(entry) for check in checks)
+        return _Plan(media_type, column, descending, keys, lo, hi, predicate, counter)
+
+    def _entry(self, plan: _Plan, key: Tuple) -> GalleryEntry:
+        return self._entries[(key[-1], plan.media_type, key[-2])]
+
+    def _walk(self, plan: _Plan, start: int) -> Iterator[GalleryEntry]:
+        """Entries from position ``start`` onwards in the plan's direction"""
+        positions = range(start, plan.lo - 1, -1) if plan.descending else range(start, plan.hi)
+        for i in positions:
+            entry = self._entry(plan, plan.keys[i])
+            if plan.predicate is None or plan.predicate(entry):
+                yield entry
+
+    def _first(self, plan: _Plan) -> int:
+        return plan.hi - 1 if plan.descending else plan.lo
+
+    def _count(self, plan: _Plan, filters: Dict) -> int:
+        if plan.predicate is None:
+            return max(plan.hi - plan.lo, 0)
+        count_key = (plan.media_type, tuple(sorted(filters.items())))
+        count = self._counts.get(count_key)
+        if count is None:
+            if plan.counter is not None:
+                count = plan.counter()
+            else:
+                count = sum(1 for _ in self._walk(plan, self._first(plan)))
+            self._counts[count_key] = count
+        return count
+
+    def page(
+        self,
+        media_type: str,
+        offset: int = 0,
+        limit: int = 20,
+        cursor: Optional[str] = None,
+        sort_by: str = "date_desc",
+        **filters,
+    ) -> Tuple[List[GalleryEntry], int, Optional[str]]:
+        """One page of entries, the total number of matches and the cursor of the next page
+
+        With a cursor the page starts right after the key it encodes, found
+        by bisection; otherwise it starts ``offset`` matches in.
+        """
+        self._ensure_built()
+        with self._lock:
+            plan = self._plan(media_type, sort_by=sort_by, **filters)
+            offset = max(offset, 0)
+            skip = 0
+            if cursor:
+                after = decode_cursor(cursor, plan.column)
+                if plan.descending:
+                    start = min(plan.hi, bisect_left(plan.keys, after)) - 1
+                else:
+                    start = max(plan.lo, bisect_right(plan.keys, after))
+            elif plan.predicate is None:
+                start = plan.hi - 1 - offset if plan.descending else plan.lo + offset
+            else:
+                start = self._first(plan)
+                skip = offset
+
+            entries = []
+            for entry in self._walk(plan, start):
+                if skip:
+                    skip -= 1
+                    continue
+                entries.append(entry)
+                if len(entries) > limit:
+                    break
+
+            next_cursor = None
+            if len(entries) > limit:
+                entries = entries[:limit]
+                next_cursor = encode_cursor(plan.column, entries[-1].sort_key(plan.column))
+            return entries, self._count(plan, filters), next_cursor
+
+    def select(self, media_type: str, sort_by: str = "date_desc", **filters) -> List[GalleryEntry]:
+        """Every matching entry, in order"""
+        self._ensure_built()
+        with self._lock:
+            plan = self._plan(media_type, sort_by=sort_by, **filters)
+            return list(self._walk(plan, self._first(plan)))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "items": len(self._entries),
+                "by_media_type": {
+                    media_type: len(self._buckets.get((media_type, None, None)) or ())
+                    for media_type in MEDIA_TYPES
+                },
+                "buckets": len(self._buckets),
+                "cached_counts": len(self._counts),
+                "cached_searches": len(self._searches),
+                "search": {media_type: index.stats() for media_type, index in self._search.items()},
+                "rebuilds": self.rebuilds,
+                "updates": self.updates,
+            }
@@ -2,7 +2,7 @@
 from fastapi import FastAPI, HTTPException, BackgroundTasks, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, Response, StreamingResponse
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 import os
@@ -12,7 +12,6 @@ import math
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 from threading import Lock
-import zipfile
 import tempfile
 from loguru import logger
 import sys
@@ -39,6 +38,10 @@ logger.add(
 import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 from snapchat_dl.snapchat_dl import SnapchatDL, NoStoriesFound
+from snapchat_dl.filelock import LOCK_DIR
+from snapchat_dl.media_index import INDEX_FILE
+from snapchat_dl.media_store import BLOB_DIR, disk_usage
+from snapchat_dl.downloader import PART_SUFFIX
 from dotenv import load_dotenv
 import json
 import logging
@@ -46,7 +49,6 @@ import sys
 import aiofiles
 import traceback
 import shutil
-from io import BytesIO
 import aiohttp
 from aiohttp import ClientSession
 import re
@@ -73,6 +75,11 @@ import random
 # Import our new modules
 from server.telegram_manager import TelegramManager, generate_telegram_caption, generate_bulk_caption
 from server.supabase_manager import SnapchatSupabaseManager
+from server.gallery_index import GalleryIndex, InvalidCursor, MEDIA_TYPES
+from server.thumbnails import ThumbnailService, is_video, file_etag, IMMUTABLE_CACHE_CONTROL
+from server.zipstream import ZipStream, parse_range
+from server.storage_accounting import StorageAccounting
+from server.dedup_store import DedupStore
 import re
 
 # Load environment variables from the server directory
@@ -360,14 +367,12 @@ class HealthCheck:
     async def get_directory_size(self, directory: str) -> float:
         """Get directory size in MB"""
         try:
-            total_size = 0
-            for root, dirs, files in os.walk(directory):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    try:
-                        total_size += os.path.getsize(file_path)
-                    except (OSError, FileNotFoundError):
-                        pass  # Skip files that can't be accessed
+            if os.path.abspath(directory) == storage_accounting.downloads_dir:
+                # Running counters; checks before the first walk completes wait for it
+                await asyncio.to_thread(storage_accounting.ensure_ready)
+                return storage_accounting.total_bytes / (1024 * 1024)
+            # Hardlinked media shares one inode; count its bytes once
+            total_size, _ = disk_usage(directory)
             return total_size / (1024 * 1024)  # Convert bytes to MB
         except Exception as e:
             logger.error(f"Failed to get directory size: {e}")
@@ -415,6 +420,10 @@ class HealthCheck:
             users_affected = set()
             
             for root, dirs, files in os.walk(DOWNLOADS_DIR):
+                # Stored media blobs are released by prune() once nothing links to them;
+                # lock files are a fixed set that must outlive any single cleanup
+                dirs[:] = [d for d in dirs if d not in (BLOB_DIR, LOCK_DIR)]
+                
                 # Extract username and media_type from path structure: downloads/{username}/{media_type}/
                 path_parts = os.path.normpath(root).split(os.sep)
                 if len(path_parts) >= 2 and path_parts[-2] in ["stories", "highlights", "spotlights"]:
@@ -424,19 +433,26 @@ class HealthCheck:
                         users_affected.add((username, media_type))
                 
                 for file in files:
-                    # Skip metadata files
-                    if file == ".media_metadata.json":
+                    # Skip metadata files and the media index database
+                    if file == ".media_metadata.json" or file.startswith(INDEX_FILE):
                         continue
                     file_path = os.path.join(root, file)
                     try:
-                        if os.path.getmtime(file_path) < cutoff_time:
-                            file_size = os.path.getsize(file_path)
+                        st = os.stat(file_path)
+                        if st.st_mtime < cutoff_time:
                             os.remove(file_path)
+                            storage_accounting.discard(file_path)
                             removed_count += 1
-                            freed_bytes += file_size
+                            # Hardlinked media is only freed with its last link (see prune below)
+                            if st.st_nlink <= 1:
+                                freed_bytes += st.st_size
                     except Exception:
                         pass
             
+            # Release stored media no user folder links to any more
+            _, pruned_bytes = snapchat_client.media_store.prune(on_remove=storage_accounting.discard)
+            freed_bytes += pruned_bytes
+            
             # Sync metadata for all affected users/media types
             metadata_removed = 0
             for username, media_type in users_affected:
@@ -458,6 +474,10 @@ class HealthCheck:
             users_affected = set()
             
             for root, dirs, files in os.walk(DOWNLOADS_DIR):
+                # Stored media blobs are released by prune() once nothing links to them;
+                # lock files are a fixed set that must outlive any single cleanup
+                dirs[:] = [d for d in dirs if d not in (BLOB_DIR, LOCK_DIR)]
+                
                 # Extract username and media_type from path structure: downloads/{username}/{media_type}/
                 path_parts = os.path.normpath(root).split(os.sep)
                 if len(path_parts) >= 2 and path_parts[-2] in ["stories", "highlights", "spotlights"]:
@@ -467,16 +487,19 @@ class HealthCheck:
                         users_affected.add((username, media_type))
                 
                 for file in files:
-                    # Skip metadata files
-                    if file == ".media_metadata.json":
+                    # Skip metadata files and the media index database
+                    if file == ".media_metadata.json" or file.startswith(INDEX_FILE):
                         continue
                     file_path = os.path.join(root, file)
                     try:
-                        if os.path.getmtime(file_path) < cutoff_time:
-                            file_size = os.path.getsize(file_path)
+                        st = os.stat(file_path)
+                        if st.st_mtime < cutoff_time:
                             os.remove(file_path)
+                            storage_accounting.discard(file_path)
                             removed_count += 1
-                            freed_bytes += file_size
+                            # Hardlinked media is only freed with its last link (see prune below)
+                            if st.st_nlink <= 1:
+                                freed_bytes += st.st_size
                     except Exception:
                         pass  # Skip files that can't be removed
                 
@@ -489,6 +512,10 @@ class HealthCheck:
                     except Exception:
                         pass
             
+            # Release stored media no user folder links to any more
+            _, pruned_bytes = snapchat_client.media_store.prune(on_remove=storage_accounting.discard)
+            freed_bytes += pruned_bytes
+            
             # Sync metadata for all affected users/media types
             metadata_removed = 0
             for username, media_type in users_affected:
@@ -505,17 +532,10 @@ class HealthCheck:
         try:
             logger.info("📊 [DISK] Analyzing application disk usage...")
             
-            # Check downloads directory
-            downloads_size = sum(
-                os.path.getsize(os.path.join(root, file))
-                for root, dirs, files in os.walk(DOWNLOADS_DIR)
-                for file in files
-            ) / (1024 * 1024)  # Convert to MB
-            
-            downloads_count = sum(
-                len(files)
-                for root, dirs, files in os.walk(DOWNLOADS_DIR)
-            )
+            # Check downloads directory (each stored media file counted once)
+            await asyncio.to_thread(storage_accounting.ensure_ready)
+            downloads_bytes, downloads_count = storage_accounting.total_bytes, storage_accounting.total_files
+            downloads_size = downloads_bytes / (1024 * 1024)  # Convert to MB
             
             logger.info(f"📊 [DISK] Downloads folder: {downloads_count} files, {downloads_size:.1f} MB")
             logger.info(f"📊 [DISK] Downloads path: {DOWNLOADS_DIR}")
@@ -598,6 +618,10 @@ class HealthCheck:
             users_affected = set()
             
             for root, dirs, files in os.walk(DOWNLOADS_DIR):
+                # Stored media blobs are released by prune() once nothing links to them;
+                # lock files are a fixed set that must outlive any single cleanup
+                dirs[:] = [d for d in dirs if d not in (BLOB_DIR, LOCK_DIR)]
+                
                 # Extract username and media_type from path structure: downloads/{username}/{media_type}/
                 path_parts = os.path.normpath(root).split(os.sep)
                 if len(path_parts) >= 2 and path_parts[-2] in ["stories", "highlights", "spotlights"]:
@@ -607,12 +631,13 @@ class HealthCheck:
                         users_affected.add((username, media_type))
                 
                 for file in files:
-                    # Skip metadata files
-                    if file == ".media_metadata.json":
+                    # Skip metadata files and the media index database
+                    if file == ".media_metadata.json" or file.startswith(INDEX_FILE):
                         continue
                     file_path = os.path.join(root, file)
                     if os.path.getmtime(file_path) < cutoff_time:
                         os.remove(file_path)
+                        storage_accounting.discard(file_path)
                         removed_count += 1
                 
                 # Remove empty directories
@@ -624,12 +649,15 @@ class HealthCheck:
                     except OSError:
                         pass  # Directory not empty or other error
             
+            # Release stored media no user folder links to any more
+            blobs_removed, _ = snapchat_client.media_store.prune(on_remove=storage_accounting.discard)
+            
             # Sync metadata for all affected users/media types
             metadata_removed = 0
             for username, media_type in users_affected:
                 metadata_removed += sync_metadata_with_files(username, media_type)
             
-            logger.info(f"🧹 2-week downloads cleanup: {removed_count} files removed, {metadata_removed} metadata entries synced")
+            logger.info(f"🧹 2-week downloads cleanup: {removed_count} files removed, {blobs_removed} stored blobs released, {metadata_removed} metadata entries synced")
             return removed_count
         except Exception as e:
             logger.error(f"2-week downloads cleanup failed: {e}")
@@ -638,6 +666,8 @@ class HealthCheck:
     async def cleanup_snapchat_cache(self):
         """Clean up Snapchat cache (2-week complete wipe)"""
         try:
+            local_result = dedup_store.expire(datetime.now() - timedelta(days=14))
+            logger.info(f"🧹 Snapchat local dedup cleanup: {local_result}")
             if supabase_manager.is_connected:
                 # Use Supabase cleanup
                 cleanup_result = await supabase_manager.clean_expired_snapchat_cache()
@@ -716,6 +746,20 @@ health_check = HealthCheck()
 # Initialize Supabase manager
 supabase_manager = SnapchatSupabaseManager()
 
+# Local service state, kept out of the source tree and out of DOWNLOADS_DIR
+# (which cleanup wipes); STATE_DIR should point at a persistent disk when there is one
+STATE_DIR = os.getenv("STATE_DIR", os.path.join(
+    os.getenv("XDG_STATE_HOME", os.path.join(os.path.expanduser("~"), ".local", "state")),
+    "snapchat-service",
+))
+
+# Processed snap_ids and recent-stories caches live locally and are synced to
+# Supabase in the background, so dedup keeps working while Supabase is down
+dedup_store = DedupStore(os.getenv(
+    "DEDUP_DB_PATH",
+    os.path.join(STATE_DIR, f"snapchat_dedup_{supabase_manager.project_namespace}.db")
+))
+
 # ===== SNAPCHAT CACHING FUNCTIONS =====
 
 def extract_snap_id_from_url(story_url: str) -> Optional[str]:
@@ -821,14 +865,11 @@ async def load_existing_cache():
             
             try:
                 # Get cache statistics to check cache status
-                cache_stats = supabase_manager.get_snapchat_cache_stats()
+                cache_stats = await supabase_manager.get_snapchat_cache_stats()
                 logger.info(f"📊 Supabase cache stats: {cache_stats}")
                 
-                # Get all cached usernames from Supabase
-                response = supabase_manager.client.table("snapchat_recent_stories_cache").select("username").order("username").execute()
-                
-                cached_users = response.data
-                unique_usernames = list(set([user['username'] for user in cached_users]))
+                # Get all cached usernames from Supabase (one row per user)
+                unique_usernames = await supabase_manager.get_cached_usernames()
                 logger.info(f"📊 Found {len(unique_usernames)} cached users in Supabase")
                 
                 if len(unique_usernames) == 0:
@@ -848,79 +889,63 @@ async def load_existing_cache():
         logger.info("✅ Cache system initialized (first run)")
 
 async def get_cached_recent_stories(username: str) -> List[Dict[str, Any]]:
-    """Get cached stories for a username (directly from Supabase - no memory cache)"""
+    """Get cached stories for a username (local dedup store, seeded from Supabase on first use)"""
     try:
         logger.info(f"📊 [CACHE] Getting cached stories for @{username}...")
         
-        # Use Supabase as single source of truth
-        if supabase_manager.is_connected:
+        cached_stories = dedup_store.recent_stories(username)
+        if cached_stories is None and supabase_manager.is_connected:
             try:
-                logger.info(f"📊 [CACHE] Fetching from Supabase for @{username}...")
-                cached_stories = await supabase_manager.get_cached_recent_stories(username)
-                
-                # Normalize cached stories to ensure proper structure
-                normalized_stories = []
-                for story in cached_stories:
-                    normalized_story = normalize_story_structure(story)
-                    if normalized_story:  # Only add if normalization succeeded
-                        normalized_stories.append(normalized_story)
-                
-                logger.info(f"✅ [CACHE] Retrieved {len(normalized_stories)} stories from Supabase for @{username}")
-                return normalized_stories
+                logger.info(f"📊 [CACHE] Not cached locally, fetching from Supabase for @{username}...")
+                remote_stories = await supabase_manager.get_cached_recent_stories(username)
+                if supabase_manager.is_connected:
+                    dedup_store.set_recent_stories(username, remote_stories, dirty=False)
+                cached_stories = remote_stories
             except Exception as error:
                 logger.error(f"❌ [CACHE] Supabase cache retrieval failed: {error}")
-                logger.info(f"📊 [CACHE] No cached stories found for @{username}")
-                return []
         
-        logger.info(f"📊 [CACHE] No cached stories found for @{username}")
-        return []
+        if not cached_stories:
+            logger.info(f"📊 [CACHE] No cached stories found for @{username}")
+            return []
+        
+        # Normalize cached stories to ensure proper structure
+        normalized_stories = []
+        for story in cached_stories:
+            normalized_story = normalize_story_structure({**story, "url": story.get("story_url", ""), "type": story.get("story_type", "photo")})
+            if normalized_story:  # Only add if normalization succeeded
+                normalized_stories.append(normalized_story)
+        
+        logger.info(f"✅ [CACHE] Retrieved {len(normalized_stories)} cached stories for @{username}")
+        return normalized_stories
         
     except Exception as error:
         logger.error(f"❌ [CACHE] Failed to get cached stories for @{username}: {error}")
         return []
 
 async def update_stories_cache(username: str, stories: List[Dict[str, Any]]) -> bool:
-    """Update cache with new stories (directly to Supabase - no memory cache)"""
+    """Update cache with new stories (written locally, synced to Supabase in the background)"""
     try:
-        # Use Supabase as single source of truth
-        if supabase_manager.is_connected:
-            success = await supabase_manager.update_recent_stories_cache(username, stories)
-            return success
-        else:
-            logger.warning(f"⚠️ [CACHE] Supabase not connected - cannot update cache for @{username}")
-            return False
+        dedup_store.set_recent_stories(username, stories)
+        return True
         
     except Exception as error:
         logger.error(f"❌ Failed to update stories cache for @{username}: {error}")
         return False
 
 async def is_story_processed(snap_id: str, username: str) -> bool:
-    """Check if a story has been processed (with memory cache optimization)"""
+    """Check if a story has been processed (answered from the local dedup store)"""
     try:
-        # Use Supabase for caching
-        if supabase_manager.is_connected:
-            return await supabase_manager.is_story_processed(snap_id, username)
-        else:
-            logger.warning(f"⚠️ [CACHE] Supabase not connected - cannot check if story is processed")
-            return False
-        
-        return False
+        return dedup_store.is_processed(snap_id, username)
         
     except Exception as error:
         logger.error(f"❌ Failed to check if story is processed: {error}")
         return False
 
 async def mark_story_processed(snap_id: str, username: str, story_url: str, story_type: str) -> bool:
-    """Mark a story as processed (with memory cache optimization)"""
+    """Mark a story as processed (written locally, synced to Supabase in the background)"""
     try:
-        # Use Supabase for caching
-        if supabase_manager.is_connected:
-            return await supabase_manager.mark_story_processed(snap_id, username, story_url, story_type)
-        else:
-            logger.warning(f"⚠️ [CACHE] Supabase not connected - cannot mark story as processed")
-            return False
-        
-        return False
+        dedup_store.mark_processed(snap_id, username, story_url, story_type)
+        return True
         
     except Exception as error:
         logger.error(f"❌ Failed to mark story as processed: {error}")
@@ -1010,27 +1035,12 @@ class ResourceManager:
                 logger.error(f"Failed to get memory usage: {e}")
                 stats["memory_usage"] = {"error": str(e)}
             
-            # Get downloads directory size (not system disk)
+            # Get downloads directory size (not system disk) from the running counters
             try:
-                if os.path.exists(DOWNLOADS_DIR):
-                    total_size = 0
-                    file_count = 0
-                    for root, dirs, files in os.walk(DOWNLOADS_DIR):
-                        for file in files:
-                            try:
-                                total_size += os.path.getsize(os.path.join(root, file))
-                                file_count += 1
-                            except (OSError, FileNotFoundError):
-                                pass
-                    
-                    stats["downloads_directory"] = {
-                        "size_bytes": total_size,
-                        "size_mb": round(total_size / (1024 * 1024), 2),
-                        "file_count": file_count,
-                        "path": DOWNLOADS_DIR
-                    }
-                else:
-                    stats["downloads_directory"] = {"error": "downloads directory not found"}
+                stats["downloads_directory"] = {
+                    **storage_accounting.totals(),
+                    "path": DOWNLOADS_DIR
+                }
             except Exception as e:
                 logger.error(f"Failed to get downloads directory size: {e}")
                 stats["downloads_directory"] = {"error": str(e)}
@@ -1092,6 +1102,27 @@ os.makedirs(DOWNLOADS_DIR, exist_ok=True)
 logger.info(f"Using downloads directory: {DOWNLOADS_DIR}")
 app.mount("/downloads", StaticFiles(directory=DOWNLOADS_DIR), name="downloads")
 
+# Shared Snapchat client - one pooled HTTP session (keep-alive + DNS cache) for
+# polling, manual downloads and debug endpoints. Closed in graceful_shutdown().
+snapchat_client = SnapchatDL(directory_prefix=DOWNLOADS_DIR, max_workers=8)
+
+# Gallery pages are served from memory; media index changes keep it current
+gallery_index = GalleryIndex(snapchat_client.media_index, DOWNLOADS_DIR)
+
+# Thumbnails are cached under .thumbnails/ and rendered in worker processes,
+# pre-generated as soon as a download completes
+thumbnail_service = ThumbnailService(
+    DOWNLOADS_DIR,
+    snapchat_client.media_index,
+    workers=int(os.getenv("THUMBNAIL_WORKERS", "2")),
+    widths=[int(width) for width in os.getenv("THUMBNAIL_WIDTHS", "160,320,640").split(",")],
+    image_format=os.getenv("THUMBNAIL_FORMAT", "webp").lower(),
+)
+
+# Running byte/file counters for the downloads folder, kept current by media
+# index changes and cleanups and reconciled by a periodic background walk
+storage_accounting = StorageAccounting(DOWNLOADS_DIR, snapchat_client.media_index)
+
 # Telegram configuration
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 TELEGRAM_CHANNEL_ID = os.getenv("TELEGRAM_CHANNEL_ID")
@@ -1161,6 +1192,7 @@ class GalleryMediaItem(BaseModel):
     progress: Optional[int]
     download_url: Optional[str] = None
     username: Optional[str] = None  # Add username field
+    thumbnail_srcset: Optional[str] = None  # Width presets of the thumbnail, for <img srcset>
 
 class FilenameItem(BaseModel):
     filename: str
@@ -1228,6 +1260,7 @@ class PaginationInfo(BaseModel):
     total_pages: int
     has_next: bool
     has_prev: bool
+    next_cursor: Optional[str] = None
 
 class GalleryResponse(BaseModel):
     status: str
@@ -1425,7 +1458,19 @@ async def health_check_endpoint():
 async def get_stats():
     """Get resource statistics"""
     try:
-        return resource_manager.get_stats()
+        stats = resource_manager.get_stats()
+        stats["profile_cache"] = snapchat_client.profile_cache.stats()
+        stats["profile_fetches"] = snapchat_client.profile_fetches.stats()
+        stats["media_store"] = snapchat_client.media_store.stats()
+        stats["media_index"] = snapchat_client.media_index.stats()
+        stats["locks"] = snapchat_client.locks.stats()
+        stats["gallery_index"] = gallery_index.stats()
+        stats["thumbnails"] = thumbnail_service.stats()
+        stats["storage"] = storage_accounting.stats()
+        stats["dedup_store"] = dedup_store.stats()
+        if supabase_manager.client is not None:
+            stats["supabase"] = supabase_manager.client.stats()
+        return stats
     except Exception as e:
         logger.error(f"Stats endpoint error: {e}")
         return JSONResponse(
@@ -1512,7 +1557,7 @@ async def gallery_websocket(websocket: WebSocket, media_type: str):
 @app.post("/download", response_model=DownloadResponse)
 async def download_content(request: DownloadRequest, background_tasks: BackgroundTasks):
     try:
-        snapchat = SnapchatDL(directory_prefix=DOWNLOADS_DIR, max_workers=8)
+        snapchat = snapchat_client
         key = f"{request.username}:{request.download_type}"
         
         # Initialize progress data
@@ -1570,59 +1615,45 @@ async def download_content(request: DownloadRequest, background_tasks: Backgroun
         try:
             logger.info(f"🔍 [MANUAL] Starting direct download for {request.username} ({request.download_type})")
             
-            # Create SnapchatDL instance for fetching
-            snapchat = SnapchatDL(max_workers=8)
+            # Use the shared SnapchatDL instance for fetching
+            snapchat = snapchat_client
+            
+            # Fetch the profile once; every collection comes from the same snapshot
+            collections = {
+                "stories": ["stories"],
+                "highlights": ["highlights"],
+                "spotlights": ["spotlights"],
+                "all": ["stories", "highlights", "spotlights"],
+            }.get(request.download_type)
+            if collections is None:
+                return DownloadResponse(
+                    status="error",
+                    message="Invalid download type selected.",
+                    media_urls=None
+                )
+            
+            snapshot = await snapchat.fetch_profile(request.username)
+            snaps = {
+                "stories": snapshot.stories,
+                "highlights": snapshot.highlight_snaps,
+                "spotlights": snapshot.spotlight_snaps,
+            }
             
-            # Fetch stories based on type
             stories_to_send = []
-            if request.download_type == "stories":
-                async for story, user_info in snapchat._web_fetch_story(request.username):
+            for collection in collections:
+                for snap in snaps[collection]:
                     # Snapchat returns: 0 = photo, 1 = video
-                    media_type = story["snapMediaType"]
+                    media_type = snap["snapMediaType"]
                     is_video = (media_type == 1 or str(media_type).upper() == "VIDEO")
                     
                     story_data = {
-                        'url': story["snapUrls"]["mediaUrl"],
+                        'url': snap["snapUrls"]["mediaUrl"],
                         'type': 'video' if is_video else 'photo',
-                        'snap_id': story["snapId"]["value"],
-                        'timestamp': story["timestampInSec"]["value"]
+                        'snap_id': snap["snapId"]["value"],
+                        'timestamp': snap["timestampInSec"]["value"]
                     }
                     stories_to_send.append(story_data)
                     logger.info(f"🔍 [MANUAL] Found {story_data['type']}: {story_data['snap_id']} (snapMediaType={media_type})")
-            elif request.download_type == "highlights":
-                async for highlight, user_info in snapchat._web_fetch_highlight(request.username):
-                    # Snapchat returns: 0 = photo, 1 = video
-                    media_type = highlight["snapMediaType"]
-                    is_video = (media_type == 1 or str(media_type).upper() == "VIDEO")
-                    
-                    story_data = {
-                        'url': highlight["snapUrls"]["mediaUrl"],
-                        'type': 'video' if is_video else 'photo',
-                        'snap_id': highlight["snapId"]["value"],
-                        'timestamp': highlight["timestampInSec"]["value"]
-                    }
-                    stories_to_send.append(story_data)
-                    logger.info(f"🔍 [MANUAL] Found {story_data['type']}: {story_data['snap_id']} (snapMediaType={media_type})")
-            elif request.download_type == "spotlights":
-                async for spotlight, user_info in snapchat._web_fetch_spotlight(request.username):
-                    # Snapchat returns: 0 = photo, 1 = video
-                    media_type = spotlight["snapMediaType"]
-                    is_video = (media_type == 1 or str(media_type).upper() == "VIDEO")
-                    
-                    story_data = {
-                        'url': spotlight["snapUrls"]["mediaUrl"],
-                        'type': 'video' if is_video else 'photo',
-                        'snap_id': spotlight["snapId"]["value"],
-                        'timestamp': spotlight["timestampInSec"]["value"]
-                    }
-                    stories_to_send.append(story_data)
-                    logger.info(f"🔍 [MANUAL] Found {story_data['type']}: {story_data['snap_id']} (snapMediaType={media_type})")
-            else:
-                return DownloadResponse(
-                    status="error",
-                    message="Invalid download type selected.",
-                    media_urls=None
-                )
             
             if not stories_to_send:
                 raise NoStoriesFound(f"No {request.download_type} found for {request.username}")
@@ -1752,10 +1783,10 @@ async def send_downloaded_content_to_telegram(username: str, media_type: str, cu
             logger.info(f"📤 [AUTO] Sending {len(media_files)} NEW files to Telegram for {username}/{media_type}")
         else:
             # Backward compatibility: send all files if no specific list provided
-        media_files = []
-        for filename in os.listdir(media_dir):
-            if filename.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.mp4', '.mov', '.avi')):
-                media_files.append(filename)
+            media_files = []
+            for filename in os.listdir(media_dir):
+                if filename.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.mp4', '.mov', '.avi')):
+                    media_files.append(filename)
             logger.info(f"📤 [AUTO] Sending {len(media_files)} files to Telegram for {username}/{media_type} (all files mode)")
         
         if not media_files:
@@ -1808,19 +1839,18 @@ async def schedule_download(request: ScheduleRequest):
         job_id = f"{request.username}_{datetime.now().timestamp()}"
         
         async def download_job():
-            snapchat = SnapchatDL(directory_prefix=DOWNLOADS_DIR, max_workers=8)
-            media_urls = []
+            snapchat = snapchat_client
+            # One profile fetch per run, shared by every collection
+            snapshot = await snapchat.fetch_profile(request.username)
             
             if request.download_type in ["all", "stories"]:
-                stories = await snapchat.get_stories(request.username)
-                media_urls.extend(stories)
+                await snapchat.download(request.username, snapshot=snapshot)
                 
             if request.download_type in ["all", "highlights"]:
-                highlights = await snapchat.get_highlights(request.username)
-                media_urls.extend(highlights)
+                await snapchat.download_highlights(request.username, snapshot=snapshot)
                 
-            if media_urls:
-                await snapchat.download_media(media_urls)
+            if request.download_type in ["all", "spotlights"]:
+                await snapchat.download_spotlights(request.username, snapshot=snapshot)
         
         scheduler.add_job(
             download_job,
@@ -1842,6 +1872,13 @@ async def schedule_download(request: ScheduleRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.delete("/download/{username}/{media_type}")
+async def cancel_download(username: str, media_type: str, filename: Optional[str] = None):
+    """Cancel running downloads for a user's media type, or a single file"""
+    cancelled = snapchat_client.cancel_download(username, media_type, filename)
+    logger.info(f"🛑 [DOWNLOAD] Cancelled {cancelled} download(s) for {username}/{media_type}")
+    return {"status": "success", "cancelled": cancelled}
+
 @app.get("/scheduled")
 async def get_scheduled_downloads():
     return scheduled_downloads
@@ -1856,21 +1893,11 @@ async def remove_scheduled_download(job_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-def get_metadata_path(username, media_type):
-    return os.path.join(DOWNLOADS_DIR, username, media_type, ".media_metadata.json")
-
 def load_media_metadata(username, media_type):
-    path = get_metadata_path(username, media_type)
-    if os.path.exists(path):
-        with open(path, "r") as f:
-            return json.load(f)
-    return []
+    return snapchat_client.media_index.items(username, media_type)
 
 def save_media_metadata(username, media_type, metadata):
-    path = get_metadata_path(username, media_type)
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "w") as f:
-        json.dump(metadata, f)
+    snapchat_client.media_index.replace(username, media_type, metadata)
 
 def sync_metadata_with_files(username, media_type):
     """
@@ -1879,32 +1906,29 @@ def sync_metadata_with_files(username, media_type):
     Returns number of entries removed.
     """
     try:
-    metadata = load_media_metadata(username, media_type)
+        metadata = load_media_metadata(username, media_type)
         if not metadata:
             return 0
         
         media_dir = os.path.join(DOWNLOADS_DIR, username, media_type)
         if not os.path.exists(media_dir):
             # Directory doesn't exist - clear all metadata
-            save_media_metadata(username, media_type, [])
-            return len(metadata)
+            return snapchat_client.media_index.remove(username, media_type)
         
-        # Filter metadata to only include files that actually exist
-        synced_metadata = []
-        removed_count = 0
-    
-    for item in metadata:
+        # Find entries whose files no longer exist
+        missing = []
+        for item in metadata:
             filename = item.get("filename")
             if filename:
                 file_path = os.path.join(media_dir, filename)
-                if os.path.exists(file_path):
-                    synced_metadata.append(item)
-                else:
-                    removed_count += 1
+                # A .part file means the download is still running or will be resumed
+                if not (os.path.exists(file_path) or os.path.exists(f"{file_path}.part")):
+                    missing.append(filename)
         
-        # Save synced metadata (removed entries for missing files)
-        if len(synced_metadata) != len(metadata):
-            save_media_metadata(username, media_type, synced_metadata)
+        # Drop only the rows for missing files
+        removed_count = 0
+        if missing:
+            removed_count = snapchat_client.media_index.remove(username, media_type, missing)
             logger.info(f"🔄 [METADATA SYNC] Removed {removed_count} entries for missing files in {username}/{media_type}")
         
         return removed_count
@@ -1913,20 +1937,41 @@ def sync_metadata_with_files(username, media_type):
         return 0
 
 
+def zip_stream_response(archive: ZipStream, download_name: str, http_request: Request):
+    """Stream a ZIP archive, honouring Range/If-Range when its size is known up front"""
+    headers = {"Content-Disposition": f"attachment; filename={download_name}"}
+    if archive.missing:
+        logger.warning(f"⚠️ [ZIP] {len(archive.missing)} selected files not found, skipped: {archive.missing[:5]}")
+    if archive.size is None:
+        # Deflated entries: the length is only known once streamed
+        return StreamingResponse(archive.chunks(), media_type="application/zip", headers=headers)
+    
+    headers["Accept-Ranges"] = "bytes"
+    headers["ETag"] = archive.etag
+    byte_range = None
+    if http_request.headers.get("if-range", archive.etag) == archive.etag:
+        try:
+            byte_range = parse_range(http_request.headers.get("range"), archive.size)
+        except ValueError:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{archive.size}"})
+    if byte_range is None:
+        headers["Content-Length"] = str(archive.size)
+        return StreamingResponse(archive.chunks(), media_type="application/zip", headers=headers)
+    
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end - 1}/{archive.size}"
+    headers["Content-Length"] = str(end - start)
+    return StreamingResponse(archive.chunks(start, end), status_code=206, media_type="application/zip", headers=headers)
+
 @app.post("/bulk-download/{username}/{media_type}")
-def bulk_download(username: str, media_type: str, request: BulkDownloadRequest):
+def bulk_download(username: str, media_type: str, request: BulkDownloadRequest, http_request: Request):
     if media_type not in ["stories", "highlights", "spotlights"]:
         raise HTTPException(status_code=400, detail="Invalid media type")
     dir_name = os.path.join(DOWNLOADS_DIR, username, media_type)
     if not os.path.exists(dir_name):
         raise HTTPException(status_code=404, detail="No files found")
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".zip") as temp_zip:
-        with zipfile.ZipFile(temp_zip.name, 'w') as zipf:
-            for file in request.files:
-                file_path = os.path.join(dir_name, file)
-                if os.path.exists(file_path):
-                    zipf.write(file_path, file)
-    return FileResponse(temp_zip.name, media_type="application/zip", filename=f"{username}_{media_type}.zip")
+    archive = ZipStream((os.path.join(dir_name, file), file) for file in request.files)
+    return zip_stream_response(archive, f"{username}_{media_type}.zip", http_request)
 
 # Add a new endpoint to get WebSocket connection stats
 @app.get("/ws/stats/{username}/{media_type}")
@@ -1977,17 +2022,52 @@ async def update_progress(username: str, media_type: str, filename: str, progres
     # Broadcast update to all connected clients
     await websocket_manager.broadcast(key, current_progress)
 
+def _wipe_media_folder(username: str, media_type: str, folder: str):
+    """Delete a media folder except its .part files, dropping the index rows of what was deleted"""
+    kept = set()
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        if name.endswith(PART_SUFFIX) and os.path.isfile(path):
+            kept.add(name[:-len(PART_SUFFIX)])
+        elif os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    try:
+        indexed = snapchat_client.media_index.filenames(username, media_type)
+        snapchat_client.media_index.remove(username, media_type, indexed - kept)
+    except Exception as e:
+        logger.error(f"Error dropping index rows for {username}/{media_type}: {e}")
+    if not kept:
+        os.rmdir(folder)
+
 def cleanup_downloads():
-    """Clean up the downloads directory."""
+    """Clean up the downloads directory.
+
+    Completed media, thumbnails and their index rows are removed. The media
+    index, blob store, lock files and the .part files of interrupted downloads
+    are kept so startup recovery can resume them instead of starting over.
+    """
     try:
         if os.path.exists(DOWNLOADS_DIR):
             # Delete contents of the directory
             for item in os.listdir(DOWNLOADS_DIR):
                 item_path = os.path.join(DOWNLOADS_DIR, item)
+                if item in (BLOB_DIR, LOCK_DIR) or item.startswith(INDEX_FILE):
+                    continue
                 if os.path.isfile(item_path):
                     os.remove(item_path)
                 elif os.path.isdir(item_path):
-                    shutil.rmtree(item_path)
+                    for media_type in os.listdir(item_path):
+                        media_path = os.path.join(item_path, media_type)
+                        if media_type in MEDIA_TYPES and os.path.isdir(media_path):
+                            _wipe_media_folder(item, media_type, media_path)
+                        elif os.path.isdir(media_path):
+                            shutil.rmtree(media_path)
+                        else:
+                            os.remove(media_path)
+                    if not os.listdir(item_path):
+                        os.rmdir(item_path)
             logger.info("Cleaned up downloads directory contents")
     except Exception as e:
         logger.error(f"Error cleaning up downloads directory: {e}")
@@ -2490,7 +2570,7 @@ async def get_cache_stats():
         
         # Get Supabase cache stats if connected
         if supabase_manager and supabase_manager.is_connected:
-            supabase_stats = supabase_manager.get_snapchat_cache_stats()
+            supabase_stats = await supabase_manager.get_snapchat_cache_stats()
             stats["supabase"].update(supabase_stats)
         
         return stats
@@ -2514,13 +2594,11 @@ async def get_cache_status():
                 "count": len(cached_stories),
                 "stories": cached_stories[:5] if cached_stories else []  # First 5 stories for preview
             },
-            "memory_cache": {
-                "removed": "Memory cache removed - using Supabase only"
-            },
+            "local_cache": dedup_store.stats(),
             "cache_system": {
                 "supabase_connected": supabase_manager.is_connected if supabase_manager else False,
-                "sqlite_connected": False,
-                "memory_cache_enabled": False
+                "sqlite_connected": True,
+                "memory_cache_enabled": True
             }
         }
         
@@ -2537,10 +2615,7 @@ async def get_targeted_usernames():
         # Get usernames from Supabase if connected
         if supabase_manager and supabase_manager.is_connected:
             try:
-                response = supabase_manager.client.table("snapchat_recent_stories_cache").select("username").execute()
-                if response.data:
-                    supabase_usernames = list(set([user['username'] for user in response.data]))
-                    usernames.extend(supabase_usernames)
+                usernames.extend(await supabase_manager.get_cached_usernames())
             except Exception as error:
                 logger.warning(f"Failed to get usernames from Supabase: {error}")
         
@@ -2665,8 +2740,8 @@ async def check_for_new_stories(force=False):
         else:
             logger.warning("⚠️ [CACHE] Supabase connection is not available, using fallback")
         
-        # Use existing Snapchat downloader to get stories
-        snapchat_dl = SnapchatDL(max_workers=8)
+        # Use the shared Snapchat downloader to get stories
+        snapchat_dl = snapchat_client
         
         try:
             # Fetch stories without downloading (same as manual)
@@ -2708,7 +2783,7 @@ async def check_for_new_stories(force=False):
         
         if len(new_stories) == 0 and not force:
             logger.info("✅ [CACHE] No new stories found, skipping story processing...")
-            # Update cache even when no new stories (refreshes timestamps)
+            # Keep the cache in step with removed stories; writes nothing when unchanged
             logger.info(f"📊 [CACHE] Updating cache with {len(stories)} current stories...")
             await update_stories_cache(TARGET_USERNAME, stories)
             return
@@ -2725,17 +2800,9 @@ async def check_for_new_stories(force=False):
                 
                 logger.info(f"✅ [AUTO] Cache-filtered download and Telegram sending completed")
                 
-                # Mark all new stories as processed
+                # Mark all new stories as processed (one local transaction, one Supabase upsert per batch)
                 logger.info(f"📊 [CACHE] Marking {len(new_stories)} stories as processed...")
-                for story in new_stories:
-                    try:
-                        story_id = generate_story_id(story)
-                        story_url = story.get('url', '')
-                        story_type = story.get('type', 'photo')
-                        await mark_story_processed(story_id, TARGET_USERNAME, story_url, story_type)
-                        logger.info(f"✅ [CACHE] Story marked as processed: {story_id}")
-                    except Exception as process_error:
-                        logger.error(f"❌ [AUTO] Error marking story as processed: {process_error}")
+                await mark_stories_processed(TARGET_USERNAME, new_stories)
                 
                 # Update cache AFTER successful sending (allows retry on failure)
                 logger.info(f"📊 [CACHE] Updating cache with {len(stories)} current stories after successful send...")
@@ -2756,13 +2823,11 @@ async def check_for_new_stories(force=False):
         # Log summary
         logger.info(f"✅ [POLL] Polling check completed: {len(new_stories)} new stories processed using manual infrastructure")
         
-        # Log cache statistics
-        if supabase_manager.is_connected:
-            try:
-                cache_stats = supabase_manager.get_snapchat_cache_stats()
-                logger.info(f"📊 [CACHE] Snapchat cache stats: {cache_stats}")
-            except Exception as stats_error:
-                logger.error(f"❌ [CACHE] Error getting cache stats: {stats_error}")
+        # Log cache statistics (local counters - no Supabase round trip per poll)
+        try:
+            logger.info(f"📊 [CACHE] Snapchat cache stats: {dedup_store.stats()}")
+        except Exception as stats_error:
+            logger.error(f"❌ [CACHE] Error getting cache stats: {stats_error}")
         
         request_tracker.print_stats()
         logger.info('')
@@ -2776,16 +2841,9 @@ async def update_stories_cache(username, stories):
     try:
         logger.info(f"📊 [CACHE] Updating stories cache for @{username} with {len(stories)} stories...")
         
-        # Use Supabase for caching
-        if supabase_manager.is_connected:
-            # Update Supabase cache
-            success = await supabase_manager.update_recent_stories_cache(username, stories)
-            if success:
-                logger.info(f"✅ [CACHE] Stories cache updated for @{username} (Supabase)")
-            else:
-                logger.error(f"❌ [CACHE] Failed to update Supabase cache for @{username}")
-        else:
-            logger.warning(f"⚠️ [CACHE] Supabase not connected - cannot update cache for @{username}")
+        # Written locally; the dedup store syncs it to Supabase in the background
+        dedup_store.set_recent_stories(username, stories)
+        logger.info(f"✅ [CACHE] Stories cache updated for @{username}")
         
     except Exception as error:
         logger.error(f"❌ [CACHE] Error updating stories cache: {error}")
@@ -2803,12 +2861,7 @@ def generate_story_id(story):
 async def check_story_processed(username, story_id):
     """Check if a story has already been processed"""
     try:
-        # Use Supabase for caching
-        if supabase_manager.is_connected:
-            return await supabase_manager.is_story_processed(story_id, username)
-        else:
-            logger.warning(f"⚠️ [CACHE] Supabase not connected - cannot check if story is processed")
-            return False
+        return dedup_store.is_processed(story_id, username)
         
     except Exception as error:
         logger.error(f"Error checking story processed: {error}")
@@ -2819,19 +2872,28 @@ async def mark_story_processed(story_id, username, story_url, story_type):
     try:
         logger.info(f"📊 [CACHE] Marking story as processed: {story_id}")
         
-        # Use Supabase for caching
-        if supabase_manager.is_connected:
-            success = await supabase_manager.mark_story_processed(story_id, username, story_url, story_type)
-            if success:
-                logger.info(f"✅ [CACHE] Story marked as processed in Supabase: {story_id}")
-            else:
-                logger.error(f"❌ [CACHE] Failed to mark story as processed in Supabase: {story_id}")
-        else:
-            logger.warning(f"⚠️ [CACHE] Supabase not connected - cannot mark story as processed")
+        # Written locally; the dedup store syncs it to Supabase in the background
+        if dedup_store.mark_processed(story_id, username, story_url, story_type):
+            logger.info(f"✅ [CACHE] Story marked as processed: {story_id}")
         
     except Exception as error:
         logger.error(f"❌ [CACHE] Error marking story processed: {error}")
 
+async def mark_stories_processed(username, stories):
+    """Mark several stories as processed at once"""
+    try:
+        processed = [
+            {"snap_id": generate_story_id(story), "url": story.get('url', ''), "type": story.get('type', 'photo')}
+            for story in stories
+        ]
+        
+        # Written locally; the dedup store syncs them to Supabase in batches
+        marked = dedup_store.mark_many(username, processed)
+        logger.info(f"✅ [CACHE] {marked} stories marked as processed for @{username} ({len(processed) - marked} already marked)")
+        
+    except Exception as error:
+        logger.error(f"❌ [CACHE] Error marking stories processed: {error}")
+
 # ===== PHASE 5: API ENDPOINTS =====
 
 # ===== 5.1 Polling Control Endpoints =====
@@ -3174,7 +3236,7 @@ async def snapchat_download_endpoint(request: DownloadRequest, background_tasks:
             logger.info(f"📥 [SNAPCHAT-DOWNLOAD] Extracted username: {extracted_username}")
             
             # Download the specific media from URL
-            snapchat = SnapchatDL(directory_prefix=DOWNLOADS_DIR, max_workers=8)
+            snapchat = snapchat_client
             key = f"{extracted_username}:{request.download_type}"
             
             # Reset progress
@@ -3203,22 +3265,14 @@ async def snapchat_download_endpoint(request: DownloadRequest, background_tasks:
                 os.makedirs(media_dir, exist_ok=True)
                 file_path = os.path.join(media_dir, filename)
                 
-                # Download the file
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(request.url) as response:
-                        if response.status == 200:
-                            content = await response.read()
-                            with open(file_path, 'wb') as f:
-                                f.write(content)
-                            logger.info(f"✅ [SNAPCHAT-DOWNLOAD] Downloaded single media: {filename}")
-                        else:
-                            raise HTTPException(status_code=response.status, detail=f"Failed to download media: HTTP {response.status}")
+                # Download the file, or link it if this media is already stored
+                await snapchat_client.fetch_media(request.url, file_path)
+                logger.info(f"✅ [SNAPCHAT-DOWNLOAD] Downloaded single media: {filename}")
                 
                 # Determine media type
                 media_type = "video" if file_ext == "mp4" else "image"
                 
                 # Save metadata
-                metadata = load_media_metadata(extracted_username, request.download_type)
                 new_item = {
                     "filename": filename,
                     "type": media_type,
@@ -3227,8 +3281,7 @@ async def snapchat_download_endpoint(request: DownloadRequest, background_tasks:
                     "progress": 100,
                     "download_url": f"/downloads/{extracted_username}/{request.download_type}/{filename}"
                 }
-                metadata.append(new_item)
-                save_media_metadata(extracted_username, request.download_type, metadata)
+                snapchat_client.media_index.upsert(extracted_username, request.download_type, new_item)
                 
                 # Send to Telegram if requested
                 if request.send_to_telegram:
@@ -3268,7 +3321,7 @@ async def snapchat_download_endpoint(request: DownloadRequest, background_tasks:
         logger.info(f"📥 [SNAPCHAT-DOWNLOAD] Request for @{request.username} - {request.download_type}")
         
         # Call the existing download function
-        snapchat = SnapchatDL(directory_prefix=DOWNLOADS_DIR, max_workers=8)
+        snapchat = snapchat_client
         key = f"{request.username}:{request.download_type}"
         
         # Reset progress
@@ -3288,8 +3341,7 @@ async def snapchat_download_endpoint(request: DownloadRequest, background_tasks:
             await websocket_manager.broadcast(key, {"overall": progress_data[key], "files": file_progress[key]})
             
             # Get list of existing files BEFORE download (to identify new files later)
-            existing_metadata = load_media_metadata(request.username, request.download_type)
-            existing_filenames = {item.get("filename") for item in existing_metadata}
+            existing_filenames = snapchat_client.media_index.filenames(request.username, request.download_type)
             logger.info(f"📊 [SNAPCHAT-DOWNLOAD] Found {len(existing_filenames)} existing files before download")
             
             media_urls = []
@@ -3303,8 +3355,7 @@ async def snapchat_download_endpoint(request: DownloadRequest, background_tasks:
             logger.info(f"Downloaded {len(media_urls)} files")
             
             # Get list of files AFTER download to identify new ones
-            new_metadata = load_media_metadata(request.username, request.download_type)
-            new_filenames = {item.get("filename") for item in new_metadata}
+            new_filenames = snapchat_client.media_index.filenames(request.username, request.download_type)
             newly_downloaded_filenames = list(new_filenames - existing_filenames)
             
             logger.info(f"📊 [SNAPCHAT-DOWNLOAD] Found {len(newly_downloaded_filenames)} NEW files (out of {len(new_filenames)} total)")
@@ -3378,97 +3429,92 @@ async def debug_snapchat_api(username: str):
         endpoint = f"https://www.snapchat.com/add/{username}/"
         regexp = r'<script\s*id="__NEXT_DATA__"\s*type="application\/json">([^<]+)</script>'
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                endpoint,
-                headers={
-                    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36"
+        session = await snapchat_client.get_session()
+        async with session.get(endpoint) as response:
+            if response.status != 200:
+                return {
+                    "success": False,
+                    "error": f"API returned status {response.status}",
+                    "status_code": response.status
                 }
-            ) as response:
-                if response.status != 200:
-                    return {
-                        "success": False,
-                        "error": f"API returned status {response.status}",
-                        "status_code": response.status
-                    }
-                
-                html = await response.text()
-                
-                # Extract JSON
-                json_match = re.findall(regexp, html)
-                if not json_match:
-                    return {
-                        "success": False,
-                        "error": "Could not find __NEXT_DATA__ JSON in response",
-                        "html_length": len(html)
-                    }
-                
-                # Parse JSON
-                data = json.loads(json_match[0])
-                
-                # Log JSON size for debugging
-                logger.info(f"📊 [DEBUG] JSON size: {len(json_match[0])} characters")
-                logger.info(f"📊 [DEBUG] HTML size: {len(html)} characters")
-                
-                # Extract key information
-                page_props = data.get("props", {}).get("pageProps", {})
-                
-                result = {
-                    "success": True,
-                    "username": username,
-                    "api_url": endpoint,
-                    "html_size": len(html),
-                    "json_size": len(json_match[0]),
-                    "page_props_keys": list(page_props.keys()),
-                    "stories": {},
-                    "highlights": {},
-                    "user_profile": {}
+            
+            html = await response.text()
+            
+            # Extract JSON
+            json_match = re.findall(regexp, html)
+            if not json_match:
+                return {
+                    "success": False,
+                    "error": "Could not find __NEXT_DATA__ JSON in response",
+                    "html_length": len(html)
                 }
+            
+            # Parse JSON
+            data = json.loads(json_match[0])
+            
+            # Log JSON size for debugging
+            logger.info(f"📊 [DEBUG] JSON size: {len(json_match[0])} characters")
+            logger.info(f"📊 [DEBUG] HTML size: {len(html)} characters")
+            
+            # Extract key information
+            page_props = data.get("props", {}).get("pageProps", {})
+            
+            result = {
+                "success": True,
+                "username": username,
+                "api_url": endpoint,
+                "html_size": len(html),
+                "json_size": len(json_match[0]),
+                "page_props_keys": list(page_props.keys()),
+                "stories": {},
+                "highlights": {},
+                "user_profile": {}
+            }
+            
+            # Extract story information
+            if "story" in page_props:
+                story_data = page_props["story"]
+                result["stories"]["has_story"] = True
+                result["stories"]["keys"] = list(story_data.keys())
                 
-                # Extract story information
-                if "story" in page_props:
-                    story_data = page_props["story"]
-                    result["stories"]["has_story"] = True
-                    result["stories"]["keys"] = list(story_data.keys())
+                if "snapList" in story_data:
+                    snap_list = story_data["snapList"]
+                    result["stories"]["snap_count"] = len(snap_list)
+                    result["stories"]["snaps"] = []
                     
-                    if "snapList" in story_data:
-                        snap_list = story_data["snapList"]
-                        result["stories"]["snap_count"] = len(snap_list)
-                        result["stories"]["snaps"] = []
-                        
-                        logger.info(f"\n🔍 [DEBUG] Processing {len(snap_list)} snaps from snapList:")
+                    logger.info(f"\n🔍 [DEBUG] Processing {len(snap_list)} snaps from snapList:")
+                    
+                    for i, snap in enumerate(snap_list, 1):
+                        snap_info = {
+                            "snap_id": snap.get("snapId", {}).get("value", "N/A"),
+                            "media_type": snap.get("snapMediaType", "N/A"),
+                            "timestamp": snap.get("timestampInSec", {}).get("value", "N/A"),
+                            "has_media_url": "mediaUrl" in snap.get("snapUrls", {})
+                        }
+                        result["stories"]["snaps"].append(snap_info)
                         
-                        for i, snap in enumerate(snap_list, 1):
-                            snap_info = {
-                                "snap_id": snap.get("snapId", {}).get("value", "N/A"),
-                                "media_type": snap.get("snapMediaType", "N/A"),
-                                "timestamp": snap.get("timestampInSec", {}).get("value", "N/A"),
-                                "has_media_url": "mediaUrl" in snap.get("snapUrls", {})
-                            }
-                            result["stories"]["snaps"].append(snap_info)
-                            
-                            # Log each snap ID with position for easy comparison
-                            logger.info(f"   📱 Snap {i}/{len(snap_list)}: {snap_info['snap_id']}")
-                else:
-                    result["stories"]["has_story"] = False
-                
-                # Extract highlights
-                if "curatedHighlights" in page_props:
-                    result["highlights"]["curated_count"] = len(page_props["curatedHighlights"])
-                
-                if "spotHighlights" in page_props:
-                    result["highlights"]["spot_count"] = len(page_props["spotHighlights"])
-                
-                # Extract user profile
-                if "userProfile" in page_props:
-                    user_profile = page_props["userProfile"]
-                    result["user_profile"]["exists"] = True
-                    result["user_profile"]["type"] = user_profile.get("$case", "unknown")
-                
-                logger.info(f"✅ [DEBUG] Found {result['stories'].get('snap_count', 0)} snaps in API")
-                
-                return result
-                
+                        # Log each snap ID with position for easy comparison
+                        logger.info(f"   📱 Snap {i}/{len(snap_list)}: {snap_info['snap_id']}")
+            else:
+                result["stories"]["has_story"] = False
+            
+            # Extract highlights
+            if "curatedHighlights" in page_props:
+                result["highlights"]["curated_count"] = len(page_props["curatedHighlights"])
+            
+            if "spotHighlights" in page_props:
+                result["highlights"]["spot_count"] = len(page_props["spotHighlights"])
+            
+            # Extract user profile
+            if "userProfile" in page_props:
+                user_profile = page_props["userProfile"]
+                result["user_profile"]["exists"] = True
+                result["user_profile"]["type"] = user_profile.get("$case", "unknown")
+            
+            logger.info(f"✅ [DEBUG] Found {result['stories'].get('snap_count', 0)} snaps in API")
+            
+            return result
+            
     except Exception as e:
         logger.error(f"❌ [DEBUG] Error: {e}")
         return {
@@ -3524,15 +3570,15 @@ async def clear_snapchat_cache_endpoint():
         
         logger.info(f"Clearing Snapchat cache for @{TARGET_USERNAME}")
         
-        # Clear cache for the current target
-        if supabase_manager.is_connected:
-            deleted_count = await supabase_manager.clear_user_cache(TARGET_USERNAME)
+        # Clear cache for the current target locally; in Supabase now, or on the next sync if that fails
+        local = dedup_store.clear_user(TARGET_USERNAME, processed=False, pending=True)
+        remote = await dedup_store.push_clear(supabase_manager, TARGET_USERNAME, processed=False)
+        if remote is not None:
+            deleted_count = remote["cache_deleted"]
             logger.info(f"🗑️ Cleared {deleted_count} cache entries for @{TARGET_USERNAME}")
         else:
-            logger.warning("⚠️ Supabase not connected, cannot clear cache")
-            deleted_count = 0
-        
-        # Memory cache removed - Supabase is the only cache now
+            logger.warning("⚠️ Supabase cache clear failed, cache cleared locally and will be cleared in Supabase on the next sync")
+            deleted_count = local["cache_deleted"]
         
         return {
             "success": True,
@@ -3569,8 +3615,36 @@ async def graceful_shutdown():
     except Exception as e:
         logger.error(f"❌ Error stopping health check: {e}")
     
-    # Database connections closed (SQLite removed)
-    logger.info("🗄️ Database connections closed (SQLite removed)")
+    # Flush pending dedup writes to Supabase, then close the local store
+    try:
+        sync_task = getattr(app, "dedup_sync_task", None)
+        if sync_task:
+            sync_task.cancel()
+        logger.info("🗄️ Syncing dedup store to Supabase...")
+        await asyncio.wait_for(dedup_store.sync(supabase_manager), timeout=10.0)
+    except Exception as e:
+        logger.error(f"❌ Error syncing dedup store: {e}")
+    dedup_store.close()
+    
+    # Close the pooled Supabase connection
+    try:
+        await supabase_manager.disconnect()
+    except Exception as e:
+        logger.error(f"❌ Error closing Supabase connection: {e}")
+    
+    # Close shared Snapchat HTTP session
+    try:
+        logger.info("🌐 Closing Snapchat HTTP session...")
+        await snapchat_client.close()
+    except Exception as e:
+        logger.error(f"❌ Error closing Snapchat HTTP session: {e}")
+    
+    # Stop thumbnail workers
+    try:
+        logger.info("🖼️ Stopping thumbnail workers...")
+        thumbnail_service.shutdown()
+    except Exception as e:
+        logger.error(f"❌ Error stopping thumbnail workers: {e}")
     
     # Close Telegram manager
     try:
@@ -3603,6 +3677,14 @@ async def graceful_shutdown():
     logger.info("✅ Graceful shutdown completed")
 
 # ===== 7.2 Enhanced Startup Integration =====
+async def reconcile_storage():
+    """Recount the downloads folder and the stored media blobs off the event loop"""
+    try:
+        await asyncio.to_thread(storage_accounting.reconcile)
+        await asyncio.to_thread(snapchat_client.media_store.count_blobs)
+    except Exception as error:
+        logger.error(f"❌ Storage reconciliation failed: {error}")
+
 @app.on_event("startup")
 async def enhanced_startup_event():
     """Enhanced startup with Supabase integration"""
@@ -3636,6 +3718,45 @@ async def enhanced_startup_event():
         # Start monitoring systems
         health_check.start()
         
+        # Push local dedup writes to Supabase in the background (and reconnect after outages)
+        app.dedup_sync_task = asyncio.create_task(dedup_store.run(supabase_manager))
+        
+        # Resume (or purge) downloads interrupted by the last shutdown
+        async def recover_partial_downloads():
+            try:
+                result = await snapchat_client.recover_partial_downloads()
+                if result["resumed"] or result["purged"]:
+                    logger.info(f"♻️ [DOWNLOAD] Partial downloads: {result['resumed']} resumed, {result['purged']} purged")
+            except Exception as error:
+                logger.error(f"❌ Failed to recover partial downloads: {error}")
+        
+        asyncio.create_task(recover_partial_downloads())
+        
+        # Build the gallery index off the event loop; requests that arrive
+        # first wait for it in a worker thread. The index follows this
+        # process's writes only, so run the server with a single worker.
+        async def build_gallery_index():
+            try:
+                await asyncio.to_thread(gallery_index.rebuild)
+            except Exception as error:
+                logger.error(f"❌ Failed to build gallery index: {error}")
+        
+        asyncio.create_task(build_gallery_index())
+        if os.getenv("WEB_CONCURRENCY", "1") not in ("", "1"):
+            logger.warning("⚠️ [GALLERY] Several workers configured: each gallery only lists its own worker's downloads")
+        if os.getenv("GALLERY_WATCH", "false").lower() in ("1", "true", "yes"):
+            asyncio.create_task(gallery_index.watch())
+        
+        # Seed the storage counters with one walk, then re-walk periodically to
+        # catch files nothing reports on (thumbnails, released blobs, logs)
+        asyncio.create_task(reconcile_storage())
+        scheduler.add_job(
+            reconcile_storage,
+            trigger=IntervalTrigger(hours=float(os.getenv("STORAGE_RECONCILE_HOURS", "6"))),
+            id="snapchat_storage_reconcile",
+            replace_existing=True
+        )
+        
         # Schedule 2-week cleanup (every 2 weeks)
         scheduler.add_job(
             health_check.scheduled_cleanup,
@@ -3752,20 +3873,16 @@ async def clear_user_cache(username: str):
         if not username:
             raise HTTPException(status_code=400, detail="Username is required")
         
-        deleted_count = 0
+        # Local dedup store first; Supabase now, or on the next sync if that fails
+        local = dedup_store.clear_user(username, processed=False, pending=True)
+        deleted_count = local["cache_deleted"]
         
-        # Use Supabase for caching
-        if supabase_manager and supabase_manager.is_connected:
-            try:
-                logger.info(f"🗑️ Clearing cache for @{username} using Supabase...")
-                deleted_count = await supabase_manager.clear_user_cache(username)
-            except Exception as error:
-                logger.error(f"❌ Supabase cache clear failed: {error}")
-                logger.warning(f"⚠️ Cannot clear cache for @{username} - Supabase not available")
+        logger.info(f"🗑️ Clearing cache for @{username} using Supabase...")
+        remote = await dedup_store.push_clear(supabase_manager, username, processed=False)
+        if remote is not None:
+            deleted_count = remote["cache_deleted"]
         else:
-            logger.warning(f"⚠️ Cannot clear cache for @{username} - Supabase not connected")
-        
-        # Memory cache removed - Supabase is the only cache now
+            logger.warning(f"⚠️ Supabase cache clear failed - cache for @{username} will be cleared there on the next sync")
         
         return {
             "success": True, 
@@ -3786,23 +3903,18 @@ async def clear_user_data(username: str):
         if not username:
             raise HTTPException(status_code=400, detail="Username is required")
         
-        processed_deleted = 0
-        cache_deleted = 0
+        # Local dedup store first; Supabase now, or on the next sync if that fails
+        local = dedup_store.clear_user(username, pending=True)
+        processed_deleted = local["processed_deleted"]
+        cache_deleted = local["cache_deleted"]
         
-        # Use Supabase for caching
-        if supabase_manager and supabase_manager.is_connected:
-            try:
-                logger.info(f"🧹 Clearing all data for @{username} using Supabase...")
-                result = await supabase_manager.clear_user_data(username)
-                processed_deleted = result["processed_deleted"]
-                cache_deleted = result["cache_deleted"]
-            except Exception as error:
-                logger.error(f"❌ Supabase data clear failed: {error}")
-                logger.warning(f"⚠️ Cannot clear data for @{username} - Supabase not available")
+        logger.info(f"🧹 Clearing all data for @{username} using Supabase...")
+        remote = await dedup_store.push_clear(supabase_manager, username)
+        if remote is not None:
+            processed_deleted = remote["processed_deleted"]
+            cache_deleted = remote["cache_deleted"]
         else:
-            logger.warning(f"⚠️ Cannot clear data for @{username} - Supabase not connected")
-        
-        # Memory cache removed - Supabase is the only cache now
+            logger.warning(f"⚠️ Supabase data clear failed - data for @{username} will be cleared there on the next sync")
         
         return {
             "success": True,
@@ -3819,7 +3931,7 @@ async def clear_user_data(username: str):
 # Storage stats endpoint - MUST be before /gallery/{media_type} to avoid route conflict
 @app.get("/gallery/stats")
 async def get_storage_stats():
-    """Get comprehensive storage statistics"""
+    """Get comprehensive storage statistics from the running storage counters"""
     try:
         total_files = 0
         total_size_bytes = 0
@@ -3827,49 +3939,16 @@ async def get_storage_stats():
         by_media_type = {"stories": 0, "highlights": 0, "spotlights": 0}
         by_file_type = {"video": 0, "image": 0}
         
-        if not os.path.exists(DOWNLOADS_DIR):
-            return {
-                "total_files": 0,
-                "total_size_mb": 0,
-                "by_username": {},
-                "by_media_type": by_media_type,
-                "by_file_type": by_file_type
-            }
-        
-        for username in os.listdir(DOWNLOADS_DIR):
-            user_dir = os.path.join(DOWNLOADS_DIR, username)
-            if not os.path.isdir(user_dir):
-                continue
-            
-            user_stats = {"files": 0, "size_mb": 0}
-            
-            for media_type in ["stories", "highlights", "spotlights"]:
-                media_dir = os.path.join(user_dir, media_type)
-                if not os.path.exists(media_dir):
-                    continue
-                
-                try:
-                    metadata = load_media_metadata(username, media_type)
-                    
-                    for item in metadata:
-                        file_path = os.path.join(media_dir, item["filename"])
-                        if os.path.isfile(file_path):
-                            file_size = os.path.getsize(file_path)
-                            total_files += 1
-                            total_size_bytes += file_size
-                            user_stats["files"] += 1
-                            user_stats["size_mb"] += file_size / (1024 * 1024)
-                            by_media_type[media_type] += 1
-                            
-                            if item["type"] == "video":
-                                by_file_type["video"] += 1
-                            else:
-                                by_file_type["image"] += 1
-                except Exception as e:
-                    logger.warning(f"Error processing stats for {username}/{media_type}: {e}")
-            
-            if user_stats["files"] > 0:
-                by_username[username] = user_stats
+        await asyncio.to_thread(storage_accounting.ensure_ready)
+        for (username, media_type), counters in sorted(storage_accounting.usage().items()):
+            total_files += counters["files"]
+            total_size_bytes += counters["bytes"]
+            user_stats = by_username.setdefault(username, {"files": 0, "size_mb": 0})
+            user_stats["files"] += counters["files"]
+            user_stats["size_mb"] += counters["bytes"] / (1024 * 1024)
+            by_media_type[media_type] += counters["files"]
+            by_file_type["video"] += counters["videos"]
+            by_file_type["image"] += counters["files"] - counters["videos"]
         
         return {
             "total_files": total_files,
@@ -3900,87 +3979,22 @@ async def get_gallery_filenames(
     if media_type not in ["stories", "highlights", "spotlights"]:
         raise HTTPException(status_code=400, detail="Invalid media type")
     
-    all_filenames = []
-    
-    if not os.path.exists(DOWNLOADS_DIR):
-        return FilenamesResponse(status="success", filenames=[], total=0)
-    
-    # Collect all files from all users (reuse filtering logic from main endpoint)
-    for user_folder in os.listdir(DOWNLOADS_DIR):
-        user_dir = os.path.join(DOWNLOADS_DIR, user_folder)
-        if not os.path.isdir(user_dir):
-            continue
-        
-        # Apply username filter early
-        if username and user_folder != username:
-            continue
-            
-        media_dir = os.path.join(user_dir, media_type)
-        if not os.path.exists(media_dir):
-            continue
-        
-        try:
-            metadata = load_media_metadata(user_folder, media_type)
-            
-            for item in metadata:
-                file_path = os.path.join(media_dir, item["filename"])
-                if not os.path.isfile(file_path):
-                    continue
-                
-                file_type = item["type"]
-                
-                # Apply media type filter
-                if media_type_filter and file_type != media_type_filter:
-                    continue
-                
-                # Apply filename search
-                if search and search.lower() not in item["filename"].lower():
-                    continue
-                
-                # Apply date range filter
-                if date_from or date_to:
-                    # Extract date from filename (format: YYYY-MM-DD_HH-MM-SS_...)
-                    try:
-                        file_date_str = item["filename"].split("_")[0]
-                        file_date = datetime.strptime(file_date_str, "%Y-%m-%d").date()
-                        
-                        if date_from:
-                            filter_from = datetime.strptime(date_from, "%Y-%m-%d").date()
-                            if file_date < filter_from:
-                                continue
-                        
-                        if date_to:
-                            filter_to = datetime.strptime(date_to, "%Y-%m-%d").date()
-                            if file_date > filter_to:
-                                continue
-                    except (ValueError, IndexError):
-                        # Skip files with invalid date format
-                        continue
-                
-                # Add to results (only filename and username)
-                all_filenames.append(
-                    FilenameItem(
-                        filename=item["filename"],
-                        username=user_folder
-                    )
-                )
-        except Exception as e:
-            logger.warning(f"Error processing user {user_folder} for filenames: {e}")
-            continue
-    
-    # Apply sorting
-    if sort_by == "date_desc":
-        all_filenames.sort(key=lambda x: x.filename, reverse=True)
-    elif sort_by == "date_asc":
-        all_filenames.sort(key=lambda x: x.filename)
-    elif sort_by == "filename_asc":
-        all_filenames.sort(key=lambda x: x.filename.lower())
-    elif sort_by == "filename_desc":
-        all_filenames.sort(key=lambda x: x.filename.lower(), reverse=True)
-    elif sort_by == "type":
-        # For type sorting, we'd need the type info, but we can't easily get it here
-        # Just use filename sort as fallback
-        all_filenames.sort(key=lambda x: x.filename)
+    # "type" needs no type info here; it falls back to filename order
+    await gallery_index.ready()
+    try:
+        entries = gallery_index.select(
+            media_type,
+            username=username,
+            search=search,
+            date_from=date_from,
+            date_to=date_to,
+            type_filter=media_type_filter,
+            sort_by="date_asc" if sort_by == "type" else sort_by,
+        )
+    except ValueError:
+        # Unparseable date filters match nothing
+        entries = []
+    all_filenames = [FilenameItem(filename=entry.filename, username=entry.username) for entry in entries]
     
     return FilenamesResponse(
         status="success",
@@ -3999,143 +4013,77 @@ async def get_gallery_all_users(
     media_type_filter: Optional[str] = None,
     sort_by: Optional[str] = "date_desc",
     page: int = 1,
-    per_page: int = 20
+    per_page: int = 20,
+    cursor: Optional[str] = None
 ):
     """
     Get gallery with advanced filtering, sorting, and pagination
     
     Query params:
     - username: Filter by specific username
-    - search: Search in filename (partial match)
+    - search: Search in filename, snap id or username (partial match, case-insensitive)
     - date_from: Filter from date (YYYY-MM-DD)
     - date_to: Filter to date (YYYY-MM-DD)
     - media_type_filter: Filter by type ("video" or "image")
     - sort_by: Sort order (date_desc, date_asc, filename_asc, filename_desc, type)
     - page: Page number (default: 1)
     - per_page: Items per page (default: 20)
+    - cursor: pagination.next_cursor of the previous page; continues right after it
+      (same cost for every page, and stable while new items arrive). Overrides page.
     """
     if media_type not in ["stories", "highlights", "spotlights"]:
         raise HTTPException(status_code=400, detail="Invalid media type")
     
-    all_media_files = []
-    
-    if not os.path.exists(DOWNLOADS_DIR):
-        return GalleryResponse(status="success", media=[])
+    # Filter, sort and slice in the gallery index; only the page is materialized
+    offset = (page - 1) * per_page
+    await gallery_index.ready()
+    try:
+        entries, total_items, next_cursor = gallery_index.page(
+            media_type,
+            offset=offset,
+            limit=per_page,
+            cursor=cursor,
+            username=username,
+            search=search,
+            date_from=date_from,
+            date_to=date_to,
+            type_filter=media_type_filter,
+            sort_by=sort_by,
+        )
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    except ValueError:
+        # Unparseable date filters match nothing
+        entries, total_items, next_cursor = [], 0, None
     
-    # Collect all files from all users
-    for user_folder in os.listdir(DOWNLOADS_DIR):
-        user_dir = os.path.join(DOWNLOADS_DIR, user_folder)
-        if not os.path.isdir(user_dir):
-            continue
-        
-        # Apply username filter early
-        if username and user_folder != username:
-            continue
-            
-        media_dir = os.path.join(user_dir, media_type)
-        if not os.path.exists(media_dir):
-            continue
-        
-        try:
-            metadata = load_media_metadata(user_folder, media_type)
-            key = f"{user_folder}:{media_type}"
-            
-            with progress_lock:
-                file_progress_data = file_progress.get(key, {})
-            
-            for item in metadata:
-                file_path = os.path.join(media_dir, item["filename"])
-                if not os.path.isfile(file_path):
-                    continue
-                
-                file_type = item["type"]
-                download_status = item["download_status"]
-                progress_val = item["progress"]
-                
-                if item["filename"] in file_progress_data:
-                    file_status = file_progress_data[item["filename"]]
-                    download_status = file_status["status"]
-                    progress_val = file_status["progress"]
-                
-                # Apply media type filter
-                if media_type_filter and file_type != media_type_filter:
-                    continue
-                
-                # Apply filename search
-                if search and search.lower() not in item["filename"].lower():
-                    continue
-                
-                # Apply date range filter
-                if date_from or date_to:
-                    # Extract date from filename (format: YYYY-MM-DD_HH-MM-SS_...)
-                    try:
-                        file_date_str = item["filename"].split("_")[0]
-                        file_date = datetime.strptime(file_date_str, "%Y-%m-%d").date()
-                        
-                        if date_from:
-                            filter_from = datetime.strptime(date_from, "%Y-%m-%d").date()
-                            if file_date < filter_from:
-                                continue
-                        
-                        if date_to:
-                            filter_to = datetime.strptime(date_to, "%Y-%m-%d").date()
-                            if file_date > filter_to:
-                                continue
-                    except (ValueError, IndexError):
-                        # Skip files with invalid date format
-                        continue
-                
-                # Build file URLs
-                file_url = f"/downloads/{user_folder}/{media_type}/{item['filename']}"
-                thumbnail_url = item.get("thumbnail_url")
-                
-                # Handle thumbnail_url being a dict with 'value' key (legacy format)
-                if isinstance(thumbnail_url, dict):
-                    thumbnail_url = thumbnail_url.get("value", "")
-                
-                if file_type == "video":
-                    if not thumbnail_url or thumbnail_url == item.get("download_url") or (isinstance(thumbnail_url, str) and thumbnail_url.endswith(".mp4")):
-                        thumbnail_url = f"/thumbnail/{user_folder}/{media_type}/{item['filename']}"
-                    elif isinstance(thumbnail_url, str) and thumbnail_url.startswith("http"):
-                        pass
-                    else:
-                        thumbnail_url = f"/thumbnail/{user_folder}/{media_type}/{item['filename']}"
-                elif not thumbnail_url:
-                    thumbnail_url = file_url
-                
-                all_media_files.append(
-                    GalleryMediaItem(
-                        filename=item["filename"],
-                        type=file_type,
-                        thumbnail_url=thumbnail_url or file_url,
-                        download_status=download_status,
-                        progress=progress_val,
-                        download_url=file_url,
-                        username=user_folder
-                    )
-                )
-        except Exception as e:
-            logger.warning(f"Error processing user {user_folder}: {e}")
-            continue
+    with progress_lock:
+        live_status = [file_progress.get(f"{entry.username}:{media_type}", {}).get(entry.filename) for entry in entries]
     
-    # Apply sorting
-    if sort_by == "date_desc":
-        all_media_files.sort(key=lambda x: x.filename, reverse=True)
-    elif sort_by == "date_asc":
-        all_media_files.sort(key=lambda x: x.filename)
-    elif sort_by == "filename_asc":
-        all_media_files.sort(key=lambda x: x.filename.lower())
-    elif sort_by == "filename_desc":
-        all_media_files.sort(key=lambda x: x.filename.lower(), reverse=True)
-    elif sort_by == "type":
-        all_media_files.sort(key=lambda x: (x.type != "video", x.filename))
+    paginated_items = []
+    for entry, file_status in zip(entries, live_status):
+        download_status = entry.download_status
+        progress_val = entry.progress
+        if file_status:
+            download_status = file_status["status"]
+            progress_val = file_status["progress"]
+        thumbnail_url, thumbnail_srcset = thumbnail_service.urls(
+            entry.username, media_type, entry.filename, entry.thumbnail_url
+        )
+        paginated_items.append(
+            GalleryMediaItem(
+                filename=entry.filename,
+                type=entry.type,
+                thumbnail_url=thumbnail_url,
+                download_status=download_status,
+                progress=progress_val,
+                download_url=entry.download_url,
+                username=entry.username,
+                thumbnail_srcset=thumbnail_srcset
+            )
+        )
     
-    # Calculate pagination
-    offset = (page - 1) * per_page
-    total_items = len(all_media_files)
-    paginated_items = all_media_files[offset:offset + per_page]
-    has_next = offset + per_page < total_items
-    has_prev = page > 1
+    has_next = next_cursor is not None
+    has_prev = page > 1 or bool(cursor)
     
     pagination_info = PaginationInfo(
         page=page,
@@ -4143,7 +4091,8 @@ async def get_gallery_all_users(
         total=total_items,
         total_pages=math.ceil(total_items / per_page) if total_items > 0 else 0,
         has_next=has_next,
-        has_prev=has_prev
+        has_prev=has_prev,
+        next_cursor=next_cursor
     )
     
     return GalleryResponse(
@@ -4166,112 +4115,100 @@ async def get_gallery(username: str, media_type: str):
         logger.info(f"Creating directory for new user: {dir_name}")
         os.makedirs(dir_name, exist_ok=True)
     
-            metadata = load_media_metadata(username, media_type)
+    metadata = load_media_metadata(username, media_type)
     media_files = []
-            key = f"{username}:{media_type}"
-            
-            with progress_lock:
-                file_progress_data = file_progress.get(key, {})
-            
-            for item in metadata:
+    key = f"{username}:{media_type}"
+    
+    with progress_lock:
+        file_progress_data = file_progress.get(key, {})
+    
+    for item in metadata:
         file_path = os.path.join(dir_name, item["filename"])
-                if os.path.isfile(file_path):
-                    file_type = item["type"]
-                    download_status = item["download_status"]
-                    progress = item["progress"]
-                    
-                    if item["filename"] in file_progress_data:
-                        file_status = file_progress_data[item["filename"]]
-                        download_status = file_status["status"]
-                        progress = file_status["progress"]
-                    
-            # Use the actual file as download URL
-                    file_url = f"/downloads/{username}/{media_type}/{item['filename']}"
-            
-            # For thumbnails: use original thumbnail_url from metadata if available
-            # For videos, if thumbnail_url points to video file, use thumbnail endpoint
-            thumbnail_url = item.get("thumbnail_url")
-            if file_type == "video":
-                # If thumbnail_url is the video URL itself or missing, generate thumbnail from video
-                if not thumbnail_url or thumbnail_url == item.get("download_url") or thumbnail_url.endswith(".mp4"):
-                    thumbnail_url = f"/thumbnail/{username}/{media_type}/{item['filename']}"
-                # If thumbnail_url is from Snapchat API (external URL), use it directly
-                elif thumbnail_url.startswith("http"):
-                    # Use the original Snapchat preview URL
-                    pass
-                else:
-                    # Fallback to thumbnail endpoint for relative paths
-                    thumbnail_url = f"/thumbnail/{username}/{media_type}/{item['filename']}"
-            elif not thumbnail_url:
-                # For images, use the file itself as thumbnail
-                thumbnail_url = file_url
-            
-            media_files.append(
-                        GalleryMediaItem(
-                            filename=item["filename"],
-                            type=file_type,
-                    thumbnail_url=thumbnail_url or file_url,
-                            download_status=download_status,
-                            progress=progress,
-                            download_url=file_url
-                        )
-                    )
+        if not os.path.isfile(file_path):
+            continue
+        
+        file_type = item["type"]
+        download_status = item["download_status"]
+        progress = item["progress"]
+        
+        if item["filename"] in file_progress_data:
+            file_status = file_progress_data[item["filename"]]
+            download_status = file_status["status"]
+            progress = file_status["progress"]
+        
+        # Use the actual file as download URL
+        file_url = f"/downloads/{username}/{media_type}/{item['filename']}"
+        
+        # For thumbnails: use original thumbnail_url from metadata if available
+        # For videos, if thumbnail_url points to video file, use thumbnail endpoint
+        thumbnail_url = item.get("thumbnail_url")
+        if file_type == "video":
+            # If thumbnail_url is the video URL itself or missing, generate thumbnail from video
+            if not thumbnail_url or thumbnail_url == item.get("download_url") or thumbnail_url.endswith(".mp4"):
+                thumbnail_url = f"/thumbnail/{username}/{media_type}/{item['filename']}"
+            # If thumbnail_url is from Snapchat API (external URL), use it directly
+            elif thumbnail_url.startswith("http"):
+                # Use the original Snapchat preview URL
+                pass
+            else:
+                # Fallback to thumbnail endpoint for relative paths
+                thumbnail_url = f"/thumbnail/{username}/{media_type}/{item['filename']}"
+        elif not thumbnail_url:
+            # For images, use the file itself as thumbnail
+            thumbnail_url = file_url
+        
+        # Serve compact width presets when an encoder is installed
+        thumbnail_url, thumbnail_srcset = thumbnail_service.urls(
+            username, media_type, item["filename"], thumbnail_url or file_url
+        )
+        media_files.append(
+            GalleryMediaItem(
+                filename=item["filename"],
+                type=file_type,
+                thumbnail_url=thumbnail_url,
+                download_status=download_status,
+                progress=progress,
+                download_url=file_url,
+                thumbnail_srcset=thumbnail_srcset
+            )
+        )
     
     return GalleryResponse(status="success", media=media_files)
 
-# Video thumbnail endpoint - extracts first frame from video
+# Thumbnail endpoint - serves cached width presets, or the first frame of a video
 @app.get("/thumbnail/{username}/{media_type}/{filename}")
-async def generate_video_thumbnail(username: str, media_type: str, filename: str):
-    """Generate thumbnail from video file by extracting first frame"""
+async def generate_video_thumbnail(username: str, media_type: str, filename: str, request: Request, w: Optional[int] = None):
+    """
+    Serve the thumbnail of an image or video, rendering it in the thumbnail pool if not cached yet
+    
+    Query params:
+    - w: Width in pixels; served from the nearest preset at least that wide (WebP/AVIF),
+      with ETag and immutable Cache-Control headers. Without it, videos get their
+      full-size first frame as JPEG and images the original file.
+    """
     try:
         file_path = os.path.join(DOWNLOADS_DIR, username, media_type, filename)
         
         if not os.path.exists(file_path):
             raise HTTPException(status_code=404, detail="File not found")
         
+        if w is not None and thumbnail_service.has_presets(filename):
+            preset = await thumbnail_service.get_preset(file_path, w)
+            if preset:
+                headers = {"ETag": file_etag(preset), "Cache-Control": IMMUTABLE_CACHE_CONTROL}
+                if headers["ETag"] in request.headers.get("if-none-match", "").split(", "):
+                    thumbnail_service.not_modified += 1
+                    return Response(status_code=304, headers=headers)
+                return FileResponse(path=preset, media_type=thumbnail_service.content_type(), headers=headers)
+            logger.warning(f"⚠️ Could not render thumbnail presets for {filename}")
+        
         # Only process video files
-        if not filename.lower().endswith(('.mp4', '.mov', '.webm', '.mkv')):
+        if not is_video(filename):
             # For non-video files, serve the file directly
             return await serve_downloaded_file(username, media_type, filename)
         
-        # Try to use OpenCV or imageio to extract thumbnail
-        thumbnail_path = None
-        try:
-            # Try OpenCV first (cv2)
-            import cv2
-            video = cv2.VideoCapture(file_path)
-            if video.isOpened():
-                ret, frame = video.read()
-                if ret:
-                    # Create thumbnail filename
-                    thumbnail_dir = os.path.join(DOWNLOADS_DIR, username, media_type, ".thumbnails")
-                    os.makedirs(thumbnail_dir, exist_ok=True)
-                    thumbnail_path = os.path.join(thumbnail_dir, f"{os.path.splitext(filename)[0]}.jpg")
-                    
-                    # Save frame as JPEG
-                    cv2.imwrite(thumbnail_path, frame)
-                    logger.info(f"✅ Generated thumbnail: {thumbnail_path}")
-                video.release()
-        except ImportError:
-            logger.warning("⚠️ OpenCV not available, trying alternative method")
-            # Fallback: try imageio
-            try:
-                import imageio
-                reader = imageio.get_reader(file_path)
-                frame = reader.get_data(0)  # Get first frame
-                
-                thumbnail_dir = os.path.join(DOWNLOADS_DIR, username, media_type, ".thumbnails")
-                os.makedirs(thumbnail_dir, exist_ok=True)
-                thumbnail_path = os.path.join(thumbnail_dir, f"{os.path.splitext(filename)[0]}.jpg")
-                
-                imageio.imwrite(thumbnail_path, frame)
-                logger.info(f"✅ Generated thumbnail with imageio: {thumbnail_path}")
-                reader.close()
-            except ImportError:
-                logger.warning("⚠️ Neither OpenCV nor imageio available for thumbnail generation")
-        
-        # If thumbnail was generated, serve it
-        if thumbnail_path and os.path.exists(thumbnail_path):
+        thumbnail_path = await thumbnail_service.get(file_path)
+        if thumbnail_path:
             return FileResponse(
                 path=thumbnail_path,
                 media_type="image/jpeg",
@@ -4324,39 +4261,14 @@ async def serve_downloaded_file(username: str, media_type: str, filename: str):
 # ===== BULK OPERATIONS ENDPOINTS =====
 
 @app.post("/gallery/bulk-download")
-async def bulk_download_files(request: BulkOperationRequest):
-    """Download multiple files as a ZIP archive"""
+async def bulk_download_files(request: BulkOperationRequest, http_request: Request):
+    """Download multiple files as a ZIP archive, streamed while the files are read"""
     try:
-        from fastapi.responses import StreamingResponse
-        
-        zip_buffer = BytesIO()
-        successful = 0
-        failed = 0
-        errors = []
-        
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            for filename in request.items:
-                try:
-                    file_path = os.path.join(DOWNLOADS_DIR, request.username, request.media_type, filename)
-                    if os.path.exists(file_path):
-                        zip_file.write(file_path, filename)
-                        successful += 1
-                    else:
-                        failed += 1
-                        errors.append(f"{filename}: File not found")
-                except Exception as e:
-                    failed += 1
-                    errors.append(f"{filename}: {str(e)}")
-        
-        zip_buffer.seek(0)
-        
-        return StreamingResponse(
-            zip_buffer,
-            media_type="application/zip",
-            headers={
-                "Content-Disposition": f"attachment; filename={request.username}_{request.media_type}.zip"
-            }
+        folder = os.path.join(DOWNLOADS_DIR, request.username, request.media_type)
+        archive = await asyncio.to_thread(
+            ZipStream, [(os.path.join(folder, filename), filename) for filename in request.items]
         )
+        return zip_stream_response(archive, f"{request.username}_{request.media_type}.zip", http_request)
     except Exception as e:
         logger.error(f"Bulk download error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -4377,9 +4289,7 @@ async def bulk_delete_files(request: BulkOperationRequest):
                     successful += 1
                     
                     # Update metadata
-                    metadata = load_media_metadata(request.username, request.media_type)
-                    metadata = [item for item in metadata if item["filename"] != filename]
-                    save_media_metadata(request.username, request.media_type, metadata)
+                    snapchat_client.media_index.remove(request.username, request.media_type, [filename])
                 else:
                     failed += 1
                     errors.append(f"{filename}: File not found")
@@ -4465,13 +4375,16 @@ async def bulk_send_telegram(request: BulkOperationRequest, background_tasks: Ba
 # ===== DIRECT DOWNLOAD AND SEND FUNCTION (NO DISK SAVE) =====
 async def download_and_send_directly(username: str, stories: list, telegram_caption: str):
     """
-    Download stories to temporary memory and send directly to Telegram
-    WITHOUT saving to disk permanently. Temp files are deleted immediately after sending.
+    Download stories through the media store and send them directly to Telegram
+    WITHOUT saving them to the user's gallery folders. Each item is fetched to a
+    transient link under DOWNLOADS_DIR/.direct that is deleted right after sending;
+    the stored blob stays so a later gallery download links it instead of
+    downloading again, and prune() reclaims it once nothing links to it.
     """
     try:
         logger.info(f"📥 [DIRECT] Downloading and sending {len(stories)} items directly to Telegram...")
         
-        import tempfile
+        direct_dir = os.path.join(DOWNLOADS_DIR, ".direct")
         sent_count = 0
         failed_count = 0
         
@@ -4484,24 +4397,15 @@ async def download_and_send_directly(username: str, stories: list, telegram_capt
                 
                 logger.info(f"📥 [DIRECT] Processing {i}/{len(stories)}: {story_type} - {snap_id}")
                 
-                # Download to temporary file
                 file_extension = '.mp4' if story_type == 'video' else '.jpg'
-                temp_file = tempfile.NamedTemporaryFile(suffix=file_extension, delete=False)
-                temp_path = temp_file.name
-                temp_file.close()
                 
-                # Download content
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(story_url) as response:
-                        if response.status == 200:
-                            content = await response.read()
-                            with open(temp_path, 'wb') as f:
-                                f.write(content)
-                            logger.info(f"✅ [DIRECT] Downloaded to temp: {os.path.basename(temp_path)}")
-                        else:
-                            logger.error(f"❌ [DIRECT] Download failed: HTTP {response.status}")
-                            failed_count += 1
-                            continue
+                # Fetch through the media store: stored media is linked without a request,
+                # new media is downloaded (with resume) and kept as a blob for the gallery
+                os.makedirs(direct_dir, exist_ok=True)
+                temp_path = os.path.join(direct_dir, f"{username}_{snap_id}{file_extension}")
+                await snapchat_client.fetch_media(story_url, temp_path)
+                send_path = snapchat_client.media_store.find(story_url, file_extension) or temp_path
+                logger.info(f"✅ [DIRECT] Media ready: {os.path.basename(send_path)}")
                 
                 # Send to Telegram
                 if telegram_manager:
@@ -4509,9 +4413,9 @@ async def download_and_send_directly(username: str, stories: list, telegram_capt
                         individual_caption = f"{telegram_caption}\n\n📱 Item {i}/{len(stories)}"
                         
                         if story_type == 'video':
-                            result = await telegram_manager.send_video_with_retry(temp_path, individual_caption)
+                            result = await telegram_manager.send_video_with_retry(send_path, individual_caption)
                         else:
-                            result = await telegram_manager.send_photo_with_retry(temp_path, individual_caption)
+                            result = await telegram_manager.send_photo_with_retry(send_path, individual_caption)
                         
                         logger.info(f"✅ [DIRECT] Sent to Telegram: {snap_id}")
                         sent_count += 1
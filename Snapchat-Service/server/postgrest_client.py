@@ -0,0 +1,328 @@
+import asyncio
+import json
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+from loguru import logger
+
+# Statuses worth retrying: the request may succeed unchanged a moment later
+RETRY_STATUSES = (429, 502, 503, 504)
+
+
+class PostgrestError(Exception):
+    """Error response from PostgREST (message, code and HTTP status of the failed call)"""
+
+    def __init__(self, message: str, status: int = 0, code: Optional[str] = None, details: Any = None):
+        super().__init__(f"{code}: {message}" if code else message)
+        self.message = message
+        self.status = status
+        self.code = code
+        self.details = details
+
+
+class PostgrestNetworkError(PostgrestError):
+    """The request did not get an answer (connection, DNS or timeout failure)"""
+
+    def __init__(self, message: str):
+        super().__init__(f"network error: {message}")
+
+
+class CircuitOpenError(PostgrestNetworkError):
+    """Calls are short-circuited after repeated network failures"""
+
+
+class APIResponse:
+    """Rows (``data``) and, when requested, the row ``count`` of one call"""
+
+    def __init__(self, data: Any, count: Optional[int] = None):
+        self.data = data if data is not None else []
+        self.count = count
+
+
+class CircuitBreaker:
+    """Stops calling an endpoint after ``threshold`` consecutive failures
+
+    While open every call fails immediately; after ``reset_timeout`` seconds
+    one trial call is let through, and its outcome closes or re-opens it.
+    Other calls keep failing fast while the trial is in flight; a trial that
+    never reports back (cancelled) is replaced after another ``reset_timeout``.
+    """
+
+    def __init__(self, threshold: int = 5, reset_timeout: float = 30.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probe_started: Optional[float] = None
+        self.trips = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def before_call(self):
+        state = self.state
+        if state == "open":
+            raise CircuitOpenError(f"circuit open for {self.reset_timeout - (time.monotonic() - self.opened_at):.0f}s more")
+        if state == "half-open":
+            now = time.monotonic()
+            if self.probe_started is not None and now - self.probe_started < self.reset_timeout:
+                raise CircuitOpenError("circuit half-open, trial call in flight")
+            self.probe_started = now
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started = None
+
+    def record_failure(self):
+        self.failures += 1
+        self.probe_started = None
+        if self.opened_at is not None or self.failures >= self.threshold:
+            if self.opened_at is None:
+                self.trips += 1
+                logger.warning(f"⚠️ [POSTGREST] {self.failures} consecutive failures, pausing calls for {self.reset_timeout:.0f}s")
+            self.opened_at = time.monotonic()
+
+
+def _quote(value: Any) -> str:
+    """A value inside an ``in.(...)`` list"""
+    text = str(value)
+    if any(char in text for char in ',()"\\ ') or text.lower() == "null":
+        return '"' + text.replace("\\", "\\\\").replace('"', '\\"') + '"'
+    return text
+
+
+class QueryBuilder:
+    """One PostgREST request, built like supabase-py's table queries and sent by ``await execute()``"""
+
+    def __init__(self, client: "PostgrestClient", table: str):
+        self._client = client
+        self._table = table
+        self._method = "GET"
+        self._params: List[Tuple[str, str]] = []
+        self._prefer: List[str] = []
+        self._body: Any = None
+        self._order: List[str] = []
+        self._head = False
+        self._timeout: Optional[float] = None
+
+    # ----- operations -----
+
+    def select(self, columns: str = "*", count: Optional[str] = None, head: bool = False) -> "QueryBuilder":
+        self._method = "HEAD" if head else "GET"
+        self._head = head
+        self._params.append(("select", columns.replace(" ", "")))
+        if count:
+            self._prefer.append(f"count={count}")
+        return self
+
+    def insert(self, rows: Any, returning: str = "representation") -> "QueryBuilder":
+        self._method = "POST"
+        self._body = rows
+        self._prefer.append(f"return={returning}")
+        return self
+
+    def upsert(self, rows: Any, on_conflict: Optional[str] = None, returning: str = "representation") -> "QueryBuilder":
+        self._method = "POST"
+        self._body = rows
+        self._prefer.extend(["resolution=merge-duplicates", f"return={returning}"])
+        if on_conflict:
+            self._params.append(("on_conflict", on_conflict))
+        return self
+
+    def delete(self, returning: str = "representation") -> "QueryBuilder":
+        self._method = "DELETE"
+        self._prefer.append(f"return={returning}")
+        return self
+
+    # ----- filters and modifiers -----
+
+    def _filter(self, column: str, operator: str, value: Any) -> "QueryBuilder":
+        self._params.append((column, f"{operator}.{value}"))
+        return self
+
+    def eq(self, column: str, value: Any) -> "QueryBuilder":
+        return self._filter(column, "eq", value)
+
+    def neq(self, column: str, value: Any) -> "QueryBuilder":
+        return self._filter(column, "neq", value)
+
+    def lt(self, column: str, value: Any) -> "QueryBuilder":
+        return self._filter(column, "lt", value)
+
+    def gt(self, column: str, value: Any) -> "QueryBuilder":
+        return self._filter(column, "gt", value)
+
+    def is_(self, column: str, value: Any) -> "QueryBuilder":
+        return self._filter(column, "is", "null" if value is None else value)
+
+    def in_(self, column: str, values: List[Any]) -> "QueryBuilder":
+        return self._filter(column, "in", "(" + ",".join(_quote(value) for value in values) + ")")
+
+    def order(self, column: str, desc: bool = False) -> "QueryBuilder":
+        self._order.append(f"{column}.{'desc' if desc else 'asc'}")
+        return self
+
+    def limit(self, count: int) -> "QueryBuilder":
+        self._params.append(("limit", str(count)))
+        return self
+
+    def range(self, start: int, end: int) -> "QueryBuilder":
+        self._params.extend([("offset", str(start)), ("limit", str(end - start + 1))])
+        return self
+
+    def timeout(self, seconds: float) -> "QueryBuilder":
+        """Per-call timeout instead of the client default"""
+        self._timeout = seconds
+        return self
+
+    async def execute(self) -> APIResponse:
+        params = list(self._params)
+        if self._order:
+            params.append(("order", ",".join(self._order)))
+        # Only reads, upserts and deletes are idempotent; a plain insert is never resent
+        idempotent = self._method != "POST" or "resolution=merge-duplicates" in self._prefer
+        return await self._client.request(
+            self._method, self._table, params=params, body=self._body, prefer=self._prefer,
+            head=self._head, timeout=self._timeout, idempotent=idempotent,
+        )
+
+
+class PostgrestClient:
+    """Async PostgREST client with one pooled keep-alive session
+
+    Every call has a timeout; idempotent calls are retried with backoff on
+    network failures and on 429/502/503/504, and a circuit breaker fails
+    calls fast after repeated network failures instead of letting each one
+    wait for its timeout.
+
+    Args:
+        url: Project URL (the ``/rest/v1`` endpoint is derived from it).
+        key: API key, sent as ``apikey`` and bearer token.
+        timeout: Default seconds per call.
+        retries: Extra attempts for idempotent calls.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        key: str,
+        timeout: float = 10.0,
+        retries: int = 2,
+        pool_limit: int = 10,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.rest_url = url.rstrip("/") + "/rest/v1"
+        self.timeout = timeout
+        self.retries = retries
+        self.pool_limit = pool_limit
+        self.breaker = breaker or CircuitBreaker()
+        self._headers = {
+            "apikey": key,
+            "Authorization": f"Bearer {key}",
+            "Accept": "application/json",
+            "Content-Type": "application/json",
+        }
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.requests = 0
+        self.retried = 0
+        self.failures = 0
+
+    def table(self, name: str) -> QueryBuilder:
+        return QueryBuilder(self, name)
+
+    async def rpc(self, function: str, params: Optional[Dict[str, Any]] = None, timeout: Optional[float] = None) -> APIResponse:
+        """Call a Postgres function exposed under ``/rpc``"""
+        return await self.request("POST", f"rpc/{function}", body=params or {}, timeout=timeout, idempotent=True)
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_limit, ttl_dns_cache=300, keepalive_timeout=60),
+                headers=self._headers,
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        params: Optional[List[Tuple[str, str]]] = None,
+        body: Any = None,
+        prefer: Optional[List[str]] = None,
+        head: bool = False,
+        timeout: Optional[float] = None,
+        idempotent: bool = True,
+    ) -> APIResponse:
+        headers = {"Prefer": ",".join(prefer)} if prefer else {}
+        data = json.dumps(body) if body is not None else None
+        client_timeout = aiohttp.ClientTimeout(total=timeout or self.timeout)
+        attempts = 1 + (self.retries if idempotent else 0)
+        for attempt in range(attempts):
+            self.breaker.before_call()
+            self.requests += 1
+            try:
+                async with self._get_session().request(
+                    method, f"{self.rest_url}/{path}", params=params, data=data,
+                    headers=headers, timeout=client_timeout,
+                ) as response:
+                    text = "" if head else await response.text()
+                    status = response.status
+                    content_range = response.headers.get("Content-Range")
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as error:
+                self.breaker.record_failure()
+                self.failures += 1
+                failure: PostgrestError = PostgrestNetworkError(f"{type(error).__name__}: {error}")
+            else:
+                if status < 400:
+                    self.breaker.record_success()
+                    return APIResponse(json.loads(text) if text else None, self._count(content_range))
+                failure = self._error(status, text)
+                if status not in RETRY_STATUSES:
+                    # The server answered: the connection itself is fine
+                    self.breaker.record_success()
+                    raise failure
+                self.breaker.record_failure()
+                self.failures += 1
+            if attempt + 1 < attempts:
+                self.retried += 1
+                await asyncio.sleep(0.25 * 2 ** attempt)
+        raise failure
+
+    @staticmethod
+    def _count(content_range: Optional[str]) -> Optional[int]:
+        """Total from a ``Content-Range: 0-24/3573`` header (``*`` when unknown)"""
+        if not content_range or "/" not in content_range:
+            return None
+        total = content_range.rsplit("/", 1)[1]
+        return int(total) if total.isdigit() else None
+
+    @staticmethod
+    def _error(status: int, text: str) -> PostgrestError:
+        try:
+            payload = json.loads(text)
+        except ValueError:
+            payload = None
+        if isinstance(payload, dict):
+            return PostgrestError(payload.get("message") or text, status, payload.get("code"), payload.get("details"))
+        return PostgrestError(text or f"HTTP {status}", status)
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "retried": self.retried,
+            "failures": self.failures,
+            "circuit": self.breaker.state,
+            "circuit_trips": self.breaker.trips,
+        }
@@ -0,0 +1,148 @@
+from array import array
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional
+
+GRAM = 3
+# Precomputed slices let the trigrams of a text be taken with one C-level map
+_SLICES = [slice(i, i + GRAM) for i in range(512)]
+
+
+def trigrams(text: str) -> set:
+    """Every distinct three-character substring of ``text``"""
+    if len(text) - GRAM + 1 <= len(_SLICES):
+        return set(map(text.__getitem__, _SLICES[:len(text) - GRAM + 1]))
+    return {text[i:i + GRAM] for i in range(len(text) - GRAM + 1)}
+
+
+class SearchIndex:
+    """Trigram index for case-insensitive substring search over gallery items
+
+    Each item is searched through one text: its filename, which carries the
+    capture time, the snap id and the username (the username is appended
+    when the filename does not already contain it). Every trigram maps to
+    the ids of the items containing it, so a needle is only checked against
+    the items of its rarest trigram instead of against every item.
+
+    Results of recent needles are kept, and a needle that extends one of
+    them (the next keystroke) only re-checks that result. Posting lists are
+    append-only arrays; removed items leave a tombstone and the lists are
+    rebuilt once tombstones outnumber live items.
+    """
+
+    def __init__(self, cache_size: int = 64):
+        self.cache_size = cache_size
+        self._postings: Dict[str, array] = {}
+        self._docs: List[Optional[object]] = []
+        self._texts: List[Optional[str]] = []
+        self._ids: Dict[Hashable, int] = {}
+        self._dead = 0
+        self._cache: "OrderedDict[str, List[int]]" = OrderedDict()
+        self.queries = 0
+        self.cache_hits = 0
+        self.compactions = 0
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    @staticmethod
+    def text_for(filename: str, username: str) -> str:
+        text = filename.lower()
+        username = username.lower()
+        return text if username in text else f"{text}\n{username}"
+
+    def add(self, key: Hashable, doc: object, text: str):
+        """Index ``doc`` (searched through ``text``) under ``key``, replacing whatever was there"""
+        self.discard(key)
+        doc_id = len(self._docs)
+        self._docs.append(doc)
+        self._texts.append(text)
+        self._ids[key] = doc_id
+        postings = self._postings
+        for gram in trigrams(text):
+            posting = postings.get(gram)
+            if posting is None:
+                posting = postings[gram] = array("I")
+            posting.append(doc_id)
+        self._cache.clear()
+
+    def discard(self, key: Hashable):
+        doc_id = self._ids.pop(key, None)
+        if doc_id is None:
+            return
+        self._docs[doc_id] = None
+        self._texts[doc_id] = None
+        self._dead += 1
+        self._cache.clear()
+        if self._dead > 1024 and self._dead > len(self._ids):
+            self._compact()
+
+    def clear(self):
+        self._postings = {}
+        self._docs = []
+        self._texts = []
+        self._ids = {}
+        self._dead = 0
+        self._cache.clear()
+
+    def _compact(self):
+        live = [(key, self._docs[doc_id], self._texts[doc_id]) for key, doc_id in self._ids.items()]
+        self.clear()
+        for key, doc, text in live:
+            self.add(key, doc, text)
+        self.compactions += 1
+
+    def candidates(self, needle: str) -> int:
+        """How many items :meth:`search` checks for ``needle`` (an upper bound on the matches)"""
+        needle = needle.lower()
+        cached = self._cache.get(needle)
+        if cached is not None:
+            return len(cached)
+        if len(needle) < GRAM:
+            # No trigram to narrow it down: one pass over the texts settles it
+            return len(self.search(needle))
+        return min(
+            len(self._postings.get(needle[i:i + GRAM], ()))
+            for i in range(len(needle) - GRAM + 1)
+        )
+
+    def _lookup(self, needle: str) -> List[int]:
+        texts = self._texts
+        # A cached needle contained in this one already holds every match
+        for previous in reversed(self._cache):
+            if previous in needle:
+                self.cache_hits += 1
+                if previous == needle:
+                    return self._cache[needle]
+                return [doc_id for doc_id in self._cache[previous] if needle in texts[doc_id]]
+        if len(needle) < GRAM:
+            return [doc_id for doc_id, text in enumerate(texts) if text is not None and needle in text]
+        shortest = min(
+            (self._postings.get(needle[i:i + GRAM], ()) for i in range(len(needle) - GRAM + 1)),
+            key=len,
+        )
+        if len(needle) == GRAM:
+            return [doc_id for doc_id in shortest if texts[doc_id] is not None]
+        return [doc_id for doc_id in shortest if texts[doc_id] is not None and needle in texts[doc_id]]
+
+    def search(self, needle: str) -> List[object]:
+        """Every indexed doc whose text contains ``needle`` (case-insensitive)"""
+        needle = needle.lower()
+        self.queries += 1
+        matches = self._lookup(needle)
+        self._cache[needle] = matches
+        self._cache.move_to_end(needle)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        docs = self._docs
+        return [docs[doc_id] for doc_id in matches]
+
+    def stats(self) -> dict:
+        return {
+            "items": len(self._ids),
+            "trigrams": len(self._postings),
+            "tombstones": self._dead,
+            "cached_needles": len(self._cache),
+            "queries": self.queries,
+            "cache_hits": self.cache_hits,
+            "compactions": self.compactions,
+        }
@@ -0,0 +1,265 @@
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from server.gallery_index import MEDIA_TYPES
+from server.thumbnails import is_video
+
+MB = 1024 * 1024
+
+
+class _Ledger:
+    """Byte and file counters for one snapshot of the downloads folder
+
+    Totals count each inode once (a stored blob and every user/media_type
+    hardlink to it share one), while the per user/media_type counters count
+    every media file in that folder, matching what the gallery shows.
+    """
+
+    def __init__(self):
+        self.paths: Dict[str, Tuple[Tuple[int, int], int]] = {}
+        self.inodes: Dict[Tuple[int, int], List[int]] = {}  # inode -> [size, tracked names]
+        self.groups: Dict[Tuple[str, str], Dict[str, int]] = {}
+        self.total_bytes = 0
+        self.total_files = 0
+
+    def set(self, path: str, group: Optional[Tuple[str, str]], inode: Tuple[int, int], size: int):
+        if self.paths.get(path) == (inode, size):
+            return
+        self.unset(path, group)
+        self.paths[path] = (inode, size)
+        shared = self.inodes.get(inode)
+        if shared is None:
+            self.inodes[inode] = [size, 1]
+            self.total_bytes += size
+            self.total_files += 1
+        else:
+            shared[1] += 1
+        if group is not None:
+            counters = self.groups.get(group)
+            if counters is None:
+                counters = self.groups[group] = {"files": 0, "bytes": 0, "videos": 0}
+            counters["files"] += 1
+            counters["bytes"] += size
+            counters["videos"] += is_video(path)
+
+    def unset(self, path: str, group: Optional[Tuple[str, str]]):
+        previous = self.paths.pop(path, None)
+        if previous is None:
+            return
+        inode, size = previous
+        shared = self.inodes[inode]
+        shared[1] -= 1
+        if not shared[1]:
+            del self.inodes[inode]
+            self.total_bytes -= shared[0]
+            self.total_files -= 1
+        if group is not None:
+            counters = self.groups[group]
+            counters["files"] -= 1
+            counters["bytes"] -= size
+            counters["videos"] -= is_video(path)
+            if not counters["files"]:
+                del self.groups[group]
+
+
+class StorageAccounting:
+    """Running byte and file counters for the downloads folder
+
+    Counters are updated as media is written and deleted: media index
+    changes re-stat the affected files, and cleanup code reports what it
+    removes through :meth:`discard`. Files nothing reports on (stored blobs
+    released by prune, thumbnails, the index database) are picked up by
+    :meth:`reconcile`, a full walk run at startup and then periodically off
+    the request path, so health and stats checks never walk the tree.
+    """
+
+    def __init__(self, downloads_dir: str, media_index=None):
+        self.downloads_dir = os.path.abspath(downloads_dir)
+        self._ledger = _Ledger()
+        self._lock = threading.RLock()
+        self._ready = False
+        self._reconciling = False
+        # Signalled whenever a walk ends, for ensure_ready() callers waiting on it
+        self._walk_done = threading.Condition(self._lock)
+        self._dirty: List[Tuple[str, Optional[str]]] = []
+        self.reconciles = 0
+        self.reconciled_at: Optional[float] = None
+        self.last_reconcile_seconds = 0.0
+        self.last_drift_bytes = 0
+        self.updates = 0
+        if media_index is not None:
+            media_index.add_listener(self.on_change)
+
+    @property
+    def ready(self) -> bool:
+        return self._ready
+
+    def _group(self, path: str) -> Optional[Tuple[str, str]]:
+        """(username, media_type) of a media file under <username>/<media_type>/, else None"""
+        parts = os.path.relpath(path, self.downloads_dir).split(os.sep)
+        if len(parts) != 3 or parts[1] not in MEDIA_TYPES:
+            return None
+        name = parts[2]
+        if name.startswith(".") or name.endswith((".part", ".link")):
+            return None
+        return parts[0], parts[1]
+
+    # ----- updates -----
+
+    def record(self, path: str):
+        """Re-stat one file after it was written, replaced or deleted"""
+        path = os.path.abspath(path)
+        with self._lock:
+            if self._reconciling:
+                self._dirty.append(("record", path))
+            self._record(path)
+
+    def _record(self, path: str):
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._ledger.unset(path, self._group(path))
+        else:
+            self._ledger.set(path, self._group(path), (st.st_dev, st.st_ino), st.st_size)
+        self.updates += 1
+
+    def discard(self, path: str):
+        """Forget a file that was just deleted"""
+        path = os.path.abspath(path)
+        with self._lock:
+            if self._reconciling:
+                self._dirty.append(("record", path))
+            self._ledger.unset(path, self._group(path))
+            self.updates += 1
+
+    def rescan(self, folder: str):
+        """Re-stat every file of one folder (not recursive)"""
+        folder = os.path.abspath(folder)
+        with self._lock:
+            if self._reconciling:
+                self._dirty.append(("rescan", folder))
+            self._rescan(folder)
+
+    def _rescan(self, folder: str):
+        prefix = folder + os.sep
+        tracked = [path for path in self._ledger.paths if path.startswith(prefix) and os.sep not in path[len(prefix):]]
+        try:
+            names = os.listdir(folder)
+        except OSError:
+            names = []
+        for path in set(tracked) | {os.path.join(folder, name) for name in names}:
+            if not os.path.isdir(path):
+                self._record(path)
+
+    def on_change(self, username: str, media_type: str, filenames: Optional[List[str]]):
+        """Media index listener: re-stat the files of the changed items"""
+        if media_type not in MEDIA_TYPES:
+            return
+        folder = os.path.join(self.downloads_dir, username, media_type)
+        if filenames is None:
+            self.rescan(folder)
+            return
+        for filename in filenames:
+            self.record(os.path.join(folder, filename))
+
+    # ----- reconciliation -----
+
+    def reconcile(self):
+        """Walk the whole downloads folder and replace the counters with what is on disk"""
+        started = time.perf_counter()
+        with self._lock:
+            if self._reconciling:
+                return
+            self._reconciling = True
+            self._dirty = []
+        try:
+            ledger = _Ledger()
+            for root, dirs, files in os.walk(self.downloads_dir):
+                for name in files:
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    ledger.set(path, self._group(path), (st.st_dev, st.st_ino), st.st_size)
+            with self._lock:
+                previous = self._ledger
+                self._ledger = ledger
+                # Changes reported during the walk may have been missed by it
+                for action, path in self._dirty:
+                    if action == "rescan":
+                        self._rescan(path)
+                    else:
+                        self._record(path)
+                self.last_drift_bytes = ledger.total_bytes - previous.total_bytes if self._ready else 0
+                self._ready = True
+        finally:
+            with self._lock:
+                self._reconciling = False
+                self._dirty = []
+                self._walk_done.notify_all()
+        self.reconciles += 1
+        self.reconciled_at = time.time()
+        self.last_reconcile_seconds = time.perf_counter() - started
+        if self.last_drift_bytes:
+            logger.info(f"📊 [STORAGE] Reconciled counters: drift of {self.last_drift_bytes / MB:+.1f} MB corrected")
+        logger.info(
+            f"📊 [STORAGE] {ledger.total_files} files, {ledger.total_bytes / MB:.1f} MB "
+            f"(walked in {self.last_reconcile_seconds:.2f}s)"
+        )
+
+    def ensure_ready(self):
+        """Reconcile once if no walk has completed yet
+
+        A walk already in flight is waited for instead of started again, so
+        the counters are seeded when this returns.
+        """
+        while True:
+            with self._lock:
+                while self._reconciling and not self._ready:
+                    self._walk_done.wait()
+                if self._ready:
+                    return
+            self.reconcile()
+
+    # ----- queries -----
+
+    @property
+    def total_bytes(self) -> int:
+        return self._ledger.total_bytes
+
+    @property
+    def total_files(self) -> int:
+        return self._ledger.total_files
+
+    def totals(self) -> dict:
+        """Whole-folder usage, each stored file counted once (constant time)"""
+        ledger = self._ledger
+        return {
+            "size_bytes": ledger.total_bytes,
+            "size_mb": round(ledger.total_bytes / MB, 2),
+            "file_count": ledger.total_files,
+            "ready": self._ready,
+            "reconciled_at": self.reconciled_at,
+        }
+
+    def usage(self) -> Dict[Tuple[str, str], Dict[str, int]]:
+        """Media file counters per (username, media_type)"""
+        with self._lock:
+            return {group: dict(counters) for group, counters in self._ledger.groups.items()}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self.totals(),
+                "tracked_paths": len(self._ledger.paths),
+                "groups": len(self._ledger.groups),
+                "updates": self.updates,
+                "reconciles": self.reconciles,
+                "last_reconcile_seconds": round(self.last_reconcile_seconds, 3),
+                "last_drift_bytes": self.last_drift_bytes,
+            }
@@ -1,13 +1,25 @@
 import os
-from supabase import create_client, Client
 from loguru import logger
 from typing import List, Dict, Optional, Any
 from datetime import datetime, timedelta
 import asyncio
+import time
+from collections import Counter
+
+from server.postgrest_client import PostgrestClient, PostgrestError, PostgrestNetworkError
+
+# Rows per upsert when marking stories processed in bulk
+PROCESSED_BATCH_SIZE = 100
+
+# Seconds cache stats and the cached-username list are reused before re-reading
+STATS_TTL = float(os.getenv("SUPABASE_STATS_TTL", "60"))
+
+# Distinct (project_namespace, username) pairs of the stories cache (see SUPABASE_NAMESPACE_MIGRATION.sql)
+CACHED_USERNAMES_VIEW = "snapchat_cached_usernames"
 
 class SnapchatSupabaseManager:
     def __init__(self):
-        self.client: Client = None
+        self.client: Optional[PostgrestClient] = None
         self.is_connected = False
         
         # Supabase configuration (same as Instagram)
@@ -17,12 +29,28 @@ class SnapchatSupabaseManager:
         # Project namespace for data separation (default: 'tyla' for backward compatibility)
         self.project_namespace = os.getenv("PROJECT_NAMESPACE", "tyla")
         logger.info(f"📁 Using project namespace: {self.project_namespace}")
+        
+        # Last known Supabase cache rows per user: cache key -> (story_url, story_type, story_order)
+        self._cache_snapshots: Dict[str, Dict[str, tuple]] = {}
+        self.cache_writes_skipped = 0
+        
+        # (expires_at, value) of the short-lived aggregate caches
+        self._stats_cache: Optional[tuple] = None
+        self._usernames_cache: Optional[tuple] = None
+        self._stats_lock = asyncio.Lock()
+        self._usernames_view = True
     
     async def connect(self) -> bool:
         """Connect to Supabase"""
         try:
             logger.info("🔌 Connecting to Supabase for Snapchat...")
-            self.client = create_client(self.supabase_url, self.supabase_key)
+            # One pooled keep-alive session to PostgREST, reused across reconnects
+            if self.client is None:
+                self.client = PostgrestClient(
+                    self.supabase_url,
+                    self.supabase_key,
+                    timeout=float(os.getenv("SUPABASE_TIMEOUT", "10")),
+                )
             
             # Test connection
             is_healthy = await self.health_check()
@@ -42,6 +70,8 @@ class SnapchatSupabaseManager:
     async def disconnect(self):
         """Disconnect from Supabase"""
         self.is_connected = False
+        if self.client is not None:
+            await self.client.close()
         logger.info("🔌 Snapchat Supabase disconnected")
     
     async def health_check(self) -> bool:
@@ -55,8 +85,8 @@ class SnapchatSupabaseManager:
             try:
                 # Test basic client functionality with timeout
                 test_response = await asyncio.wait_for(
-                    asyncio.to_thread(
-                        lambda: self.client.table("_test_connection").select("*").limit(1).execute()
+                    (
+                        self.client.table("_test_connection").select("*").limit(1).execute()
                     ),
                     timeout=5.0
                 )
@@ -100,6 +130,8 @@ class SnapchatSupabaseManager:
     # Helper method to check for network errors
     def _is_network_error(self, error: Exception) -> bool:
         """Check if an error is a network/DNS error"""
+        if isinstance(error, PostgrestNetworkError):
+            return True
         error_str = str(error).lower()
         return (
             "getaddrinfo" in error_str or
@@ -117,8 +149,8 @@ class SnapchatSupabaseManager:
                 logger.warning("⚠️ Supabase not connected, returning empty cache")
                 return []
             
-            response = await asyncio.to_thread(
-                lambda: self.client.table("snapchat_recent_stories_cache")
+            response = await (
+                self.client.table("snapchat_recent_stories_cache")
                     .select("*")
                     .eq("project_namespace", self.project_namespace)
                     .eq("username", username)
@@ -128,6 +160,7 @@ class SnapchatSupabaseManager:
             
             # No need to check response.error as Supabase client handles errors differently
             
+            self._cache_snapshots[username] = self._snapshot(response.data)
             return [
                 {
                     "story_url": story["story_url"],
@@ -148,66 +181,124 @@ class SnapchatSupabaseManager:
                 logger.error(f"❌ Failed to get cached stories for @{username}: {error}")
             return []
     
+    @staticmethod
+    def _cache_key(row: Dict[str, Any]) -> str:
+        """Identity of a cache row: its snap_id, or its URL for rows without one"""
+        return row.get("snap_id") or row.get("story_url")
+
+    def _snapshot(self, rows: List[Dict[str, Any]]) -> Dict[str, tuple]:
+        return {
+            self._cache_key(row): (row.get("story_url"), row.get("story_type"), row.get("story_order"))
+            for row in rows
+        }
+
     async def update_recent_stories_cache(self, username: str, stories: List[Dict[str, Any]]) -> bool:
-        """Update stories cache (Snapchat equivalent of updateRecentPostsCache)"""
+        """Update stories cache (Snapchat equivalent of updateRecentPostsCache)
+        
+        Only the difference to the cached rows is written: targeted deletes for
+        stories that are gone and an upsert for new or reordered stories (rows
+        without a snap_id are deleted and re-inserted by URL). Nothing is written
+        when the cache already holds these stories.
+        """
         try:
             if not self.is_connected:
                 logger.warning("⚠️ Supabase not connected, skipping cache update")
                 return False
             
-            # Remove old cache entries for this user
-            try:
-                await asyncio.to_thread(
-                    lambda: self.client.table("snapchat_recent_stories_cache")
-                        .delete()
+            current = self._cache_snapshots.get(username)
+            if current is None:
+                response = await (
+                    self.client.table("snapchat_recent_stories_cache")
+                        .select("snap_id, story_url, story_type, story_order")
                         .eq("project_namespace", self.project_namespace)
                         .eq("username", username)
                         .execute()
                 )
-            except Exception as delete_error:
-                if self._is_network_error(delete_error):
-                    logger.error(f"❌ Supabase network error deleting cache for @{username} - marking as disconnected")
-                    self.is_connected = False
-                else:
-                    logger.error(f"❌ Failed to delete old cache for @{username}: {delete_error}")
-                return False
-            
-            if not stories:
-                logger.info(f"📊 Stories cache cleared for @{username}")
-                return True
-            
-            # Prepare new cache entries
-            cache_entries = []
-            for i, story in enumerate(stories):
-                cache_entries.append({
+                current = self._snapshot(response.data)
+                # URL-keyed rows duplicated by earlier writes count as changed, so
+                # the rewrite below leaves one row per URL
+                url_counts = Counter(row.get("story_url") for row in response.data if not row.get("snap_id"))
+                for url, count in url_counts.items():
+                    if count > 1:
+                        current[url] = (url, None, None)
+            
+            # Wanted cache entries, keyed like the snapshot (first occurrence wins)
+            wanted = {}
+            for story in stories:
+                entry = {
                     "project_namespace": self.project_namespace,
                     "username": username,
                     "story_url": story["url"],
                     "snap_id": story.get("snap_id"),
                     "story_type": story.get("type", "photo"),
-                    "story_order": i + 1
-                })
+                    "story_order": len(wanted) + 1
+                }
+                wanted.setdefault(self._cache_key(entry), entry)
             
-            # Insert new cache entries
-            if cache_entries:
-                try:
-                    await asyncio.to_thread(
-                        lambda: self.client.table("snapchat_recent_stories_cache")
-                            .insert(cache_entries)
-                            .execute()
-                    )
-                except Exception as insert_error:
-                    if self._is_network_error(insert_error):
-                        logger.error(f"❌ Supabase network error inserting cache for @{username} - marking as disconnected")
-                        self.is_connected = False
-                    else:
-                        logger.error(f"❌ Failed to insert cache for @{username}: {insert_error}")
-                    return False
+            removed = [key for key in current if key not in wanted]
+            changed = [
+                entry for key, entry in wanted.items()
+                if current.get(key) != (entry["story_url"], entry["story_type"], entry["story_order"])
+            ]
+            if not removed and not changed:
+                self.cache_writes_skipped += 1
+                self._cache_snapshots[username] = current
+                logger.debug(f"📊 Stories cache unchanged for @{username}, nothing written")
+                return True
             
-            logger.info(f"✅ Updated Supabase stories cache with {len(stories)} stories for @{username}")
+            # Drop the snapshot until the writes succeed; the next update re-reads the rows
+            self._cache_snapshots.pop(username, None)
+            # Rows without a snap_id never conflict on (username, snap_id), so an upsert
+            # would duplicate them: they are deleted by URL and inserted again instead
+            changed_snap_ids = [entry for entry in changed if entry["snap_id"]]
+            changed_urls = [entry for entry in changed if not entry["snap_id"]]
+            removed_snap_ids = [key for key in removed if current[key][0] != key]
+            removed_urls = [key for key in removed if current[key][0] == key]
+            removed_urls += [entry["story_url"] for entry in changed_urls if entry["story_url"] in current]
+            if removed_snap_ids:
+                await (
+                    self.client.table("snapchat_recent_stories_cache")
+                        .delete()
+                        .eq("project_namespace", self.project_namespace)
+                        .eq("username", username)
+                        .in_("snap_id", removed_snap_ids)
+                        .execute()
+                )
+            if removed_urls:
+                await (
+                    self.client.table("snapchat_recent_stories_cache")
+                        .delete()
+                        .eq("project_namespace", self.project_namespace)
+                        .eq("username", username)
+                        .is_("snap_id", "null")
+                        .in_("story_url", removed_urls)
+                        .execute()
+                )
+            
+            if changed:
+                cached_at = datetime.now().isoformat()
+                for entry in changed:
+                    entry["cached_at"] = cached_at
+            if changed_snap_ids:
+                await (
+                    self.client.table("snapchat_recent_stories_cache")
+                        .upsert(changed_snap_ids, on_conflict="username,snap_id", returning="minimal")
+                        .execute()
+                )
+            if changed_urls:
+                await (
+                    self.client.table("snapchat_recent_stories_cache")
+                        .insert(changed_urls, returning="minimal")
+                        .execute()
+                )
+            
+            self._cache_snapshots[username] = self._snapshot(list(wanted.values()))
+            self._note_cached_username(username, bool(wanted))
+            logger.info(f"✅ Updated Supabase stories cache for @{username}: {len(changed)} upserted, {len(removed)} removed ({len(wanted)} cached)")
             return True
             
         except Exception as error:
+            self._cache_snapshots.pop(username, None)
             if self._is_network_error(error):
                 logger.error(f"❌ Supabase network error updating cache for @{username} - marking as disconnected")
                 self.is_connected = False
@@ -222,8 +313,8 @@ class SnapchatSupabaseManager:
             if not self.is_connected:
                 return False
             
-            response = await asyncio.to_thread(
-                lambda: self.client.table("snapchat_processed_stories")
+            response = await (
+                self.client.table("snapchat_processed_stories")
                     .select("*")
                     .eq("project_namespace", self.project_namespace)
                     .eq("snap_id", snap_id)
@@ -245,37 +336,93 @@ class SnapchatSupabaseManager:
     
     async def mark_story_processed(self, snap_id: str, username: str, story_url: str, story_type: str) -> bool:
         """Mark story as processed (Snapchat equivalent of markPostAsProcessed)"""
-        try:
-            if not self.is_connected:
-                return False
-            
-            story_data = {
+        stored = await self.mark_stories_processed(username, [{"snap_id": snap_id, "url": story_url, "type": story_type}])
+        return stored == 1
+    
+    async def mark_stories_processed(self, username: str, stories: List[Dict[str, Any]],
+                                     batch_size: int = PROCESSED_BATCH_SIZE, retries: int = 3) -> int:
+        """Mark stories as processed with one upsert per batch of ``batch_size``
+        
+        Stories with the same snap_id are written once. A failed batch is retried
+        with backoff; a network error marks the manager disconnected and stops.
+        Returns how many distinct stories were stored: the first ones in order of
+        first appearance, so callers can resume after the last stored one.
+        """
+        if not self.is_connected:
+            return 0
+        
+        processed_at = datetime.now().isoformat()
+        rows = {}
+        for story in stories:
+            snap_id = story.get("snap_id")
+            rows[f"{username}_{snap_id}"] = {
                 "id": f"{username}_{snap_id}",
                 "project_namespace": self.project_namespace,
                 "username": username,
-                "story_url": story_url,
-                "story_type": story_type,
+                "story_url": story.get("url") or story.get("story_url"),
+                "story_type": story.get("type") or story.get("story_type") or "photo",
                 "snap_id": snap_id,
-                "processed_at": datetime.now().isoformat()
+                "processed_at": story.get("processed_at") or processed_at
             }
-            
-            await asyncio.to_thread(
-                lambda: self.client.table("snapchat_processed_stories")
-                    .upsert(story_data)
-                    .execute()
-            )
-            
-            logger.info(f"✅ Marked story {snap_id} as processed for @{username}")
-            return True
-            
+        # One row per id: an upsert may not touch the same row twice
+        rows = list(rows.values())
+        
+        stored = 0
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            for attempt in range(retries):
+                try:
+                    await (
+                        self.client.table("snapchat_processed_stories")
+                            .upsert(batch, returning="minimal")
+                            .execute()
+                    )
+                    break
+                except Exception as error:
+                    if self._is_network_error(error):
+                        logger.error(f"❌ Supabase network error marking {len(batch)} stories for @{username} - marking as disconnected")
+                        self.is_connected = False
+                        return stored
+                    if attempt == retries - 1:
+                        logger.error(f"❌ Failed to mark {len(batch)} stories as processed for @{username}: {error}")
+                        return stored
+                    logger.warning(f"⚠️ Marking {len(batch)} stories for @{username} failed (attempt {attempt + 1}/{retries}), retrying: {error}")
+                    await asyncio.sleep(0.5 * 2 ** attempt)
+            stored += len(batch)
+        
+        duplicates = f" ({len(stories) - stored} duplicates skipped)" if stored < len(stories) else ""
+        logger.info(f"✅ Marked {stored} stories as processed for @{username}{duplicates}")
+        return stored
+    
+    async def get_processed_stories(self, page_size: int = 1000) -> Optional[List[Dict[str, Any]]]:
+        """Get every processed story of this namespace (None if Supabase could not be read)"""
+        try:
+            if not self.is_connected:
+                return None
+
+            rows = []
+            while True:
+                start = len(rows)
+                response = await (
+                    self.client.table("snapchat_processed_stories")
+                        .select("username, snap_id, story_url, story_type, processed_at")
+                        .eq("project_namespace", self.project_namespace)
+                        .order("processed_at")
+                        .range(start, start + page_size - 1)
+                        .execute()
+                )
+                rows.extend(response.data)
+                if len(response.data) < page_size:
+                    return rows
+
         except Exception as error:
             if self._is_network_error(error):
-                logger.error(f"❌ Supabase network error marking story {snap_id} - marking as disconnected")
+                logger.error("❌ Supabase network error getting processed stories - marking as disconnected")
                 self.is_connected = False
             else:
-                logger.error(f"❌ Failed to mark story {snap_id} as processed: {error}")
-            return False
-    
+                logger.error(f"❌ Failed to get processed stories: {error}")
+            return None
+
     # Cache cleanup functions
     async def clean_expired_snapchat_cache(self) -> Dict[str, int]:
         """Clean expired Snapchat cache (complete wipe every 2 weeks)"""
@@ -289,16 +436,19 @@ class SnapchatSupabaseManager:
             two_weeks_ago = datetime.now() - timedelta(days=14)
             
             # Complete wipe of stories cache for this namespace (not selective like Instagram)
-            cache_response = self.client.table("snapchat_recent_stories_cache").delete().eq("project_namespace", self.project_namespace).lt("cached_at", two_weeks_ago.isoformat()).execute()
+            self._cache_snapshots.clear()
+            self._stats_cache = None
+            self._usernames_cache = None
+            cache_response = await self.client.table("snapchat_recent_stories_cache").delete().eq("project_namespace", self.project_namespace).lt("cached_at", two_weeks_ago.isoformat()).execute()
             
             # Complete wipe of processed stories for this namespace (not selective like Instagram)
-            processed_response = self.client.table("snapchat_processed_stories").delete().eq("project_namespace", self.project_namespace).lt("processed_at", two_weeks_ago.isoformat()).execute()
+            processed_response = await self.client.table("snapchat_processed_stories").delete().eq("project_namespace", self.project_namespace).lt("processed_at", two_weeks_ago.isoformat()).execute()
             
             stories_removed = len(cache_response.data) if cache_response.data else 0
             processed_removed = len(processed_response.data) if processed_response.data else 0
             
             # Log cleanup
-            self.update_snapchat_cleanup_log(stories_removed + processed_removed)
+            await self.update_snapchat_cleanup_log(stories_removed + processed_removed)
             
             logger.info(f"✅ Snapchat cache cleanup completed: {stories_removed} stories, {processed_removed} processed removed")
             return {"stories_removed": stories_removed, "processed_removed": processed_removed}
@@ -310,7 +460,7 @@ class SnapchatSupabaseManager:
     async def update_snapchat_cleanup_log(self, stories_removed: int) -> None:
         """Update cleanup log for Snapchat"""
         try:
-            self.client.table("snapchat_cache_cleanup_log").insert({
+            await self.client.table("snapchat_cache_cleanup_log").insert({
                 "project_namespace": self.project_namespace,
                 "stories_removed": stories_removed,
                 "cleaned_at": datetime.now().isoformat()
@@ -320,50 +470,119 @@ class SnapchatSupabaseManager:
             logger.error(f"❌ Failed to update Snapchat cleanup log: {error}")
     
     # Cache statistics
-    def get_snapchat_cache_stats(self) -> Dict[str, Any]:
-        """Get Snapchat cache statistics"""
+    async def get_snapchat_cache_stats(self, max_age: float = STATS_TTL) -> Dict[str, Any]:
+        """Get Snapchat cache statistics for this namespace
+        
+        Row counts are planner estimates read with HEAD requests (no rows are
+        transferred or counted one by one), and the result is reused for
+        ``max_age`` seconds, so polls and dashboards do not scale with table size.
+        """
         try:
             if not self.is_connected:
                 return {"connected": False, "error": "Not connected to Supabase"}
             
-            # Get counts using a more robust approach
-            def safe_get_count(table_name: str) -> int:
-                try:
-                    response = self.client.table(table_name).select("*", count="exact").execute()
-                    return response.count if hasattr(response, 'count') and response.count is not None else 0
-                except Exception as e:
-                    logger.warning(f"⚠️ Failed to get count for {table_name}: {e}")
-                    return 0
-            
-            cache_count = safe_get_count("snapchat_recent_stories_cache")
-            processed_count = safe_get_count("snapchat_processed_stories")
-            cleanup_count = safe_get_count("snapchat_cache_cleanup_log")
-            
-            stats = {
-                "connected": True,
-                "collections": {
-                    "snapchat_recent_stories_cache": cache_count,
-                    "snapchat_processed_stories": processed_count,
-                    "snapchat_cache_cleanup_log": cleanup_count
-                },
-                "last_cleanup": None
-            }
-            
-            # Get last cleanup date
-            if cleanup_count > 0:
-                try:
-                    last_cleanup_response = self.client.table("snapchat_cache_cleanup_log").select("cleaned_at").eq("project_namespace", self.project_namespace).order("cleaned_at", desc=True).limit(1).execute()
-                    if last_cleanup_response.data:
-                        stats["last_cleanup"] = last_cleanup_response.data[0]["cleaned_at"]
-                except Exception as e:
-                    logger.warning(f"⚠️ Failed to get last cleanup date: {e}")
+            cached = self._stats_cache
+            if cached and cached[0] > time.monotonic():
+                return dict(cached[1])
             
-            return stats
+            async with self._stats_lock:
+                # Another caller may have refreshed it while we waited
+                cached = self._stats_cache
+                if cached and cached[0] > time.monotonic():
+                    return dict(cached[1])
+                
+                async def safe_get_count(table_name: str) -> int:
+                    try:
+                        response = await (
+                            self.client.table(table_name)
+                                .select("project_namespace", count="estimated", head=True)
+                                .eq("project_namespace", self.project_namespace)
+                                .execute()
+                        )
+                        return response.count if response.count is not None else 0
+                    except Exception as e:
+                        logger.warning(f"⚠️ Failed to get count for {table_name}: {e}")
+                        return 0
+                
+                cache_count, processed_count, cleanup_count, last_cleanup = await asyncio.gather(
+                    safe_get_count("snapchat_recent_stories_cache"),
+                    safe_get_count("snapchat_processed_stories"),
+                    safe_get_count("snapchat_cache_cleanup_log"),
+                    self.get_last_cleanup_date(),
+                )
+                
+                stats = {
+                    "connected": True,
+                    "collections": {
+                        "snapchat_recent_stories_cache": cache_count,
+                        "snapchat_processed_stories": processed_count,
+                        "snapchat_cache_cleanup_log": cleanup_count
+                    },
+                    "counts": "estimated",
+                    "last_cleanup": last_cleanup
+                }
+                self._stats_cache = (time.monotonic() + max_age, stats)
+                return dict(stats)
             
         except Exception as error:
             logger.error(f"❌ Failed to get Snapchat cache stats: {error}")
             return {"connected": False, "error": str(error)}
     
+    async def get_cached_usernames(self, max_age: float = STATS_TTL) -> List[str]:
+        """Usernames with cached stories in this namespace, sorted (reused for ``max_age`` seconds)"""
+        if not self.is_connected:
+            return []
+        
+        cached = self._usernames_cache
+        if cached and cached[0] > time.monotonic():
+            return list(cached[1])
+        
+        try:
+            if self._usernames_view:
+                try:
+                    response = await (
+                        self.client.table(CACHED_USERNAMES_VIEW)
+                            .select("username")
+                            .eq("project_namespace", self.project_namespace)
+                            .order("username")
+                            .execute()
+                    )
+                    usernames = [row["username"] for row in response.data]
+                except PostgrestError as error:
+                    if isinstance(error, PostgrestNetworkError) or error.code not in ("PGRST205", "42P01"):
+                        raise
+                    logger.warning(f"⚠️ {CACHED_USERNAMES_VIEW} view missing (see SUPABASE_NAMESPACE_MIGRATION.sql) - falling back to reading every cached row")
+                    self._usernames_view = False
+            if not self._usernames_view:
+                response = await (
+                    self.client.table("snapchat_recent_stories_cache")
+                        .select("username")
+                        .eq("project_namespace", self.project_namespace)
+                        .execute()
+                )
+                usernames = sorted({row["username"] for row in response.data})
+            
+            self._usernames_cache = (time.monotonic() + max_age, usernames)
+            return list(usernames)
+            
+        except Exception as error:
+            if self._is_network_error(error):
+                logger.error("❌ Supabase network error getting cached usernames - marking as disconnected")
+                self.is_connected = False
+            else:
+                logger.error(f"❌ Failed to get cached usernames: {error}")
+            return []
+    
+    def _note_cached_username(self, username: str, cached: bool):
+        """Keep the reused username list in step with this process's own cache writes"""
+        if self._usernames_cache is None:
+            return
+        expires_at, usernames = self._usernames_cache
+        if cached and username not in usernames:
+            self._usernames_cache = (expires_at, sorted(usernames + [username]))
+        elif not cached and username in usernames:
+            self._usernames_cache = (expires_at, [name for name in usernames if name != username])
+    
     # Get last cleanup date
     async def get_last_cleanup_date(self) -> Optional[str]:
         """Get the last cleanup date for Snapchat"""
@@ -371,7 +590,7 @@ class SnapchatSupabaseManager:
             if not self.is_connected:
                 return None
             
-            response = self.client.table("snapchat_cache_cleanup_log").select("cleaned_at").eq("project_namespace", self.project_namespace).order("cleaned_at", desc=True).limit(1).execute()
+            response = await self.client.table("snapchat_cache_cleanup_log").select("cleaned_at").eq("project_namespace", self.project_namespace).order("cleaned_at", desc=True).limit(1).execute()
             
             if response.data:
                 return response.data[0]["cleaned_at"]
@@ -382,14 +601,16 @@ class SnapchatSupabaseManager:
             return None
 
     # Clear cache for specific user (Supabase version)
-    async def clear_user_cache(self, username: str) -> int:
-        """Clear cache for specific user (Supabase version)"""
+    async def clear_user_cache(self, username: str) -> Optional[int]:
+        """Clear cache for specific user (Supabase version); None if the delete failed"""
         try:
             if not self.is_connected:
                 logger.warning("⚠️ Supabase not connected, cannot clear cache")
-                return 0
+                return None
             
-            response = self.client.table("snapchat_recent_stories_cache").delete().eq("project_namespace", self.project_namespace).eq("username", username).execute()
+            self._cache_snapshots.pop(username, None)
+            self._note_cached_username(username, False)
+            response = await self.client.table("snapchat_recent_stories_cache").delete().eq("project_namespace", self.project_namespace).eq("username", username).execute()
             
             deleted_count = len(response.data) if response.data else 0
             logger.info(f"🗑️ Cleared cache for @{username} ({deleted_count} entries) (Supabase)")
@@ -397,17 +618,17 @@ class SnapchatSupabaseManager:
             
         except Exception as error:
             logger.error(f"❌ Error clearing cache for @{username}: {error}")
-            return 0
+            return None
 
     # Clear processed stories for specific user (Supabase version)
-    async def clear_user_processed_stories(self, username: str) -> int:
-        """Clear processed stories for specific user (Supabase version)"""
+    async def clear_user_processed_stories(self, username: str) -> Optional[int]:
+        """Clear processed stories for specific user (Supabase version); None if the delete failed"""
         try:
             if not self.is_connected:
                 logger.warning("⚠️ Supabase not connected, cannot clear processed stories")
-                return 0
+                return None
             
-            response = self.client.table("snapchat_processed_stories").delete().eq("project_namespace", self.project_namespace).eq("username", username).execute()
+            response = await self.client.table("snapchat_processed_stories").delete().eq("project_namespace", self.project_namespace).eq("username", username).execute()
             
             deleted_count = len(response.data) if response.data else 0
             logger.info(f"🗑️ Cleared processed stories for @{username} ({deleted_count} entries) (Supabase)")
@@ -415,25 +636,27 @@ class SnapchatSupabaseManager:
             
         except Exception as error:
             logger.error(f"❌ Error clearing processed stories for @{username}: {error}")
-            return 0
+            return None
 
     # Clear all data for specific user (cache + processed stories) (Supabase version)
-    async def clear_user_data(self, username: str) -> Dict[str, int]:
-        """Clear all data for specific user (cache + processed stories) (Supabase version)"""
+    async def clear_user_data(self, username: str) -> Optional[Dict[str, int]]:
+        """Clear all data for specific user (cache + processed stories) (Supabase version); None if a delete failed"""
         try:
             if not self.is_connected:
                 logger.warning("⚠️ Supabase not connected, cannot clear user data")
-                return {"processed_deleted": 0, "cache_deleted": 0}
+                return None
             
             # Clear both cache and processed stories concurrently
             cache_task = self.clear_user_cache(username)
             processed_task = self.clear_user_processed_stories(username)
             
             cache_deleted, processed_deleted = await asyncio.gather(cache_task, processed_task)
+            if cache_deleted is None or processed_deleted is None:
+                return None
             
             logger.info(f"🧹 Cleared all data for @{username} (processed: {processed_deleted}, cache: {cache_deleted}) (Supabase)")
             return {"processed_deleted": processed_deleted, "cache_deleted": cache_deleted}
             
         except Exception as error:
             logger.error(f"❌ Error clearing user data for @{username}: {error}")
-            return {"processed_deleted": 0, "cache_deleted": 0}
+            return None
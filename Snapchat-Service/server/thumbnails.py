@@ -0,0 +1,392 @@
+import asyncio
+import importlib.util
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from loguru import logger
+
+THUMBNAIL_DIR = ".thumbnails"
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".webm", ".mkv")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+RENDER_BACKENDS = ("cv2", "imageio")
+
+# Width presets; the gallery advertises all of them in srcset
+THUMBNAIL_WIDTHS = (160, 320, 640)
+DEFAULT_WIDTH = 320
+# format -> (file extension, content type, encoder quality)
+FORMATS = {
+    "avif": ("avif", "image/avif", 50),
+    "webp": ("webp", "image/webp", 75),
+    "jpeg": ("jpg", "image/jpeg", 80),
+}
+# Preset files never change for a given source, so clients may keep them
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def is_video(filename: str) -> bool:
+    return filename.lower().endswith(VIDEO_EXTENSIONS)
+
+
+def is_image(filename: str) -> bool:
+    return filename.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def thumbnail_path(video_path: str) -> str:
+    """Where the full-size first frame of a video is cached: <folder>/.thumbnails/<name>.jpg"""
+    folder, filename = os.path.split(video_path)
+    return os.path.join(folder, THUMBNAIL_DIR, f"{os.path.splitext(filename)[0]}.jpg")
+
+
+def preset_path(source_path: str, width: int, image_format: str) -> str:
+    """Where one width preset is cached: <folder>/.thumbnails/<name>.w<width>.<ext>"""
+    folder, filename = os.path.split(source_path)
+    extension = FORMATS[image_format][0]
+    return os.path.join(folder, THUMBNAIL_DIR, f"{os.path.splitext(filename)[0]}.w{width}.{extension}")
+
+
+def is_fresh(video_path: str, thumb_path: str) -> bool:
+    """True if the cached thumbnail exists and is not older than the video"""
+    try:
+        return os.stat(thumb_path).st_mtime >= os.stat(video_path).st_mtime
+    except OSError:
+        return False
+
+
+def file_etag(path: str) -> str:
+    st = os.stat(path)
+    return f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+
+def available_formats() -> Set[str]:
+    """Output formats an encoder is installed for (Pillow, else OpenCV)"""
+    try:
+        from PIL import Image
+        try:
+            import pillow_avif  # noqa: F401  (AVIF plugin for Pillow < 11.2)
+        except ImportError:
+            pass
+        Image.init()
+        return {name for name in FORMATS if name.upper() in Image.SAVE}
+    except ImportError:
+        pass
+    if importlib.util.find_spec("cv2"):
+        return {"webp", "jpeg"}
+    return set()
+
+
+def render_thumbnail(video_path: str, thumb_path: str) -> bool:
+    """Save the first frame of a video as JPEG (runs in a worker process)
+
+    Uses OpenCV, falling back to imageio. The frame is written under a
+    temporary name and renamed into place, so readers never see a partial
+    file.
+    """
+    os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+    tmp_path = f"{os.path.splitext(thumb_path)[0]}.{os.getpid()}.tmp.jpg"
+    written = False
+    try:
+        import cv2
+        video = cv2.VideoCapture(video_path)
+        try:
+            if video.isOpened():
+                ret, frame = video.read()
+                written = bool(ret) and cv2.imwrite(tmp_path, frame)
+        finally:
+            video.release()
+    except ImportError:
+        try:
+            import imageio
+            reader = imageio.get_reader(video_path)
+            try:
+                imageio.imwrite(tmp_path, reader.get_data(0))
+                written = True
+            finally:
+                reader.close()
+        except ImportError:
+            logger.warning("⚠️ Neither OpenCV nor imageio available for thumbnail generation")
+    if not written:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+    os.replace(tmp_path, thumb_path)
+    return True
+
+
+def _first_frame_rgb(video_path: str):
+    """First frame of a video as an RGB array, or None"""
+    try:
+        import cv2
+    except ImportError:
+        import imageio
+        reader = imageio.get_reader(video_path)
+        try:
+            return reader.get_data(0)
+        finally:
+            reader.close()
+    video = cv2.VideoCapture(video_path)
+    try:
+        ret, frame = video.read() if video.isOpened() else (False, None)
+    finally:
+        video.release()
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) if ret else None
+
+
+def _scaled_size(size: Tuple[int, int], width: int) -> Tuple[int, int]:
+    # Never upscale: narrow sources keep their own size
+    source_width, source_height = size
+    width = min(width, source_width)
+    return width, max(1, round(source_height * width / source_width))
+
+
+def render_presets(source_path: str, video: bool, outputs: Sequence[Tuple[int, str]], image_format: str) -> List[int]:
+    """Decode a source once and write every (width, path) preset of it (runs in a worker process)
+
+    Encodes with Pillow when installed, else with OpenCV. Each preset is
+    written under a temporary name and renamed into place.
+
+    Returns:
+        The widths that were written
+    """
+    try:
+        from PIL import Image, ImageOps
+        try:
+            import pillow_avif  # noqa: F401
+        except ImportError:
+            pass
+    except ImportError:
+        Image = None
+
+    if video:
+        frame = _first_frame_rgb(source_path)
+        if frame is None:
+            return []
+        source = Image.fromarray(frame) if Image else frame
+    elif Image:
+        with Image.open(source_path) as opened:
+            source = ImageOps.exif_transpose(opened).convert("RGB")
+    else:
+        import cv2
+        frame = cv2.imread(source_path)
+        if frame is None:
+            return []
+        source = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+    quality = FORMATS[image_format][2]
+    written = []
+    for width, path in outputs:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        root, extension = os.path.splitext(path)
+        tmp_path = f"{root}.{os.getpid()}.tmp{extension}"
+        if Image:
+            size = _scaled_size(source.size, width)
+            resized = source.resize(size, Image.LANCZOS) if size != source.size else source
+            resized.save(tmp_path, format=image_format.upper(), quality=quality)
+        else:
+            import cv2
+            height, source_width = source.shape[:2]
+            size = _scaled_size((source_width, height), width)
+            resized = cv2.resize(source, size, interpolation=cv2.INTER_AREA) if size[0] != source_width else source
+            flag = cv2.IMWRITE_WEBP_QUALITY if image_format == "webp" else cv2.IMWRITE_JPEG_QUALITY
+            if not cv2.imwrite(tmp_path, cv2.cvtColor(resized, cv2.COLOR_RGB2BGR), [flag, quality]):
+                continue
+        os.replace(tmp_path, path)
+        written.append(width)
+    return written
+
+
+class ThumbnailService:
+    """Thumbnails cached on disk and rendered in a bounded process pool
+
+    Two kinds of thumbnails are kept under ``.thumbnails/``:
+
+    - width presets (``<name>.w320.webp``) of images and videos, rendered
+      together from one decode of the source in the most compact format an
+      encoder is installed for (AVIF, WebP, then JPEG); these are what the
+      gallery advertises through ``thumbnail_url`` and ``srcset``;
+    - the full-size first frame of a video as JPEG, for the original
+      ``/thumbnail`` URL.
+
+    Requests are served from the cache whenever the cached file is at least
+    as new as the source; otherwise the render is queued in the pool and
+    awaited without blocking the event loop. Concurrent requests for the
+    same source share one render. Registered as a media index listener,
+    the service also renders the presets as soon as a download completes,
+    so the gallery usually finds its thumbnails ready.
+    """
+
+    def __init__(
+        self,
+        downloads_dir: str,
+        media_index=None,
+        workers: int = 2,
+        widths: Sequence[int] = THUMBNAIL_WIDTHS,
+        image_format: str = "webp",
+    ):
+        self.downloads_dir = downloads_dir
+        self.media_index = media_index
+        self.workers = workers
+        self.widths = tuple(sorted(widths))
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending: Dict[Tuple[str, str], Future] = {}
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+        self.failed = 0
+        self.pregenerated = 0
+        self.not_modified = 0
+        # Without a decoder there is nothing to render; callers serve the video instead
+        self.available = any(importlib.util.find_spec(name) for name in RENDER_BACKENDS)
+        if not self.available:
+            logger.warning("⚠️ [THUMBNAILS] Neither OpenCV nor imageio available; video thumbnails disabled")
+        formats = available_formats()
+        self.format = next(
+            (name for name in (image_format, "webp", "jpeg") if name in FORMATS and name in formats),
+            None,
+        )
+        if self.format is None:
+            logger.warning("⚠️ [THUMBNAILS] Neither Pillow nor OpenCV available; thumbnail presets disabled")
+        elif self.format != image_format:
+            logger.warning(f"⚠️ [THUMBNAILS] No {image_format} encoder installed; using {self.format}")
+        if media_index is not None:
+            media_index.add_listener(self.on_change)
+
+    def _pool(self) -> ProcessPoolExecutor:
+        # Workers are started on first use, not at import time
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def _done(self, key: Tuple[str, str], future: Future):
+        with self._lock:
+            self._pending.pop(key, None)
+            if future.cancelled():
+                return
+            if future.exception() is None and future.result():
+                self.generated += 1
+                return
+            self.failed += 1
+        error = future.exception()
+        logger.warning(f"⚠️ [THUMBNAILS] Could not render {os.path.basename(key[1])}{f': {error}' if error else ''}")
+
+    def _submit(self, key: Tuple[str, str], fn, *args) -> Future:
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                future = self._pool().submit(fn, *args)
+                self._pending[key] = future
+                future.add_done_callback(lambda f: self._done(key, f))
+            return future
+
+    def submit(self, video_path: str) -> Future:
+        """Queue a render of the full-size first frame of ``video_path``, joining one already in flight"""
+        return self._submit(("frame", video_path), render_thumbnail, video_path, thumbnail_path(video_path))
+
+    def submit_presets(self, source_path: str) -> Future:
+        """Queue a render of every width preset of ``source_path``, joining one already in flight"""
+        outputs = [(width, preset_path(source_path, width, self.format)) for width in self.widths]
+        return self._submit(
+            ("presets", source_path), render_presets,
+            source_path, is_video(source_path), outputs, self.format,
+        )
+
+    def has_presets(self, filename: str) -> bool:
+        """Whether width presets can be rendered for this file"""
+        if self.format is None:
+            return False
+        return is_image(filename) or (is_video(filename) and self.available)
+
+    def preset_width(self, requested: int) -> int:
+        """The smallest preset at least ``requested`` wide (the largest if none is)"""
+        return next((width for width in self.widths if width >= requested), self.widths[-1])
+
+    def content_type(self) -> str:
+        return FORMATS[self.format][1]
+
+    def urls(self, username: str, media_type: str, filename: str, thumbnail_url: str) -> Tuple[str, Optional[str]]:
+        """Gallery ``thumbnail_url`` and ``srcset`` for an item
+
+        Local items point at a preset; external video previews (Snapchat
+        CDN) are kept as the fallback URL, with the presets in srcset.
+        """
+        if not self.has_presets(filename):
+            return thumbnail_url, None
+        base = f"/thumbnail/{username}/{media_type}/{filename}"
+        srcset = ", ".join(f"{base}?w={width} {width}w" for width in self.widths)
+        if is_video(filename) and thumbnail_url and thumbnail_url.startswith("http"):
+            return thumbnail_url, srcset
+        return f"{base}?w={self.preset_width(DEFAULT_WIDTH)}", srcset
+
+    async def get(self, video_path: str) -> Optional[str]:
+        """Path of a fresh full-size thumbnail for ``video_path``, rendering it if needed; None if it cannot be made"""
+        thumb_path = thumbnail_path(video_path)
+        if is_fresh(video_path, thumb_path):
+            self.hits += 1
+            return thumb_path
+        self.misses += 1
+        if not self.available:
+            return None
+        try:
+            rendered = await asyncio.wrap_future(self.submit(video_path))
+        except Exception as e:
+            logger.error(f"❌ [THUMBNAILS] Render failed for {os.path.basename(video_path)}: {e}")
+            return None
+        return thumb_path if rendered else None
+
+    async def get_preset(self, source_path: str, width: int) -> Optional[str]:
+        """Path of a fresh preset of ``source_path``, rendering the presets if needed; None if it cannot be made"""
+        if not self.has_presets(source_path):
+            return None
+        path = preset_path(source_path, self.preset_width(width), self.format)
+        if is_fresh(source_path, path):
+            self.hits += 1
+            return path
+        self.misses += 1
+        try:
+            await asyncio.wrap_future(self.submit_presets(source_path))
+        except Exception as e:
+            logger.error(f"❌ [THUMBNAILS] Render failed for {os.path.basename(source_path)}: {e}")
+            return None
+        return path if os.path.exists(path) else None
+
+    def on_change(self, username: str, media_type: str, filenames: Optional[List[str]]):
+        """Media index listener: pre-render the presets of files that just completed"""
+        if filenames is None or self.media_index is None:
+            return
+        for filename in filenames:
+            if not self.has_presets(filename):
+                continue
+            item = self.media_index.get(username, media_type, filename)
+            if not item or item.get("download_status") != "complete":
+                continue
+            source_path = os.path.join(self.downloads_dir, username, media_type, filename)
+            largest = preset_path(source_path, self.widths[-1], self.format)
+            if os.path.isfile(source_path) and not is_fresh(source_path, largest):
+                self.pregenerated += 1
+                self.submit_presets(source_path)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / requests, 3) if requests else None,
+            "not_modified": self.not_modified,
+            "generated": self.generated,
+            "failed": self.failed,
+            "pregenerated": self.pregenerated,
+            "pending": pending,
+            "available": self.available,
+            "format": self.format,
+            "widths": list(self.widths),
+            "workers": self.workers,
+        }
@@ -0,0 +1,336 @@
+import hashlib
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+# Already-compressed media gains nothing from deflate; it is stored as-is
+COMPRESSED_EXTENSIONS = (
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".avif", ".heic",
+    ".mp4", ".mov", ".webm", ".mkv", ".m4a", ".mp3", ".zip", ".gz",
+)
+CHUNK_SIZE = 1024 * 1024
+
+STORED = 0
+DEFLATED = 8
+ZIP64_LIMIT = 0xFFFFFFFF
+# Bit 3: CRC and sizes follow the data; bit 11: UTF-8 names
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+
+LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+END_RECORD = struct.Struct("<IHHHHIIH")
+ZIP64_END_RECORD = struct.Struct("<IQHHIIQQQQ")
+ZIP64_END_LOCATOR = struct.Struct("<IIQI")
+
+# CRCs of files read while serving one range, for the ranges that need them later
+_crc_cache: "OrderedDict[Tuple[str, int, int], int]" = OrderedDict()
+_crc_cache_lock = threading.Lock()
+CRC_CACHE_SIZE = 10000
+
+
+def _cached_crc(key: Tuple[str, int, int]) -> Optional[int]:
+    with _crc_cache_lock:
+        crc = _crc_cache.get(key)
+        if crc is not None:
+            _crc_cache.move_to_end(key)
+        return crc
+
+
+def _store_crc(key: Tuple[str, int, int], crc: int):
+    with _crc_cache_lock:
+        _crc_cache[key] = crc
+        _crc_cache.move_to_end(key)
+        while len(_crc_cache) > CRC_CACHE_SIZE:
+            _crc_cache.popitem(last=False)
+
+
+def _dos_time(mtime: float) -> Tuple[int, int]:
+    t = time.localtime(max(mtime, 315532800))  # ZIP dates start in 1980
+    return (
+        (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+        ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday,
+    )
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """[start, end) of a single ``bytes=`` range, None for the whole body
+
+    Raises:
+        ValueError: For ranges that cannot be satisfied
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None  # Multipart ranges are served as the whole body
+    first, _, last = spec.strip().partition("-")
+    if not first:
+        if not last or int(last) == 0:
+            raise ValueError("Unsatisfiable range")
+        return max(size - int(last), 0), size
+    start = int(first)
+    end = min(int(last) + 1, size) if last else size
+    if start >= size or start >= end:
+        raise ValueError("Unsatisfiable range")
+    return start, end
+
+
+@dataclass
+class ZipEntry:
+    path: str
+    arcname: bytes
+    size: int
+    mtime_ns: int
+    method: int
+    utf8: bool
+    offset: int = 0
+    crc: Optional[int] = None
+    compressed_size: Optional[int] = None
+
+    @property
+    def zip64(self) -> bool:
+        return self.size >= ZIP64_LIMIT
+
+    @property
+    def cache_key(self) -> Tuple[str, int, int]:
+        return (self.path, self.size, self.mtime_ns)
+
+
+class ZipStream:
+    """A ZIP archive generated chunk by chunk while the files are read
+
+    Nothing is buffered beyond one read chunk (and the central directory,
+    a few dozen bytes per file), so memory stays flat however many files
+    are selected. Already-compressed media is STORED; anything else is
+    deflated on the fly. CRCs go in data descriptors after each file, so
+    no file is read twice.
+
+    When every entry is stored, the archive layout follows from file sizes
+    alone: ``size`` is known up front and :meth:`chunks` can produce any
+    byte range, which is what Content-Length and Range/resume need. A range
+    that starts inside a file only needs that file's CRC once its data
+    descriptor (or the central directory) is reached; it is then computed
+    by reading the file, and remembered.
+
+    Args:
+        files: ``(path, arcname)`` pairs; missing files are skipped and listed in ``missing``
+        chunk_size: Bytes read per chunk
+    """
+
+    def __init__(self, files: Iterable[Tuple[str, str]], chunk_size: int = CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.entries: List[ZipEntry] = []
+        self.missing: List[str] = []
+        for path, arcname in files:
+            try:
+                st = os.stat(path)
+            except OSError:
+                self.missing.append(arcname)
+                continue
+            try:
+                name = arcname.encode("ascii")
+                utf8 = False
+            except UnicodeEncodeError:
+                name = arcname.encode("utf-8")
+                utf8 = True
+            method = STORED if arcname.lower().endswith(COMPRESSED_EXTENSIONS) else DEFLATED
+            entry = ZipEntry(path, name, st.st_size, st.st_mtime_ns, method, utf8)
+            if method == STORED:
+                entry.compressed_size = entry.size
+            self.entries.append(entry)
+
+        self.size: Optional[int] = None
+        if all(entry.method == STORED for entry in self.entries):
+            position = 0
+            for entry in self.entries:
+                entry.offset = position
+                position += self._local_header_length(entry) + entry.size + self._descriptor_length(entry)
+            self.size = position + self._central_directory_length(position)
+
+    @property
+    def etag(self) -> str:
+        digest = hashlib.sha1()
+        for entry in self.entries:
+            digest.update(b"%s\0%d\0%d\n" % (entry.arcname, entry.size, entry.mtime_ns))
+        return f'"{digest.hexdigest()[:32]}"'
+
+    # ----- record layout -----
+
+    @staticmethod
+    def _local_header_length(entry: ZipEntry) -> int:
+        return LOCAL_HEADER.size + len(entry.arcname) + (20 if entry.zip64 else 0)
+
+    @staticmethod
+    def _descriptor_length(entry: ZipEntry) -> int:
+        return 24 if entry.zip64 else 16
+
+    @staticmethod
+    def _central_zip64(entry: ZipEntry) -> bool:
+        return entry.zip64 or entry.offset >= ZIP64_LIMIT or (entry.compressed_size or 0) >= ZIP64_LIMIT
+
+    def _central_directory_length(self, offset: int) -> int:
+        length = sum(
+            CENTRAL_HEADER.size + len(entry.arcname) + (28 if self._central_zip64(entry) else 0)
+            for entry in self.entries
+        )
+        if self._needs_zip64_end(offset, length):
+            length += ZIP64_END_RECORD.size + ZIP64_END_LOCATOR.size
+        return length + END_RECORD.size
+
+    def _needs_zip64_end(self, offset: int, length: int) -> bool:
+        return len(self.entries) >= 0xFFFF or offset >= ZIP64_LIMIT or length >= ZIP64_LIMIT
+
+    def _flags(self, entry: ZipEntry) -> int:
+        return FLAG_DATA_DESCRIPTOR | (FLAG_UTF8 if entry.utf8 else 0)
+
+    def _local_header(self, entry: ZipEntry) -> bytes:
+        mod_time, mod_date = _dos_time(entry.mtime_ns / 1e9)
+        extra = b""
+        if entry.zip64:
+            sizes = ZIP64_LIMIT
+            extra = struct.pack("<HHQQ", 0x0001, 16, entry.size, entry.compressed_size or 0)
+        elif entry.method == STORED:
+            sizes = entry.size
+        else:
+            sizes = 0  # Only known after compressing; given in the data descriptor
+        return LOCAL_HEADER.pack(
+            0x04034B50, 45 if entry.zip64 else 20, self._flags(entry), entry.method,
+            mod_time, mod_date, 0, sizes, sizes, len(entry.arcname), len(extra),
+        ) + entry.arcname + extra
+
+    def _descriptor(self, entry: ZipEntry) -> bytes:
+        crc = self._crc(entry)
+        if entry.zip64:
+            return struct.pack("<IIQQ", 0x08074B50, crc, entry.compressed_size, entry.size)
+        return struct.pack("<IIII", 0x08074B50, crc, entry.compressed_size, entry.size)
+
+    def _central_directory(self, offset: int) -> bytes:
+        records = []
+        for entry in self.entries:
+            mod_time, mod_date = _dos_time(entry.mtime_ns / 1e9)
+            extra = b""
+            size, compressed_size, entry_offset = entry.size, entry.compressed_size, entry.offset
+            if self._central_zip64(entry):
+                extra = struct.pack("<HHQQQ", 0x0001, 24, size, compressed_size, entry_offset)
+                size = compressed_size = entry_offset = ZIP64_LIMIT
+            records.append(CENTRAL_HEADER.pack(
+                0x02014B50, 45, 45 if extra else 20, self._flags(entry), entry.method,
+                mod_time, mod_date, self._crc(entry), compressed_size, size,
+                len(entry.arcname), len(extra), 0, 0, 0, 0, entry_offset,
+            ) + entry.arcname + extra)
+        directory = b"".join(records)
+        count = len(self.entries)
+        if self._needs_zip64_end(offset, len(directory)):
+            zip64_end = offset + len(directory)
+            directory += ZIP64_END_RECORD.pack(
+                0x06064B50, ZIP64_END_RECORD.size - 12, 45, 45, 0, 0, count, count, len(directory), offset,
+            )
+            directory += ZIP64_END_LOCATOR.pack(0x07064B50, 0, zip64_end, 1)
+            return directory + END_RECORD.pack(
+                0x06054B50, 0, 0, 0xFFFF, 0xFFFF, ZIP64_LIMIT, ZIP64_LIMIT, 0,
+            )
+        return directory + END_RECORD.pack(0x06054B50, 0, 0, count, count, len(directory), offset, 0)
+
+    # ----- data -----
+
+    def _crc(self, entry: ZipEntry) -> int:
+        # Only ranges that skipped a file's start get here without its CRC
+        if entry.crc is None:
+            entry.crc = _cached_crc(entry.cache_key)
+        if entry.crc is None:
+            crc = 0
+            with open(entry.path, "rb") as f:
+                for chunk in iter(lambda: f.read(self.chunk_size), b""):
+                    crc = zlib.crc32(chunk, crc)
+            entry.crc = crc
+            _store_crc(entry.cache_key, crc)
+        return entry.crc
+
+    def _stored_data(self, entry: ZipEntry, skip: int, length: int) -> Iterator[bytes]:
+        """``length`` bytes of a stored file from ``skip`` on; the CRC is taken when reading from the start"""
+        whole = skip == 0 and length == entry.size
+        crc = 0
+        with open(entry.path, "rb") as f:
+            f.seek(skip)
+            remaining = length
+            while remaining > 0:
+                chunk = f.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    raise IOError(f"{entry.path} shrank while it was being archived")
+                remaining -= len(chunk)
+                if whole:
+                    crc = zlib.crc32(chunk, crc)
+                yield chunk
+        if whole:
+            entry.crc = crc
+            _store_crc(entry.cache_key, crc)
+
+    def _deflated_data(self, entry: ZipEntry) -> Iterator[bytes]:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        crc = 0
+        compressed_size = 0
+        with open(entry.path, "rb") as f:
+            for chunk in iter(lambda: f.read(self.chunk_size), b""):
+                crc = zlib.crc32(chunk, crc)
+                out = compressor.compress(chunk)
+                if out:
+                    compressed_size += len(out)
+                    yield out
+        out = compressor.flush()
+        compressed_size += len(out)
+        entry.crc = crc
+        entry.compressed_size = compressed_size
+        yield out
+
+    def chunks(self, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """Archive bytes ``[start, end)``; ranges need ``size`` to be known
+
+        A plain generator: FastAPI's StreamingResponse runs it in its thread
+        pool, so file reads stay off the event loop.
+        """
+        if (start or end is not None) and self.size is None:
+            raise ValueError("Byte ranges need an archive of stored entries")
+        end = self.size if end is None else end
+        position = 0
+
+        def overlapping(data: bytes) -> bytes:
+            return data[max(start - position, 0):None if end is None else max(end - position, 0)]
+
+        for entry in self.entries:
+            if end is not None and position >= end:
+                return
+            if self.size is None:
+                entry.offset = position
+            header_length = self._local_header_length(entry)
+            if position + header_length > start:
+                yield overlapping(self._local_header(entry))
+            position += header_length
+
+            if entry.method == STORED:
+                data_end = position + entry.size
+                if data_end > start and (end is None or position < end):
+                    skip = max(start - position, 0)
+                    length = (entry.size if end is None else min(data_end, end) - position) - skip
+                    yield from self._stored_data(entry, skip, length)
+                position = data_end
+            else:
+                for chunk in self._deflated_data(entry):
+                    if chunk:
+                        yield chunk
+                position += entry.compressed_size
+
+            if end is not None and position >= end:
+                return
+            descriptor_length = self._descriptor_length(entry)
+            if position + descriptor_length > start:
+                yield overlapping(self._descriptor(entry))
+            position += descriptor_length
+
+        if end is None or position < end:
+            yield overlapping(self._central_directory(position))
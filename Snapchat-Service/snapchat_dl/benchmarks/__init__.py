@@ -0,0 +1 @@
+"""Micro-benchmarks for snapchat_dl hot paths."""
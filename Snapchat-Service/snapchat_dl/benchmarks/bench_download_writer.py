@@ -0,0 +1,115 @@
+"""Benchmark the download write path: per-chunk writes vs the batched writer.
+
+Usage:
+    python -m snapchat_dl.benchmarks.bench_download_writer [size_mb] [link_mb_per_s]
+
+Feeds an in-memory body (no network) through the old per-chunk loop and the
+current copy_stream_async writer, writing to a temporary file with a
+progress callback attached. The first run reads as fast as possible and
+reports CPU time per MB and how many file writes each strategy made. The
+second paces reads to a simulated link speed (default 8 MB/s), as a real
+download would arrive, and reports how many progress callbacks fired and
+the longest gap between two of them.
+"""
+import asyncio
+import io
+import os
+import sys
+import tempfile
+import time
+
+import aiofiles
+
+from snapchat_dl.downloader import copy_stream_async
+
+
+# Network reads seen from aiohttp are rarely larger than this
+NETWORK_READ = 64 * 1024
+
+
+class CountingFile:
+    """Wrap a file object and count write calls."""
+
+    def __init__(self, f):
+        self.f = f
+        self.writes = 0
+
+    def write(self, data):
+        self.writes += 1
+        return self.f.write(data)
+
+
+class CountingAsyncFile(CountingFile):
+    async def write(self, data):
+        self.writes += 1
+        return await self.f.write(data)
+
+    async def writelines(self, chunks):
+        self.writes += 1
+        return await self.f.writelines(chunks)
+
+
+async def legacy_async(read, f, total_size, progress_callback):
+    """Previous async behaviour: one aiofiles write and one callback per network read."""
+    downloaded = 0
+    while True:
+        chunk = await read()
+        if not chunk:
+            break
+        await f.write(chunk)
+        downloaded += len(chunk)
+        await progress_callback(downloaded / total_size * 100)
+    return downloaded
+
+
+def _reader(body, rate=None):
+    stream = io.BytesIO(body)
+    delay = NETWORK_READ / rate if rate else 0
+
+    async def read():
+        if delay:
+            await asyncio.sleep(delay)
+        return stream.read(NETWORK_READ)
+
+    return read
+
+
+async def run_async(strategy, body, path, rate=None):
+    calls = []
+
+    async def callback(progress):
+        calls.append(time.monotonic())
+
+    async with aiofiles.open(path, "wb") as f:
+        counted = CountingAsyncFile(f)
+        started = time.monotonic()
+        cpu_started = time.process_time()
+        if strategy == "legacy":
+            await legacy_async(_reader(body, rate), counted, len(body), callback)
+        else:
+            await copy_stream_async(_reader(body, rate), counted, 0, len(body), callback)
+        cpu = time.process_time() - cpu_started
+    marks = [started] + calls
+    max_gap = max((b - a for a, b in zip(marks, marks[1:])), default=0.0)
+    return cpu, counted.writes, len(calls), max_gap
+
+
+def main(argv):
+    size_mb = int(argv[0]) if argv else 50
+    rate_mb = float(argv[1]) if len(argv) > 1 else 8.0
+    body = os.urandom(size_mb * 1024 * 1024)
+    strategies = (("write per read", "legacy"), ("batched writelines", "batched"))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "video.mp4")
+        print(f"\n{size_mb} MB body, async (aiohttp + aiofiles) path, unpaced")
+        for label, strategy in strategies:
+            cpu, writes, _, _ = asyncio.run(run_async(strategy, body, path))
+            print(f"  {label:<22} {cpu / size_mb * 1000:7.2f} ms CPU/MB   {writes:6d} writes")
+        print(f"\n{size_mb} MB body at {rate_mb:g} MB/s")
+        for label, strategy in strategies:
+            _, _, callbacks, max_gap = asyncio.run(run_async(strategy, body, path, rate_mb * 1024 * 1024))
+            print(f"  {label:<22} {callbacks:6d} progress callbacks   longest gap {max_gap:.2f}s")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
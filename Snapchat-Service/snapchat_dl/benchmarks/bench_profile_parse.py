@@ -0,0 +1,225 @@
+"""Benchmark profile page parsing: buffered regex vs streaming extractor.
+
+Usage:
+    python -m snapchat_dl.benchmarks.bench_profile_parse [page.html ...]
+
+Runs against every recorded page in ``benchmarks/fixtures`` plus any HTML
+files given on the command line, and against a synthetic highlight-heavy page
+sized like a large public profile. Reports parse time and peak memory for
+each strategy, i.e. the parsing cost of a single poll of that profile.
+"""
+import glob
+import json
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+from snapchat_dl import profile
+from snapchat_dl.profile import NextDataExtractor
+from snapchat_dl.profile import PROFILE_KEYS
+from snapchat_dl.profile import ProfileSnapshot
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+REGEXP_WEB_JSON = (
+    r'<script\s*id="__NEXT_DATA__"\s*type="application\/json">([^<]+)</script>'
+)
+CHUNK_SIZE = 64 * 1024
+
+
+def _snap(index, username):
+    return {
+        "snapIndex": index,
+        "snapId": {"value": f"snap{index:04d}_{username}"},
+        "snapMediaType": index % 2,
+        "snapUrls": {
+            "mediaUrl": f"https://cf-st.sc-cdn.net/d/media{index:04d}.27.IRZXSOY?mo=GlYaCjICBH1IAlBLYAE%3D&uc=75",
+            "mediaPreviewUrl": {"value": f"https://cf-st.sc-cdn.net/d/preview{index:04d}.256.IRZXSOY?uc=75"},
+        },
+        "timestampInSec": {"value": str(1728000000 + index * 60)},
+    }
+
+
+def build_profile_html(
+    username="benchuser", snaps=20, highlights=10, snaps_per_highlight=15, padding_kb=256, messages=2000,
+    messages_first=False,
+):
+    """Build a synthetic profile page shaped like www.snapchat.com/add/<user>.
+
+    Args:
+        username (str): Username to embed.
+        snaps (int): Number of story snaps.
+        highlights (int): Number of curated highlight groups.
+        snaps_per_highlight (int): Snaps in each highlight group.
+        padding_kb (int): Inline CSS/JS before the payload, in KB.
+        messages (int): Number of i18n strings carried in pageProps.
+        messages_first (bool): Put the i18n strings before the profile
+            members, so a selective decoder has to skip them instead of
+            stopping before them.
+
+    Returns:
+        bytes: The page encoded as UTF-8.
+    """
+    next_data = {
+        "props": {
+            "pageProps": {
+                "userProfile": {
+                    "$case": "publicProfileInfo",
+                    "publicProfileInfo": {
+                        "username": username,
+                        "title": username.title(),
+                        "snapcodeImageUrl": f"https://app.snapchat.com/web/deeplink/snapcode?username={username}",
+                        "subscriberCount": "120000",
+                    },
+                },
+                "story": {
+                    "storyType": 4,
+                    "snapList": [_snap(i, username) for i in range(snaps)],
+                },
+                "curatedHighlights": [
+                    {
+                        "highlightId": {"value": f"highlight{h}"},
+                        "storyTitle": {"value": f"Highlight {h}"},
+                        "snapList": [_snap(h * 1000 + i, username) for i in range(snaps_per_highlight)],
+                    }
+                    for h in range(highlights)
+                ],
+                "spotHighlights": [
+                    {
+                        "storyId": {"value": f"spot{h}"},
+                        "snapList": [_snap(h * 5000 + i, username) for i in range(3)],
+                    }
+                    for h in range(highlights)
+                ],
+                "pageMetadata": {"pageTitle": f"{username} on Snapchat", "pageType": 18},
+                "messages": {f"i18n_key_{i}": "x" * 40 for i in range(messages)},
+            },
+            "__N_SSP": True,
+        },
+        "page": "/add/[username]",
+        "query": {"username": username},
+        "buildId": "benchmark-build",
+        "isFallback": False,
+        "gssp": True,
+        "locale": "en-US",
+    }
+    if messages_first:
+        page_props = next_data["props"]["pageProps"]
+        next_data["props"]["pageProps"] = {"messages": page_props.pop("messages"), **page_props}
+    payload = json.dumps(next_data).replace("<", "\\u003c")
+    padding = "".join(
+        f".c{i}{{margin:{i % 7}px;padding:{i % 5}px;color:#{i % 4096:03x}}}" for i in range(padding_kb * 24)
+    )
+    html = (
+        "<!DOCTYPE html><html lang=\"en\"><head><meta charSet=\"utf-8\"/>"
+        f"<title>{username} on Snapchat</title><style>{padding}</style></head>"
+        "<body><div id=\"__next\"></div>"
+        f"<script id=\"__NEXT_DATA__\" type=\"application/json\">{payload}</script>"
+        "<script src=\"/_next/static/chunks/main.js\" defer=\"\"></script>"
+        "</body></html>"
+    )
+    return html.encode("utf-8")
+
+
+def _chunks(page):
+    return [page[i:i + CHUNK_SIZE] for i in range(0, len(page), CHUNK_SIZE)]
+
+
+def parse_buffered(chunks):
+    """Previous behaviour: buffer the body, decode it, regex it, parse it."""
+    text = b"".join(chunks).decode("utf-8")
+    match = re.findall(REGEXP_WEB_JSON, text)
+    return json.loads(match[0])
+
+
+def _extract(chunks):
+    extractor = NextDataExtractor()
+    for chunk in chunks:
+        if extractor.feed(chunk):
+            break
+    return extractor.payload
+
+
+def parse_streaming(chunks):
+    """Stream chunks, keep only the payload, decode all of it."""
+    return json.loads(_extract(chunks))
+
+
+def parse_selective(chunks):
+    """Stream chunks, decode only the pageProps members the downloader reads."""
+    return ProfileSnapshot.from_payload("bench", _extract(chunks))
+
+
+def parse_selective_stdlib(chunks):
+    """As parse_selective, forcing the stdlib walk whatever the page size and backend."""
+    backend, profile.orjson = profile.orjson, None
+    threshold, profile.SELECTIVE_MIN_SIZE = profile.SELECTIVE_MIN_SIZE, 0
+    try:
+        return parse_selective(chunks)
+    finally:
+        profile.orjson = backend
+        profile.SELECTIVE_MIN_SIZE = threshold
+
+
+def _check(chunks):
+    page_props = parse_buffered(chunks)["props"]["pageProps"]
+    expected = ProfileSnapshot.from_page_props("bench", {k: page_props[k] for k in PROFILE_KEYS if k in page_props})
+    assert parse_streaming(chunks) == parse_buffered(chunks)
+    assert parse_selective(chunks) == expected
+    assert parse_selective_stdlib(chunks) == expected
+
+
+STRATEGIES = (
+    ("buffered+regex", parse_buffered),
+    ("streaming", parse_streaming),
+    ("selective", parse_selective),
+    ("selective-stdlib", parse_selective_stdlib),
+)
+
+
+def measure(func, chunks, repeat):
+    """Return (best seconds, peak traced bytes) for ``func(chunks)``."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(chunks)
+        best = min(best, time.perf_counter() - started)
+
+    tracemalloc.start()
+    func(chunks)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def run(pages, repeat=20):
+    for name, page in pages:
+        chunks = _chunks(page)
+        _check(chunks)
+        print(f"\n{name}: {len(page) / 1024:.0f} KB page")
+        for label, func in STRATEGIES:
+            seconds, peak = measure(func, chunks, repeat)
+            print(f"  {label:<18} {seconds * 1000:8.2f} ms   peak {peak / 1024:8.0f} KB")
+
+
+def main(argv):
+    pages = []
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, "*.html"))) + argv:
+        with open(path, "rb") as f:
+            pages.append((os.path.basename(path), f.read()))
+    pages.append(("synthetic-large", build_profile_html(snaps=60, highlights=40, padding_kb=512)))
+    pages.append((
+        "synthetic-highlight-heavy",
+        build_profile_html(snaps=100, highlights=150, snaps_per_highlight=25, padding_kb=256, messages=8000),
+    ))
+    pages.append((
+        "synthetic-messages-first",
+        build_profile_html(snaps=60, highlights=40, padding_kb=256, messages=40000, messages_first=True),
+    ))
+    run(pages)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,82 +1,298 @@
-import requests
 from loguru import logger
 import time
 import os
+import random
+import inspect
 from typing import Optional, Callable
-from requests.exceptions import RequestException
 import asyncio
+import aiohttp
+import aiofiles
+
+# Suffix for files still being written; renamed into place once complete
+PART_SUFFIX = ".part"
 
 class DownloadError(Exception):
     """Custom exception for download errors."""
     pass
 
-def download_url(url: str, output: str, sleep_interval: float, progress_callback: Optional[Callable] = None, max_retries: int = 5) -> Optional[str]:
+class IncompleteDownload(Exception):
+    """The transfer ended early or resumed at the wrong offset; safe to retry."""
+    pass
+
+def part_path(output: str) -> str:
+    """Return the temporary path a download is written to before the final rename."""
+    return output + PART_SUFFIX
+
+def _resume_offset(part: str) -> int:
+    try:
+        return os.path.getsize(part)
+    except OSError:
+        return 0
+
+def _remove_partial(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def _range_headers(offset: int, validator: Optional[str] = None) -> dict:
+    # Media is fetched as-is so byte offsets and Content-Length refer to the file itself
+    headers = {"Accept-Encoding": "identity"}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+        if validator:
+            headers["If-Range"] = validator
+    return headers
+
+def _parse_content_range(value: Optional[str]):
+    """Parse ``bytes start-end/total`` into (start, total); total is None when unknown."""
+    try:
+        unit, _, spec = value.partition(" ")
+        span, _, total = spec.partition("/")
+        start = int(span.split("-")[0])
+        return start, (int(total) if total and total != "*" else None)
+    except (AttributeError, ValueError):
+        return None, None
+
+def _plan_write(status: int, headers, offset: int, part: str):
+    """
+    Decide where the body goes in the part file.
+
+    Returns:
+        (offset, total_size): Offset to append at (0 means start over) and the
+        expected final size, or 0 when the server did not say.
+    """
+    content_length = int(headers.get("Content-Length") or 0)
+    if status != 206:
+        # Server ignored the Range header (or the file changed): start over
+        return 0, content_length
+    start, total = _parse_content_range(headers.get("Content-Range"))
+    if start != offset:
+        _remove_partial(part)
+        raise IncompleteDownload(f"Server resumed at byte {start}, expected {offset}")
+    if total is None:
+        total = offset + content_length if content_length else 0
+    return offset, total
+
+def _finalize(part: str, output: str, size: int, total_size: int):
+    """Verify the part file against the expected size and move it into place."""
+    if total_size > 0 and size != total_size:
+        if size > total_size:
+            _remove_partial(part)
+        raise IncompleteDownload(f"Downloaded {size} of {total_size} bytes")
+    os.replace(part, output)
+
+def _validator(headers) -> Optional[str]:
+    # Weak ETags are not allowed in If-Range
+    etag = headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return headers.get("Last-Modified")
+
+class ProgressThrottle:
+    """
+    Decide when a download should report progress.
+
+    Progress is emitted once at least ``step_bytes`` (1% of the file, and no
+    less than ``min_bytes``) have arrived and ``min_interval`` seconds have
+    passed since the last report, plus once on completion - independent of
+    how many chunks the transfer happens to be split into.
+    """
+
+    def __init__(self, total_size: int, start: int = 0, min_bytes: int = 256 * 1024, min_interval: float = 0.25):
+        self.total_size = total_size
+        self.step_bytes = max(min_bytes, total_size // 100)
+        self.min_interval = min_interval
+        self._last_bytes = start
+        self._last_time = time.monotonic()
+
+    def due(self, downloaded: int) -> bool:
+        """Return True (and reset the window) when ``downloaded`` bytes should be reported."""
+        if self.total_size <= 0:
+            return False
+        if downloaded < self.total_size:
+            if downloaded - self._last_bytes < self.step_bytes:
+                return False
+            now = time.monotonic()
+            if now - self._last_time < self.min_interval:
+                return False
+            self._last_time = now
+        elif self._last_bytes >= self.total_size:
+            return False
+        self._last_bytes = downloaded
+        return True
+
+    def percent(self, downloaded: int) -> float:
+        return downloaded / self.total_size * 100
+
+
+class ChunkBatch:
+    """
+    Received chunks held by reference until they are worth one file write.
+
+    The batch size starts at ``min_size`` so small images stay cheap and
+    doubles every time a full batch is written, up to ``max_size``, so long
+    videos are written in large blocks. The chunks are the bytes objects the
+    HTTP client already produced; nothing is copied into a staging buffer.
     """
-    Download file from URL to specified output path with progress tracking and retry logic.
-    
+
+    def __init__(self, min_size: int = 64 * 1024, max_size: int = 1024 * 1024):
+        self.size = min_size
+        self.max_size = max_size
+        self.filled = 0
+        self._chunks = []
+
+    def add(self, chunk: bytes):
+        self._chunks.append(chunk)
+        self.filled += len(chunk)
+
+    @property
+    def full(self) -> bool:
+        return self.filled >= self.size
+
+    def take(self) -> list:
+        """Hand over the held chunks, growing the batch size if it was full."""
+        if self.full and self.size < self.max_size:
+            self.size = min(self.size * 2, self.max_size)
+        chunks, self._chunks, self.filled = self._chunks, [], 0
+        return chunks
+
+
+async def copy_stream_async(read, f, downloaded: int, total_size: int, progress_callback: Optional[Callable] = None) -> int:
+    """
+    Copy an async body into an aiofiles handle in growing batches.
+
+    ``read`` is an awaitable returning the next available bytes (``b""`` at the
+    end), e.g. ``response.content.readany``. aiohttp hands out a new bytes
+    object per read and has no ``readinto``, so received chunks are kept by
+    reference and written with one (thread-pool backed) ``writelines`` call
+    per batch of up to 1 MB; the data is never copied into a staging buffer.
+
+    Returns:
+        Total bytes in the file (``downloaded`` plus what was copied)
+    """
+    batch = ChunkBatch()
+    throttle = ProgressThrottle(total_size, downloaded)
+    try:
+        while True:
+            chunk = await read()
+            if not chunk:
+                break
+            downloaded += len(chunk)
+            batch.add(chunk)
+            if batch.full:
+                await f.writelines(batch.take())
+            if progress_callback and throttle.due(downloaded):
+                await _report_progress(progress_callback, throttle.percent(downloaded))
+    finally:
+        # Bytes already received belong in the part file even when the
+        # transfer breaks off or is cancelled, so a resume starts after them
+        if batch.filled:
+            await f.writelines(batch.take())
+    return downloaded
+
+
+# Statuses worth retrying; any other 4xx means the URL itself is bad
+RETRYABLE_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 30.0) -> float:
+    """Full-jitter exponential backoff: a random delay in [0, min(cap, base * 2**attempt)]."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+async def _report_progress(progress_callback: Optional[Callable], progress: float):
+    result = progress_callback(progress)
+    if inspect.isawaitable(result):
+        await result
+
+
+async def download_url_async(
+    session: aiohttp.ClientSession,
+    url: str,
+    output: str,
+    sleep_interval: float = 0,
+    progress_callback: Optional[Callable] = None,
+    max_retries: int = 5,
+    timeout: Optional[aiohttp.ClientTimeout] = None,
+) -> Optional[str]:
+    """
+    Download file from URL to specified output path on an aiohttp session.
+
+    Never blocks the event loop: the body is streamed from the shared connection pool and written with aiofiles in
+    blocks of up to 1 MB, and retries wait with jittered exponential backoff. Retries and later calls
+    resume an existing ``.part`` file with a Range request; the file is renamed
+    into place only after it matches Content-Length. Cancelling the calling
+    task stops the download and keeps the part file for a later resume.
+
     Args:
+        session: The aiohttp session (connection pool) to download with
         url: The URL to download from
         output: The output file path
-        sleep_interval: Time to sleep between chunks
-        progress_callback: Optional callback function for progress updates
-        max_retries: Maximum number of retry attempts
-    
+        sleep_interval: Time to sleep after a successful download
+        progress_callback: Optional callback (sync or async) receiving percent complete
+        max_retries: Maximum number of attempts
+        timeout: Per-request timeout; defaults to no total limit with a 60s read timeout
+
     Returns:
-        The filename if successful, None if failed
-        
+        The filename if successful
+
     Raises:
         DownloadError: If download fails after all retries
     """
-    retry_count = 0
-    last_error = None
-    
-    while retry_count < max_retries:
+    if timeout is None:
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=60)
+
+    output_dir = os.path.dirname(output)
+    if output_dir:  # Only create directory if there's a directory path
+        os.makedirs(output_dir, exist_ok=True)
+
+    part = part_path(output)
+    validator = None
+    attempt = 0
+    while True:
+        attempt += 1
+        offset = _resume_offset(part)
         try:
-            response = requests.get(url, stream=True, timeout=30)
-            response.raise_for_status()
-            
-            total_size = int(response.headers.get('content-length', 0))
-            downloaded_size = 0
-            chunk_size = 8192  # Increased chunk size for better performance
-            
-            # Create directory if it doesn't exist
-            output_dir = os.path.dirname(output)
-            if output_dir:  # Only create directory if there's a directory path
-                os.makedirs(output_dir, exist_ok=True)
-            
-            with open(output, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=chunk_size):
-                    if chunk:
-                        f.write(chunk)
-                        downloaded_size += len(chunk)
-                        if progress_callback and total_size > 0:
-                            progress = (downloaded_size / total_size) * 100
-                            try:
-                                progress_callback(progress)
-                            except TypeError:
-                                # If the callback doesn't accept the progress parameter, try calling without it
-                                progress_callback()
-            
-            # Verify file was downloaded completely
-            if total_size > 0 and os.path.getsize(output) != total_size:
-                raise DownloadError("Downloaded file size doesn't match expected size")
-            
-            time.sleep(sleep_interval)
+            async with session.get(url, headers=_range_headers(offset, validator), timeout=timeout) as response:
+                if response.status == 416:
+                    _remove_partial(part)
+                    raise IncompleteDownload("Requested range not satisfiable, restarting")
+                if response.status >= 400 and response.status not in RETRYABLE_STATUSES:
+                    raise DownloadError(f"HTTP {response.status} for {url}")
+                response.raise_for_status()
+                validator = _validator(response.headers) or validator
+
+                offset, total_size = _plan_write(response.status, response.headers, offset, part)
+                if offset:
+                    logger.info(f"Resuming {os.path.basename(output)} at byte {offset}")
+                async with aiofiles.open(part, 'ab' if offset else 'wb') as f:
+                    downloaded_size = await copy_stream_async(
+                        response.content.readany, f, offset, total_size, progress_callback
+                    )
+
+            # Verify file was downloaded completely, then move it into place
+            _finalize(part, output, downloaded_size, total_size)
+
+            if sleep_interval:
+                await asyncio.sleep(sleep_interval)
             return os.path.basename(output)
-            
-        except RequestException as e:
-            last_error = e
-            retry_count += 1
-            if retry_count < max_retries:
-                wait_time = 2 ** retry_count  # Exponential backoff
-                logger.warning(f"Download failed (attempt {retry_count}/{max_retries}). Retrying in {wait_time} seconds...")
-                time.sleep(wait_time)
-            else:
+
+        except asyncio.CancelledError:
+            # Part file is kept so a later attempt (or startup recovery) can resume it
+            raise
+        except DownloadError:
+            _remove_partial(part)
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError, IncompleteDownload) as e:
+            if attempt >= max_retries:
+                # Part file is kept so a later attempt can resume it
                 logger.error(f"Failed to download {url} after {max_retries} attempts: {str(e)}")
                 raise DownloadError(f"Failed to download after {max_retries} attempts: {str(e)}")
-                
+            wait_time = backoff_delay(attempt)
+            logger.warning(f"Download failed (attempt {attempt}/{max_retries}). Retrying in {wait_time:.1f} seconds...")
+            await asyncio.sleep(wait_time)
         except Exception as e:
+            _remove_partial(part)
             logger.error(f"Unexpected error downloading {url}: {e}")
             raise DownloadError(f"Unexpected error: {str(e)}")
-    
-    return None
\ No newline at end of file
@@ -0,0 +1,260 @@
+"""Reentrant locks shared between tasks, threads and processes."""
+import asyncio
+import hashlib
+import os
+import threading
+import time
+import weakref
+
+import portalocker
+
+
+LOCK_DIR = ".locks"
+
+
+class LockTimeout(Exception):
+    """A lock could not be acquired within its timeout."""
+
+    pass
+
+
+def _owner():
+    """Identify the caller: the running asyncio task, else the thread."""
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    if task is not None:
+        return ("task", id(task))
+    return ("thread", threading.get_ident())
+
+
+class _SharedFileLock:
+    """The OS-level lock on one file, shared by every in-process holder.
+
+    The first holder takes the lock (``flock`` on POSIX, ``LockFileEx`` on
+    Windows, via portalocker) and the last one to leave releases it, so other
+    processes stay out while any lock of this process on the file is held.
+    Wait counters live here, so they add up per lock file.
+    """
+
+    def __init__(self, lock_file):
+        self.lock_file = lock_file
+        self._mutex = threading.Lock()
+        self._holders = 0
+        self._handle = None
+        self.acquisitions = 0
+        self.contended = 0
+        self.timeouts = 0
+
+    def try_hold(self):
+        """bool: Join the holders, taking the OS lock if this is the first one."""
+        with self._mutex:
+            if self._holders:
+                self._holders += 1
+                return True
+            handle = open(self.lock_file, "a")
+            try:
+                portalocker.lock(handle, portalocker.LOCK_EX | portalocker.LOCK_NB)
+            except portalocker.exceptions.LockException:
+                handle.close()
+                return False
+            self._holders = 1
+            self._handle = handle
+            return True
+
+    def drop(self):
+        """Leave the holders, releasing the OS lock with the last one."""
+        with self._mutex:
+            self._holders -= 1
+            if self._holders:
+                return
+            handle, self._handle = self._handle, None
+            try:
+                portalocker.unlock(handle)
+            finally:
+                handle.close()
+
+
+class PathLock:
+    """An exclusive lock held by one task or thread at a time, across processes.
+
+    The in-process owner and recursion depth are tracked here, so the holder
+    can re-enter freely; the first acquisition also holds an OS-level lock
+    (``flock`` on POSIX, ``LockFileEx`` on Windows, via portalocker) on
+    ``lock_file``, which keeps other processes out. Waits poll and give up
+    with :class:`LockTimeout` after ``timeout`` seconds instead of spinning
+    forever.
+
+    Use ``with lock:`` from threads and ``async with lock:`` from coroutines;
+    the async form sleeps on the event loop while it waits.
+
+    Args:
+        lock_file (str): File the OS-level lock is taken on.
+        timeout (float): Default seconds to wait before giving up.
+        poll_interval (float): Seconds between attempts while waiting.
+        shared (_SharedFileLock): OS-level lock on ``lock_file`` shared with
+            other PathLocks of this process; a private one when omitted.
+    """
+
+    def __init__(self, lock_file, timeout=10.0, poll_interval=0.05, shared=None):
+        self.lock_file = lock_file
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._file = shared if shared is not None else _SharedFileLock(lock_file)
+        self._mutex = threading.Lock()
+        self._owner = None
+        self._depth = 0
+
+    @property
+    def locked(self):
+        """bool: True while some task or thread of this process holds the lock."""
+        return self._owner is not None
+
+    @property
+    def acquisitions(self):
+        """int: First acquisitions on the lock file."""
+        return self._file.acquisitions
+
+    @property
+    def contended(self):
+        """int: Acquisitions that had to wait."""
+        return self._file.contended
+
+    @property
+    def timeouts(self):
+        """int: Waits that gave up with :class:`LockTimeout`."""
+        return self._file.timeouts
+
+    def _try_acquire(self, owner):
+        with self._mutex:
+            if self._owner == owner:
+                self._depth += 1
+                return True
+            if self._owner is not None:
+                return False
+            if not self._file.try_hold():
+                return False
+            self._owner = owner
+            self._depth = 1
+            self._file.acquisitions += 1
+            return True
+
+    def _waited_too_long(self, deadline):
+        if time.monotonic() < deadline:
+            return False
+        self._file.timeouts += 1
+        return True
+
+    def acquire(self, timeout=None):
+        """Block until the lock is held by the calling thread.
+
+        Raises:
+            LockTimeout: If the lock is still held elsewhere after ``timeout`` seconds.
+        """
+        owner = _owner()
+        if self._try_acquire(owner):
+            return
+        self._file.contended += 1
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        while not self._try_acquire(owner):
+            if self._waited_too_long(deadline):
+                raise LockTimeout(f"Timed out waiting for {self.lock_file}")
+            time.sleep(self.poll_interval)
+
+    async def acquire_async(self, timeout=None):
+        """Wait on the event loop until the lock is held by the current task.
+
+        Raises:
+            LockTimeout: If the lock is still held elsewhere after ``timeout`` seconds.
+        """
+        owner = _owner()
+        if self._try_acquire(owner):
+            return
+        self._file.contended += 1
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        while not self._try_acquire(owner):
+            if self._waited_too_long(deadline):
+                raise LockTimeout(f"Timed out waiting for {self.lock_file}")
+            await asyncio.sleep(self.poll_interval)
+
+    def release(self):
+        """Release one level of ownership; the OS lock goes with the last one."""
+        with self._mutex:
+            if self._owner != _owner():
+                raise RuntimeError("Lock released by a task or thread that does not hold it")
+            self._depth -= 1
+            if self._depth:
+                return
+            self._owner = None
+            self._file.drop()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    async def __aenter__(self):
+        await self.acquire_async()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class LockManager:
+    """Hands out one shared :class:`PathLock` per name.
+
+    Within this process every name (usually a file path) gets its own lock,
+    so tasks working on different files never wait for each other. Across
+    processes names are hashed onto a fixed number of lock files under
+    ``lock_dir``, so the directory never grows and no lock file is ever
+    deleted while another process might be about to lock it; two processes
+    whose names share a stripe simply serialize.
+
+    Args:
+        lock_dir (str): Directory for the lock files.
+        stripes (int): Number of lock files.
+        timeout (float): Default wait for every lock handed out.
+    """
+
+    def __init__(self, lock_dir, stripes=256, timeout=10.0):
+        self.lock_dir = lock_dir
+        self.stripes = stripes
+        self.timeout = timeout
+        self._files = {}
+        # Dropped once no holder or waiter references them, so the map stays
+        # as small as the set of files currently being worked on
+        self._locks = weakref.WeakValueDictionary()
+        self._mutex = threading.Lock()
+        os.makedirs(lock_dir, exist_ok=True)
+
+    def lock(self, name):
+        """PathLock: The lock guarding ``name``."""
+        path = os.path.normcase(os.path.abspath(name))
+        with self._mutex:
+            lock = self._locks.get(path)
+            if lock is None:
+                digest = hashlib.sha1(path.encode("utf-8")).digest()
+                stripe = int.from_bytes(digest[:4], "big") % self.stripes
+                shared = self._files.get(stripe)
+                if shared is None:
+                    shared = _SharedFileLock(os.path.join(self.lock_dir, f"{stripe:04d}.lock"))
+                    self._files[stripe] = shared
+                lock = PathLock(shared.lock_file, timeout=self.timeout, shared=shared)
+                self._locks[path] = lock
+            return lock
+
+    def stats(self):
+        """dict: Counters for ``/stats``."""
+        with self._mutex:
+            locks = list(self._locks.values())
+            files = list(self._files.values())
+        return {
+            "held": sum(1 for lock in locks if lock.locked),
+            "acquisitions": sum(f.acquisitions for f in files),
+            "contended": sum(f.contended for f in files),
+            "timeouts": sum(f.timeouts for f in files),
+        }
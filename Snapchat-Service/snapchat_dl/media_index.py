@@ -0,0 +1,491 @@
+"""SQLite index of downloaded media, one row per item."""
+import calendar
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from datetime import timezone
+
+from loguru import logger
+
+
+INDEX_FILE = ".media_index.db"
+LEGACY_METADATA_FILE = ".media_metadata.json"
+MIGRATED_SUFFIX = ".migrated"
+
+# Statuses written through immediately; everything else may be deferred.
+FINAL_STATUSES = ("complete", "error")
+
+# Item keys with their own column; anything else (and structured values of
+# these keys, like the ``{"value": url}`` preview URLs) round-trips through ``extra``.
+COLUMNS = (
+    "filename",
+    "type",
+    "thumbnail_url",
+    "download_status",
+    "progress",
+    "download_url",
+    "source_url",
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL,
+    media_type TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    type TEXT,
+    thumbnail_url TEXT,
+    download_status TEXT,
+    progress NUMERIC,
+    download_url TEXT,
+    source_url TEXT,
+    extra TEXT,
+    timestamp INTEGER NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS media_item ON media (username, media_type, filename);
+CREATE INDEX IF NOT EXISTS media_timestamp ON media (media_type, timestamp);
+"""
+
+_TIMESTAMP_SHAPE = re.compile(r"\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}")
+_SELECT = "SELECT " + ", ".join(COLUMNS) + ", extra FROM media"
+_UPDATE_STATUS = (
+    "UPDATE media SET download_status = ?, progress = COALESCE(?, progress)"
+    " WHERE username = ? AND media_type = ? AND filename = ?"
+)
+
+
+def filename_timestamp(filename, default=None):
+    """Return the UTC capture time encoded in a download filename.
+
+    Downloaded files are named ``%Y-%m-%d_%H-%M-%S_<snap_id>_<username>.<ext>``.
+
+    Args:
+        filename (str): Media filename.
+        default (int): Returned when the filename carries no timestamp.
+
+    Returns:
+        int: Unix timestamp.
+    """
+    # Sliced by hand: time.strptime costs ~30us a call, which adds up over a
+    # whole gallery at startup
+    if not isinstance(filename, str) or _TIMESTAMP_SHAPE.match(filename) is None:
+        return default
+    try:
+        moment = datetime(
+            int(filename[0:4]), int(filename[5:7]), int(filename[8:10]),
+            int(filename[11:13]), int(filename[14:16]), int(filename[17:19]),
+            tzinfo=timezone.utc,
+        )
+    except ValueError:
+        return default
+    return calendar.timegm(moment.utctimetuple())
+
+
+def _row_to_item(row):
+    item = dict(zip(COLUMNS, row[:-1]))
+    if item["source_url"] is None:
+        del item["source_url"]
+    if row[-1]:
+        item.update(json.loads(row[-1]))
+    return item
+
+
+def _item_to_row(username, media_type, item):
+    extra = {
+        key: value for key, value in item.items()
+        if key not in COLUMNS or isinstance(value, (dict, list))
+    }
+    filename = item["filename"]
+    columns = [None if key in extra else item.get(key) for key in COLUMNS[1:]]
+    return (
+        username,
+        media_type,
+        filename,
+        *columns,
+        json.dumps(extra, ensure_ascii=False) if extra else None,
+        filename_timestamp(filename, int(time.time())),
+    )
+
+
+class MediaIndex:
+    """Media metadata for every user and media type in one SQLite database.
+
+    Replaces the per-directory ``.media_metadata.json`` arrays: reads and
+    single-item updates touch one row instead of reparsing and rewriting the
+    whole list. The database runs in WAL mode so readers (gallery requests)
+    do not block the downloader's writes. Items come back as the same dicts
+    the JSON files held, in insertion order.
+
+    Progress ticks can be deferred (``update_status(..., defer=True)``): they
+    are kept in memory, where reads through this index already see them, and
+    written in one transaction per flush. A flush happens ``flush_interval``
+    seconds after the first deferred update, or as soon as an item of the
+    same user and media type reaches a final status.
+
+    Args:
+        path (str): Database file.
+        flush_interval (float): Seconds deferred updates may stay in memory.
+        stats_ttl (float): Seconds the row counts reported by :meth:`stats` are reused.
+    """
+
+    def __init__(self, path, flush_interval=1.0, stats_ttl=30.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.stats_ttl = stats_ttl
+        # (expires_at, items, groups), counted on a separate reader connection
+        self._counts = None
+        self._counts_lock = threading.Lock()
+        self._reader = None
+        self._pending = {}
+        self._timer = None
+        self.deferred = 0
+        self.coalesced = 0
+        self.flushes = 0
+        self._listeners = []
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(_SCHEMA)
+
+    def add_listener(self, callback):
+        """Call ``callback(username, media_type, filenames)`` after items change.
+
+        ``filenames`` lists the items whose rows were written: added,
+        replaced, removed or given a new status, including deferred updates
+        once they are flushed. It is None when the whole user/media_type list
+        was replaced or cleared. Callbacks run on the writing thread after
+        the write is committed, outside the index lock.
+        """
+        self._listeners.append(callback)
+
+    def _notify(self, username, media_type, filenames):
+        for callback in self._listeners:
+            try:
+                callback(username, media_type, filenames)
+            except Exception as e:
+                logger.error(f"[MediaIndex] Change listener failed: {e}")
+
+    def _notify_rows(self, rows):
+        """Notify listeners of written ``(status, progress, username, media_type, filename)`` rows."""
+        changed = {}
+        for row in rows:
+            changed.setdefault((row[2], row[3]), []).append(row[4])
+        for (username, media_type), filenames in changed.items():
+            self._notify(username, media_type, filenames)
+
+    def close(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        self.flush()
+        with self._lock:
+            self._conn.close()
+        with self._counts_lock:
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
+
+    def _overlay(self, username, media_type, item):
+        pending = self._pending.get((username, media_type, item["filename"]))
+        if pending is not None:
+            item["download_status"] = pending[0]
+            if pending[1] is not None:
+                item["progress"] = pending[1]
+        return item
+
+    def _drop_pending(self, username, media_type, filenames=None):
+        for key in [k for k in self._pending if k[0] == username and k[1] == media_type]:
+            if filenames is None or key[2] in filenames:
+                del self._pending[key]
+
+    def items(self, username, media_type):
+        """list: Items for one user and media type, oldest insert first."""
+        with self._lock:
+            rows = self._conn.execute(
+                _SELECT + " WHERE username = ? AND media_type = ? ORDER BY id",
+                (username, media_type),
+            ).fetchall()
+            items = [_row_to_item(row) for row in rows]
+            if self._pending:
+                items = [self._overlay(username, media_type, item) for item in items]
+        return items
+
+    def get(self, username, media_type, filename):
+        """dict: One item, or None if it is not indexed."""
+        with self._lock:
+            row = self._conn.execute(
+                _SELECT + " WHERE username = ? AND media_type = ? AND filename = ?",
+                (username, media_type, filename),
+            ).fetchone()
+            return self._overlay(username, media_type, _row_to_item(row)) if row else None
+
+    def filenames(self, username, media_type):
+        """set: Filenames indexed for one user and media type."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT filename FROM media WHERE username = ? AND media_type = ?",
+                (username, media_type),
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def groups(self):
+        """list: ``(username, media_type)`` pairs that have items."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT DISTINCT username, media_type FROM media ORDER BY username, media_type"
+            ).fetchall()
+
+    def add(self, username, media_type, item):
+        """Insert an item unless one with the same filename exists.
+
+        Returns:
+            bool: True if the item was inserted.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO media (username, media_type, filename, type, thumbnail_url,"
+                " download_status, progress, download_url, source_url, extra, timestamp)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                _item_to_row(username, media_type, item),
+            )
+        if cursor.rowcount > 0:
+            self._notify(username, media_type, [item["filename"]])
+            return True
+        return False
+
+    def upsert(self, username, media_type, item):
+        """Insert an item or replace the fields of the existing one."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO media (username, media_type, filename, type, thumbnail_url,"
+                " download_status, progress, download_url, source_url, extra, timestamp)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (username, media_type, filename) DO UPDATE SET"
+                " type = excluded.type, thumbnail_url = excluded.thumbnail_url,"
+                " download_status = excluded.download_status, progress = excluded.progress,"
+                " download_url = excluded.download_url, source_url = excluded.source_url,"
+                " extra = excluded.extra",
+                _item_to_row(username, media_type, item),
+            )
+        self._notify(username, media_type, [item["filename"]])
+
+    def update_status(self, username, media_type, filename, status, progress=None, defer=False):
+        """Set an item's download status (and progress, if given).
+
+        Args:
+            defer (bool): Keep the update in memory until the next flush.
+                Ignored for final statuses, which flush every pending update
+                of the same user and media type together with this one.
+
+        Returns:
+            bool: False if the update was written and no such item is indexed.
+        """
+        key = (username, media_type, filename)
+        with self._lock:
+            if key in self._pending:
+                self.coalesced += 1
+                if progress is None:
+                    progress = self._pending[key][1]
+            if defer and status not in FINAL_STATUSES:
+                self._pending[key] = (status, progress)
+                self.deferred += 1
+                if self._timer is None:
+                    self._timer = threading.Timer(self.flush_interval, self._flush_on_timer)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return True
+            self._pending.pop(key, None)
+            if status in FINAL_STATUSES:
+                rows = self._write_pending(username, media_type, extra=[(status, progress) + key])
+            else:
+                cursor = self._conn.execute(_UPDATE_STATUS, (status, progress) + key)
+                if cursor.rowcount <= 0:
+                    return False
+                rows = [(status, progress) + key]
+        self._notify_rows(rows)
+        return True
+
+    def flush(self, username=None, media_type=None, extra=()):
+        """Write deferred updates in one transaction.
+
+        Args:
+            username (str): Only flush this user's updates (with ``media_type``).
+            media_type (str): Only flush this media type's updates.
+            extra (iterable): Further ``(status, progress, username, media_type,
+                filename)`` rows to write in the same transaction.
+
+        Returns:
+            int: Number of rows written.
+        """
+        with self._lock:
+            rows = self._write_pending(username, media_type, extra)
+        self._notify_rows(rows)
+        return len(rows)
+
+    def _write_pending(self, username=None, media_type=None, extra=()):
+        """Write deferred (and ``extra``) rows in one transaction; returns the rows written."""
+        with self._lock:
+            keys = [
+                key for key in self._pending
+                if username is None or (key[0] == username and key[1] == media_type)
+            ]
+            rows = [self._pending.pop(key) + key for key in keys] + list(extra)
+            if not rows:
+                return []
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(_UPDATE_STATUS, rows)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self.flushes += 1
+            return rows
+
+    def _flush_on_timer(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"[MediaIndex] Deferred metadata flush failed: {e}")
+
+    def remove(self, username, media_type, filenames=None):
+        """Delete the given filenames, or every item when ``filenames`` is None.
+
+        Returns:
+            int: Number of rows deleted.
+        """
+        if filenames is not None:
+            filenames = list(filenames)
+        with self._lock:
+            self._drop_pending(username, media_type, None if filenames is None else set(filenames))
+            if filenames is None:
+                cursor = self._conn.execute(
+                    "DELETE FROM media WHERE username = ? AND media_type = ?",
+                    (username, media_type),
+                )
+                removed = cursor.rowcount
+            else:
+                removed = self._remove_rows(username, media_type, filenames)
+        if removed:
+            self._notify(username, media_type, filenames)
+        return removed
+
+    def _remove_rows(self, username, media_type, filenames):
+        with self._lock:
+            removed = 0
+            self._conn.execute("BEGIN")
+            try:
+                for filename in filenames:
+                    removed += self._conn.execute(
+                        "DELETE FROM media WHERE username = ? AND media_type = ? AND filename = ?",
+                        (username, media_type, filename),
+                    ).rowcount
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return removed
+
+    def replace(self, username, media_type, items):
+        """Make ``items`` the complete list for one user and media type."""
+        with self._lock:
+            self._drop_pending(username, media_type)
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute(
+                    "DELETE FROM media WHERE username = ? AND media_type = ?",
+                    (username, media_type),
+                )
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO media (username, media_type, filename, type, thumbnail_url,"
+                    " download_status, progress, download_url, source_url, extra, timestamp)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [_item_to_row(username, media_type, item) for item in items if item.get("filename")],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        self._notify(username, media_type, None)
+
+    def migrate_json(self, root):
+        """Import legacy ``.media_metadata.json`` files found under ``root``.
+
+        Each imported file is renamed to ``.media_metadata.json.migrated`` so
+        the import runs once; items already in the index are left alone.
+
+        Returns:
+            int: Number of items imported.
+        """
+        imported = 0
+        if not os.path.isdir(root):
+            return imported
+        for username in os.listdir(root):
+            user_dir = os.path.join(root, username)
+            if username.startswith(".") or not os.path.isdir(user_dir):
+                continue
+            for media_type in os.listdir(user_dir):
+                legacy = os.path.join(user_dir, media_type, LEGACY_METADATA_FILE)
+                if not os.path.isfile(legacy):
+                    continue
+                try:
+                    with open(legacy, "r", encoding="utf-8") as f:
+                        items = json.load(f)
+                except (OSError, ValueError) as e:
+                    logger.error(f"[MediaIndex] Could not read {legacy}: {e}")
+                    continue
+                with self._lock:
+                    self._conn.execute("BEGIN")
+                    try:
+                        for item in items:
+                            if isinstance(item, dict) and item.get("filename"):
+                                imported += self.add(username, media_type, item)
+                        self._conn.execute("COMMIT")
+                    except Exception:
+                        self._conn.execute("ROLLBACK")
+                        raise
+                os.replace(legacy, legacy + MIGRATED_SUFFIX)
+        if imported:
+            logger.info(f"[MediaIndex] Imported {imported} items from legacy metadata files")
+        return imported
+
+    def _row_counts(self):
+        """Return ``(items, groups)``, recounted at most every ``stats_ttl`` seconds.
+
+        Counted on a connection of its own, so the writer lock is not held
+        and, with WAL, writers are not blocked while counting.
+        """
+        with self._counts_lock:
+            now = time.monotonic()
+            if self._counts is None or now >= self._counts[0]:
+                if self._reader is None:
+                    self._reader = sqlite3.connect(self.path, check_same_thread=False)
+                # Both counts are answered from covering indexes
+                items, groups = self._reader.execute(
+                    "SELECT (SELECT COUNT(*) FROM media),"
+                    " (SELECT COUNT(*) FROM (SELECT 1 FROM media GROUP BY username, media_type))"
+                ).fetchone()
+                self._counts = (now + self.stats_ttl, items, groups)
+            return self._counts[1:]
+
+    def stats(self):
+        """dict: Row and write-behind counters for ``/stats``."""
+        items, groups = self._row_counts()
+        return {
+            "items": items,
+            "groups": groups,
+            "pending_updates": len(self._pending),
+            "deferred_updates": self.deferred,
+            "coalesced_updates": self.coalesced,
+            "flushes": self.flushes,
+        }
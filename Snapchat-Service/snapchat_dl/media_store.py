@@ -0,0 +1,231 @@
+"""Content-addressed storage for downloaded media."""
+import hashlib
+import os
+import shutil
+import threading
+from urllib.parse import urlsplit
+
+from loguru import logger
+
+
+BLOB_DIR = ".blobs"
+
+
+def stable_url(url):
+    """Return the part of a media URL that identifies the media itself.
+
+    Snapchat CDN URLs carry per-request query parameters (signatures, quality
+    hints) but the host and path name the object, so those are the key.
+
+    Args:
+        url (str): Media URL.
+
+    Returns:
+        str: ``host/path`` of the URL.
+    """
+    parts = urlsplit(url)
+    return f"{parts.netloc}{parts.path}"
+
+
+def disk_usage(root):
+    """Return ``(bytes, files)`` used under ``root``, counting each inode once.
+
+    Hardlinked entries (a blob and every user/media_type name pointing at it)
+    share one inode, so summing ``os.path.getsize`` over every name would
+    count the same media several times.
+    """
+    seen = set()
+    total_size = 0
+    file_count = 0
+    for dirpath, _, files in os.walk(root):
+        for name in files:
+            try:
+                st = os.stat(os.path.join(dirpath, name))
+            except OSError:
+                continue
+            inode = (st.st_dev, st.st_ino)
+            if inode in seen:
+                continue
+            seen.add(inode)
+            total_size += st.st_size
+            file_count += 1
+    return total_size, file_count
+
+
+class MediaStore:
+    """Deduplicated media blobs with per-user/media_type hardlinks.
+
+    Each distinct media file is stored once under ``root/.blobs/<xx>/<key><ext>``
+    where ``key`` is the SHA-256 of its stable URL (or of its bytes when no URL
+    is known). The files under ``root/<username>/<media_type>/`` are hardlinks
+    to those blobs, so existing paths, metadata and the ``/downloads`` mount
+    keep working unchanged while the bytes exist on disk once. When the
+    filesystem refuses hardlinks the store falls back to plain copies.
+
+    Args:
+        root (str): Downloads directory.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.blob_root = os.path.join(root, BLOB_DIR)
+        self.reused = 0
+        self.stored = 0
+        self.copied = 0
+        # Unknown until count_blobs(); adopt() and prune() keep it current after that
+        self.blobs = None
+        self._blobs_lock = threading.Lock()
+
+    @staticmethod
+    def key_for_url(url):
+        """str: Blob key for a media URL."""
+        return hashlib.sha256(stable_url(url).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def key_for_file(path, chunk_size=1024 * 1024):
+        """str: Blob key for a file's contents."""
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def blob_path(self, key, ext=""):
+        """str: Where the blob for ``key`` lives."""
+        return os.path.join(self.blob_root, key[:2], key + ext)
+
+    def find(self, url, ext=""):
+        """Return the blob path for ``url`` if it has already been stored."""
+        blob = self.blob_path(self.key_for_url(url), ext)
+        return blob if os.path.exists(blob) else None
+
+    def _link(self, src, dest):
+        """Point ``dest`` at ``src``'s bytes, replacing whatever was there."""
+        tmp = f"{dest}.link"
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copy2(src, tmp)
+            self.copied += 1
+        os.replace(tmp, dest)
+
+    def materialize(self, url, dest):
+        """Link an already stored blob for ``url`` to ``dest``.
+
+        Returns:
+            bool: True if ``dest`` now holds the media, False if it has to be downloaded.
+        """
+        blob = self.find(url, os.path.splitext(dest)[1])
+        if blob is None:
+            return False
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        try:
+            if os.path.exists(dest) and os.path.samefile(blob, dest):
+                return True
+            self._link(blob, dest)
+        except OSError:
+            # Pruned between the lookup and the link
+            return False
+        self.reused += 1
+        logger.info(f"[MediaStore] Reused stored media for {os.path.basename(dest)}")
+        return True
+
+    def adopt(self, path, url=None):
+        """Move a freshly downloaded file into the store, leaving a link at ``path``.
+
+        If a blob with the same key already exists, ``path`` is re-pointed at
+        it and the duplicate bytes are released.
+
+        Args:
+            path (str): Downloaded file.
+            url (str): Source URL; the content hash is used when omitted.
+
+        Returns:
+            str: The blob path, or None if the file could not be stored.
+        """
+        key = self.key_for_url(url) if url else self.key_for_file(path)
+        blob = self.blob_path(key, os.path.splitext(path)[1])
+        try:
+            if os.path.exists(blob):
+                if not os.path.samefile(blob, path):
+                    self._link(blob, path)
+                    self.reused += 1
+                return blob
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            os.link(path, blob)
+            self.stored += 1
+            self._count_blobs(1)
+            return blob
+        except OSError as e:
+            # No hardlinks here (or a race with prune); keep the plain file
+            logger.debug(f"[MediaStore] Could not store {path}: {e}")
+            return None
+
+    def prune(self, on_remove=None):
+        """Delete blobs no user/media_type entry links to any more.
+
+        Args:
+            on_remove (callable): Called with the path of each deleted blob.
+
+        Returns:
+            tuple: ``(removed, freed_bytes)``.
+        """
+        removed = 0
+        freed_bytes = 0
+        if not os.path.isdir(self.blob_root):
+            return removed, freed_bytes
+        for dirpath, dirs, files in os.walk(self.blob_root, topdown=False):
+            for name in files:
+                blob = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(blob)
+                    if st.st_nlink <= 1:
+                        os.remove(blob)
+                        removed += 1
+                        freed_bytes += st.st_size
+                        if on_remove is not None:
+                            on_remove(blob)
+                except OSError:
+                    pass
+            if dirpath != self.blob_root:
+                try:
+                    os.rmdir(dirpath)
+                except OSError:
+                    pass  # Directory not empty
+        self._count_blobs(-removed)
+        if removed:
+            logger.info(f"[MediaStore] Pruned {removed} unreferenced blobs ({freed_bytes / (1024 * 1024):.1f} MB)")
+        return removed, freed_bytes
+
+    def _count_blobs(self, delta):
+        with self._blobs_lock:
+            if self.blobs is not None:
+                self.blobs += delta
+
+    def count_blobs(self):
+        """Count the stored blobs once; the count is kept up to date afterwards.
+
+        Walks the whole blob directory, so call it off the event loop.
+
+        Returns:
+            int: Number of blobs.
+        """
+        blobs = 0
+        if os.path.isdir(self.blob_root):
+            blobs = sum(len(files) for _, _, files in os.walk(self.blob_root))
+        with self._blobs_lock:
+            self.blobs = blobs
+        return blobs
+
+    def stats(self):
+        """dict: Counters for ``/stats``; ``blobs`` is None until counted."""
+        return {
+            "blobs": self.blobs,
+            "stored": self.stored,
+            "reused": self.reused,
+            "copied": self.copied,
+        }
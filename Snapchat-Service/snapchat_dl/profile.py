@@ -0,0 +1,457 @@
+"""Helpers for reading Snapchat profile pages."""
+import json
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from dataclasses import field
+
+try:
+    import orjson
+except ImportError:  # optional fast decoder
+    orjson = None
+
+from snapchat_dl.utils import UserNotFoundError
+
+
+NEXT_DATA_OPEN = re.compile(
+    rb'<script\s*id="__NEXT_DATA__"\s*type="application/json"[^>]*>'
+)
+NEXT_DATA_CLOSE = b"</script>"
+
+# Longest opening tag we expect to see; used to keep enough of the previous
+# chunk around when the tag is split across two reads.
+_OPEN_TAG_LOOKBEHIND = 256
+
+
+class NextDataExtractor:
+    """Incrementally extract the ``__NEXT_DATA__`` payload from a profile page.
+
+    Feed the response body chunk by chunk. Only the bytes between the opening
+    ``<script id="__NEXT_DATA__">`` tag and its closing ``</script>`` are kept;
+    everything before the tag is discarded as it is scanned, and the caller can
+    stop reading the body as soon as :attr:`done` is true.
+
+    Args:
+        max_payload (int): Upper bound for the payload size in bytes.
+    """
+
+    def __init__(self, max_payload=16 * 1024 * 1024):
+        self.max_payload = max_payload
+        self.bytes_scanned = 0
+        self._window = b""
+        self._payload = bytearray()
+        self._in_payload = False
+        self._done = False
+
+    @property
+    def done(self):
+        """bool: True once the closing script tag has been seen."""
+        return self._done
+
+    @property
+    def payload(self):
+        """bytes: The raw JSON payload (complete only when :attr:`done`)."""
+        return bytes(self._payload)
+
+    def feed(self, chunk):
+        """Consume the next chunk of the response body.
+
+        Args:
+            chunk (bytes): Raw bytes read from the response.
+
+        Returns:
+            bool: True when the payload is complete and no more input is needed.
+        """
+        if self._done or not chunk:
+            return self._done
+        self.bytes_scanned += len(chunk)
+
+        if not self._in_payload:
+            window = self._window + chunk
+            match = NEXT_DATA_OPEN.search(window)
+            if match is None:
+                self._window = window[-_OPEN_TAG_LOOKBEHIND:]
+                return False
+            self._window = b""
+            self._in_payload = True
+            chunk = window[match.end():]
+
+        # Only search the part that could contain a new closing tag
+        search_from = max(0, len(self._payload) - len(NEXT_DATA_CLOSE) + 1)
+        self._payload += chunk
+        end = self._payload.find(NEXT_DATA_CLOSE, search_from)
+        if end != -1:
+            del self._payload[end:]
+            self._done = True
+        elif len(self._payload) > self.max_payload:
+            raise ValueError("__NEXT_DATA__ payload exceeds max_payload")
+        return self._done
+
+
+def extract_next_data(chunks, max_payload=16 * 1024 * 1024):
+    """Return the ``__NEXT_DATA__`` payload from an iterable of byte chunks.
+
+    Args:
+        chunks (iterable): Byte chunks of an HTML document.
+        max_payload (int): Upper bound for the payload size in bytes.
+
+    Returns:
+        bytes: The payload, or None if the script tag was not found.
+    """
+    extractor = NextDataExtractor(max_payload=max_payload)
+    for chunk in chunks:
+        if extractor.feed(chunk):
+            return extractor.payload
+    return None
+
+
+# pageProps members the downloader actually reads; everything else is skipped.
+PROFILE_KEYS = ("userProfile", "story", "curatedHighlights", "spotHighlights")
+
+# Below this many bytes a full json.loads is cheaper than the selective walk,
+# whose only gain is a lower memory peak on large pages
+SELECTIVE_MIN_SIZE = 1024 * 1024
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_SCALAR = re.compile(r"[^,\]}\s]*")
+# Everything up to the next bracket outside a string: plain characters and
+# whole string literals (escapes included), matched in C without building them.
+# The quantifiers are possessive (Python 3.11+, pinned in server/.python-version):
+# greedy ones would stack backtracking state for every string in the run, which
+# costs more CPU and memory than decoding the whole payload.
+try:
+    _FILLER = re.compile(r'[^"\[\]{}]*+(?:"[^"\\]*+(?:\\.[^"\\]*+)*+"[^"\[\]{}]*+)*+')
+except re.error:
+    _FILLER = None
+_decoder = json.JSONDecoder()
+_scanstring = json.decoder.scanstring
+
+
+def _skip_ws(doc, pos):
+    return _WHITESPACE.match(doc, pos).end()
+
+
+def _skip_container(doc, pos):
+    """Return the index just past the array or object starting at ``doc[pos]``.
+
+    Only brackets are looked at: the scalars and string literals between
+    them are consumed by one regex match per run, so nothing inside the
+    skipped subtree is decoded or allocated.
+    """
+    depth = 0
+    end = len(doc)
+    while pos < end:
+        char = doc[pos]
+        if char in "[{":
+            depth += 1
+        elif char in "]}":
+            depth -= 1
+            if not depth:
+                return pos + 1
+        else:
+            raise ValueError(f"Unterminated string at {pos}")
+        pos = _FILLER.match(doc, pos + 1).end()
+    raise ValueError("Unterminated container")
+
+
+def _skip_value(doc, pos):
+    """Return the index just past the JSON value starting at ``doc[pos]``.
+
+    Nothing is built: strings and scalars are scanned past and containers
+    are skipped by bracket matching. Skipped bytes are only checked for
+    balanced brackets and terminated strings.
+    """
+    first = doc[pos]
+    if first == '"':
+        return _scanstring(doc, pos + 1)[1]
+    if first in "[{":
+        return _skip_container(doc, pos)
+    return _SCALAR.match(doc, pos).end()
+
+
+def _members(doc, pos):
+    """Yield (key, value_start) for the object starting at ``doc[pos]``.
+
+    The consumer must send back the index just past each value.
+    """
+    if doc[pos] != "{":
+        raise ValueError(f"Expected object at {pos}")
+    pos = _skip_ws(doc, pos + 1)
+    if doc[pos] == "}":
+        return
+    while True:
+        if doc[pos] != '"':
+            raise ValueError(f"Expected key at {pos}")
+        key, pos = _scanstring(doc, pos + 1)
+        pos = _skip_ws(doc, pos)
+        if doc[pos] != ":":
+            raise ValueError(f"Expected ':' at {pos}")
+        pos = yield key, _skip_ws(doc, pos + 1)
+        pos = _skip_ws(doc, pos)
+        if doc[pos] == "}":
+            return
+        if doc[pos] != ",":
+            raise ValueError(f"Expected ',' at {pos}")
+        pos = _skip_ws(doc, pos + 1)
+
+
+def _find_member(doc, pos, key):
+    """Return the start of ``key``'s value in the object at ``doc[pos]``, or None."""
+    members = _members(doc, pos)
+    try:
+        name, start = next(members)
+        while True:
+            if name == key:
+                return start
+            name, start = members.send(_skip_value(doc, start))
+    except StopIteration:
+        return None
+
+
+def _select_stdlib(payload, keys):
+    doc = payload.decode("utf-8") if isinstance(payload, (bytes, bytearray)) else payload
+    try:
+        return _walk_page_props(doc, keys)
+    except IndexError:
+        raise ValueError("Truncated __NEXT_DATA__ payload") from None
+
+
+def _walk_page_props(doc, keys):
+    pos = _skip_ws(doc, 0)
+    for key in ("props", "pageProps"):
+        pos = _find_member(doc, pos, key)
+        if pos is None:
+            raise ValueError(f"__NEXT_DATA__ has no {key}")
+
+    wanted = set(keys)
+    selected = {}
+    members = _members(doc, pos)
+    try:
+        name, start = next(members)
+        while True:
+            if name in wanted:
+                selected[name], end = _decoder.raw_decode(doc, start)
+                wanted.discard(name)
+                if not wanted:
+                    break
+            else:
+                end = _skip_value(doc, start)
+            name, start = members.send(end)
+    except StopIteration:
+        pass
+    return selected
+
+
+def _select_decoded(payload, keys, loads):
+    try:
+        page_props = loads(payload)["props"]["pageProps"]
+    except (KeyError, TypeError):
+        raise ValueError("__NEXT_DATA__ has no props.pageProps")
+    return {key: page_props[key] for key in keys if key in page_props}
+
+
+def select_page_props(payload, keys=PROFILE_KEYS):
+    """Decode only the requested members of ``props.pageProps``.
+
+    Payloads of at least ``SELECTIVE_MIN_SIZE`` bytes are walked member by
+    member with the stdlib decoder: only the requested subtrees are decoded,
+    the values of all other members are skipped by bracket matching without
+    building any of their objects, and the walk stops once every requested
+    key has been found. The walk costs more CPU than ``json.loads`` (about
+    24 vs 17 ms on a 2.9 MB page) but peaks at roughly half the memory, so
+    smaller payloads are decoded whole and the unwanted members dropped.
+    So is every payload on Python < 3.11, which lacks the regex the walk needs.
+    When ``orjson`` is installed it always decodes the whole payload: that
+    path is not selective, its gain is the faster decoder.
+
+    Args:
+        payload (bytes | str): The raw ``__NEXT_DATA__`` JSON.
+        keys (iterable): pageProps member names to decode.
+
+    Returns:
+        dict: Decoded members keyed by name; missing keys are absent.
+
+    Raises:
+        ValueError: If the payload is not valid JSON or lacks ``props.pageProps``.
+    """
+    if orjson is not None:
+        return _select_decoded(payload, keys, orjson.loads)
+    if _FILLER is None or len(payload) < SELECTIVE_MIN_SIZE:
+        return _select_decoded(payload, keys, json.loads)
+    return _select_stdlib(payload, keys)
+
+
+@dataclass
+class ProfileSnapshot:
+    """The parts of a public profile the downloader uses.
+
+    Built by :meth:`from_payload` through :func:`select_page_props`, which
+    only builds these members when it walks a large payload with the stdlib
+    (small payloads, and every payload with ``orjson``, are decoded whole).
+
+    Args:
+        username (str): Profile username.
+        user_info (dict): The ``userProfile`` case payload.
+        stories (list): Current story snaps.
+        curated_highlights (list): Highlight groups, each with a ``snapList``.
+        spot_highlights (list): Spotlight groups, each with a ``snapList``.
+    """
+
+    username: str
+    user_info: dict
+    stories: list = field(default_factory=list)
+    curated_highlights: list = field(default_factory=list)
+    spot_highlights: list = field(default_factory=list)
+
+    @classmethod
+    def from_page_props(cls, username, page_props):
+        """Build a snapshot from a (selectively) decoded pageProps dict.
+
+        Raises:
+            UserNotFoundError: If the page carries no user profile.
+        """
+        user_profile = page_props.get("userProfile")
+        if not user_profile:
+            raise UserNotFoundError
+        return cls(
+            username=username,
+            user_info=user_profile[user_profile["$case"]],
+            stories=(page_props.get("story") or {}).get("snapList") or [],
+            curated_highlights=page_props.get("curatedHighlights") or [],
+            spot_highlights=page_props.get("spotHighlights") or [],
+        )
+
+    @classmethod
+    def from_payload(cls, username, payload):
+        """Build a snapshot straight from a raw ``__NEXT_DATA__`` payload."""
+        return cls.from_page_props(username, select_page_props(payload))
+
+    @staticmethod
+    def _flatten(groups):
+        snaps = []
+        for group in groups:
+            if "snapList" in group:
+                snaps.extend(group["snapList"])
+            elif "snapUrls" in group:
+                snaps.append(group)
+        return snaps
+
+    @property
+    def highlight_snaps(self):
+        """list: Snaps from every curated highlight group."""
+        return self._flatten(self.curated_highlights)
+
+    @property
+    def spotlight_snaps(self):
+        """list: Snaps from every spotlight group."""
+        return self._flatten(self.spot_highlights)
+
+
+@dataclass
+class CachedProfile:
+    """A cached snapshot plus the validators needed to revalidate it."""
+
+    snapshot: ProfileSnapshot
+    etag: str = None
+    last_modified: str = None
+    stored_at: float = 0.0
+
+
+class ProfileCache:
+    """LRU cache of profile snapshots keyed by username.
+
+    Entries are served without a request while younger than ``ttl`` seconds.
+    Older entries are kept (until evicted) so their ``ETag``/``Last-Modified``
+    can be sent with the next fetch; a ``304`` then refreshes the entry
+    without downloading the page again.
+
+    Args:
+        ttl (float): Seconds an entry is served without revalidation.
+        max_size (int): Maximum number of usernames kept; least recently used
+            entries are evicted first.
+    """
+
+    def __init__(self, ttl=30, max_size=128):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.revalidated = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(username):
+        return username.lower()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, username):
+        """Return ``(entry, fresh)`` for a username and count the outcome.
+
+        ``entry`` is None on a miss; ``fresh`` is True only when the entry can
+        be served without going back to Snapchat.
+        """
+        key = self._key(username)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None, False
+        self._entries.move_to_end(key)
+        if time.monotonic() - entry.stored_at < self.ttl:
+            self.hits += 1
+            return entry, True
+        self.stale += 1
+        return entry, False
+
+    def peek(self, username):
+        """Return the entry for a username, fresh or not, without counting it."""
+        return self._entries.get(self._key(username))
+
+    def store(self, username, snapshot, etag=None, last_modified=None):
+        """Insert or replace the entry for a username and return it."""
+        key = self._key(username)
+        entry = CachedProfile(snapshot, etag, last_modified, time.monotonic())
+        if self.max_size <= 0:
+            return entry
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return entry
+
+    def revalidate(self, username, entry, etag=None, last_modified=None):
+        """Mark a stale entry fresh again after a ``304 Not Modified``."""
+        self.revalidated += 1
+        return self.store(
+            username,
+            entry.snapshot,
+            etag or entry.etag,
+            last_modified or entry.last_modified,
+        )
+
+    def invalidate(self, username=None):
+        """Drop one username, or every entry when ``username`` is None."""
+        if username is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(self._key(username), None)
+
+    def stats(self):
+        """dict: Counters for ``/stats``."""
+        lookups = self.hits + self.misses + self.stale
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "revalidated": self.revalidated,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
@@ -0,0 +1,57 @@
+"""Coalesce concurrent async calls that share a key."""
+import asyncio
+from functools import partial
+
+
+class SingleFlight:
+    """Run at most one call per key at a time.
+
+    Callers that arrive while a call for the same key is in flight await that
+    call's result (or exception) instead of starting their own. Each waiter is
+    shielded, so cancelling one caller does not cancel the shared call for the
+    others.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.started = 0
+        self.coalesced = 0
+
+    async def do(self, key, func, *args, **kwargs):
+        """Await ``func(*args, **kwargs)``, sharing it with concurrent callers.
+
+        Args:
+            key (hashable): Calls with equal keys are coalesced.
+            func (callable): Coroutine function to run when no call is in flight.
+
+        Returns:
+            The shared call's result.
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self._calls[key] = task
+            self.started += 1
+            task.add_done_callback(partial(self._forget, key))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Every waiter may have been cancelled; mark the error as retrieved
+        if not task.cancelled():
+            task.exception()
+
+    def in_flight(self):
+        """int: Number of keys with a call currently running."""
+        return len(self._calls)
+
+    def stats(self):
+        """dict: Counters for ``/stats``."""
+        return {
+            "in_flight": len(self._calls),
+            "started": self.started,
+            "coalesced": self.coalesced,
+        }
@@ -1,9 +1,8 @@
 """The Main Snapchat Downloader Class."""
 
-import concurrent.futures
+import contextlib
 import json
 import os
-import re
 import asyncio
 import aiohttp
 from dotenv import load_dotenv
@@ -15,17 +14,22 @@ import tempfile
 import shutil
 from pathlib import Path
 from datetime import datetime
-import portalocker
 import traceback
-import platform
 
-# Import msvcrt only on Windows
-if platform.system() == "Windows":
-    import msvcrt
-else:
-    msvcrt = None
-
-from snapchat_dl.downloader import download_url
+from snapchat_dl.downloader import download_url_async
+from snapchat_dl.downloader import DownloadError
+from snapchat_dl.downloader import PART_SUFFIX
+from snapchat_dl.downloader import part_path
+from snapchat_dl.filelock import LOCK_DIR
+from snapchat_dl.filelock import LockManager
+from snapchat_dl.filelock import LockTimeout
+from snapchat_dl.media_index import INDEX_FILE
+from snapchat_dl.media_index import MediaIndex
+from snapchat_dl.media_store import MediaStore
+from snapchat_dl.profile import NextDataExtractor
+from snapchat_dl.profile import ProfileCache
+from snapchat_dl.profile import ProfileSnapshot
+from snapchat_dl.singleflight import SingleFlight
 from snapchat_dl.utils import APIResponseError
 from snapchat_dl.utils import dump_response
 from snapchat_dl.utils import MEDIA_TYPE
@@ -35,70 +39,14 @@ from snapchat_dl.utils import UserNotFoundError
 
 load_dotenv()
 
-class FileLock:
-    def __init__(self, filename):
-        self.filename = filename
-        self.lock_file = f"{filename}.lock"
-        self.lock = None
-        self.max_retries = 3
-        self.retry_delay = 0.1  # 100ms
-
-    def __enter__(self):
-        retries = 0
-        while retries < self.max_retries:
-            try:
-                # Create the lock file if it doesn't exist
-                if not os.path.exists(self.lock_file):
-                    with open(self.lock_file, 'w') as f:
-                        f.write(str(os.getpid()))
-                
-                # Try to acquire the lock
-                self.lock = open(self.lock_file, 'r+')
-                try:
-                    # Try to get an exclusive lock (Windows-specific)
-                    if msvcrt:
-                        msvcrt.locking(self.lock.fileno(), msvcrt.LK_NBLCK, 1)
-                    # If successful, write our PID to the lock file
-                    self.lock.seek(0)
-                    self.lock.write(str(os.getpid()))
-                    self.lock.truncate()
-                    self.lock.flush()
-                    return self
-                except (IOError, OSError):
-                    # If we couldn't get the lock, close the file and retry
-                    self.lock.close()
-                    self.lock = None
-                    retries += 1
-                    if retries == self.max_retries:
-                        raise
-                    time.sleep(self.retry_delay)
-            except Exception as e:
-                if self.lock:
-                    self.lock.close()
-                    self.lock = None
-                retries += 1
-                if retries == self.max_retries:
-                    raise
-                time.sleep(self.retry_delay)
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.lock:
-            try:
-                # Release the lock (Windows-specific)
-                if msvcrt:
-                    msvcrt.locking(self.lock.fileno(), msvcrt.LK_UNLCK, 1)
-                self.lock.close()
-            except:
-                pass
-            try:
-                # Remove the lock file if it exists and belongs to us
-                if os.path.exists(self.lock_file):
-                    with open(self.lock_file, 'r') as f:
-                        pid = f.read().strip()
-                        if pid == str(os.getpid()):
-                            os.remove(self.lock_file)
-            except:
-                pass
+def _part_written_within(output, seconds):
+    """bool: Whether the ``.part`` file of ``output`` was written to in the last ``seconds``."""
+    try:
+        return time.time() - os.path.getmtime(part_path(output)) <= seconds
+    except OSError:
+        return False
+
 
 class SnapchatDL:
     def __init__(
@@ -109,6 +57,7 @@ class SnapchatDL:
         sleep_interval=1,
         quiet=False,
         dump_json=False,
+        session=None,
     ):
         self.directory_prefix = os.path.abspath(os.path.normpath(directory_prefix))
         self.max_workers = max_workers
@@ -117,104 +66,210 @@ class SnapchatDL:
         self.quiet = quiet
         self.dump_json = dump_json
         self.endpoint_web = "https://www.snapchat.com/add/{}/"
-        self.regexp_web_json = (
-            r'<script\s*id="__NEXT_DATA__"\s*type="application\/json">([^<]+)</script>'
-        )
         self.response_ok = 200
+        self.read_chunk_size = 64 * 1024
+        # Bytes left after </script> that we still drain so the pooled
+        # connection can be reused; longer tails close the connection instead.
+        self.max_drain_bytes = 64 * 1024
+        self.user_agent = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36"
+
+        # HTTP connection pool shared by every profile fetch made through this instance.
+        # A session passed in by the caller is used as-is and never closed here.
+        self._session = session
+        self._owns_session = session is None
+        self.pool_limit = int(os.getenv("SNAPCHAT_HTTP_POOL_LIMIT", "20"))
+        self.pool_limit_per_host = int(os.getenv("SNAPCHAT_HTTP_POOL_LIMIT_PER_HOST", "8"))
+        self.dns_cache_ttl = int(os.getenv("SNAPCHAT_HTTP_DNS_TTL", "300"))
+        self.keepalive_timeout = float(os.getenv("SNAPCHAT_HTTP_KEEPALIVE", "60"))
+        self.request_timeout = float(os.getenv("SNAPCHAT_HTTP_TIMEOUT", "30"))
+
+        # Recently fetched profiles, so back-to-back lookups of the same user
+        # (manual download, polling) don't each go back to Snapchat.
+        self.profile_cache = ProfileCache(
+            ttl=float(os.getenv("SNAPCHAT_PROFILE_CACHE_TTL", "30")),
+            max_size=int(os.getenv("SNAPCHAT_PROFILE_CACHE_SIZE", "128")),
+        )
+        # Concurrent fetches of the same username share one request
+        self.profile_fetches = SingleFlight()
+
+        # Media downloads run as tasks on the event loop; at most max_workers
+        # at a time, keyed by (username, media_type, filename) for cancellation.
+        self._download_slots = None
+        self._download_tasks = {}
+
+        # Per-file locks shared with other worker processes, so two of them
+        # never write the same download or migrate the same metadata at once
+        self.locks = LockManager(
+            os.path.join(self.directory_prefix, LOCK_DIR),
+            timeout=float(os.getenv("SNAPCHAT_LOCK_TIMEOUT", "30")),
+        )
 
-    async def _api_response(self, username):
-        async with aiohttp.ClientSession() as session:
-            web_url = self.endpoint_web.format(username)
-            async with session.get(
-                web_url,
-                headers={
-                    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36"
-                }
-            ) as response:
-                if response.status != self.response_ok:
-                    raise APIResponseError(f"API returned status {response.status}")
-                return await response.text()
-
-    async def _web_fetch_story(self, username):
-        response = await self._api_response(username)
-        response_json_raw = re.findall(self.regexp_web_json, response)
+        # Media bytes are stored once and hardlinked into each user/media_type folder
+        self.media_store = MediaStore(self.directory_prefix)
+
+        # One SQLite row per media item instead of a JSON array per folder
+        self.media_index = MediaIndex(
+            os.path.join(self.directory_prefix, INDEX_FILE),
+            flush_interval=float(os.getenv("SNAPCHAT_METADATA_FLUSH_INTERVAL", "1.0")),
+        )
+        with self.locks.lock(self.media_index.path):
+            self.media_index.migrate_json(self.directory_prefix)
+
+    async def get_session(self):
+        """Return the pooled aiohttp session, creating it on first use.
+
+        The session keeps connections alive between polls and caches DNS
+        lookups, so repeated profile fetches skip the TCP/TLS handshake.
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_limit,
+                limit_per_host=self.pool_limit_per_host,
+                ttl_dns_cache=self.dns_cache_ttl,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.request_timeout),
+                headers={"User-Agent": self.user_agent},
+            )
+            self._owns_session = True
+        return self._session
+
+    async def close(self):
+        """Close the pooled session if this instance created it and flush pending metadata."""
+        self.media_index.flush()
+        if self._owns_session and self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def __aenter__(self):
+        await self.get_session()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def _api_response(self, username, cached=None):
+        """Fetch a profile page and return its raw ``__NEXT_DATA__`` payload.
+
+        The body is streamed in chunks and only the JSON payload is buffered;
+        reading stops as soon as the closing script tag is seen.
+
+        Args:
+            username (str): Snapchat username.
+            cached (CachedProfile): Previous response whose validators are
+                sent as ``If-None-Match``/``If-Modified-Since``.
+
+        Returns:
+            tuple: ``(payload, etag, last_modified)``; payload is None when the
+            server answered ``304 Not Modified``.
+        """
+        session = await self.get_session()
+        web_url = self.endpoint_web.format(username)
+        headers = {}
+        if cached is not None:
+            if cached.etag:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified:
+                headers["If-Modified-Since"] = cached.last_modified
+        extractor = NextDataExtractor()
+        async with session.get(web_url, headers=headers) as response:
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+            if response.status == 304 and cached is not None:
+                return None, etag, last_modified
+            if response.status != self.response_ok:
+                raise APIResponseError(f"API returned status {response.status}")
+            async for chunk in response.content.iter_chunked(self.read_chunk_size):
+                if extractor.feed(chunk):
+                    break
+            if not extractor.done:
+                raise APIResponseError("__NEXT_DATA__ not found in profile page")
+            await self._discard_tail(response)
+        return extractor.payload, etag, last_modified
+
+    async def _discard_tail(self, response):
+        """Drain a short remainder of the body so the connection stays reusable."""
+        drained = 0
+        while not response.content.at_eof():
+            chunk = await response.content.readany()
+            if not chunk:
+                break
+            drained += len(chunk)
+            if drained > self.max_drain_bytes:
+                response.close()
+                return
+
+    async def fetch_profile(self, username, use_cache=True):
+        """Fetch a profile page once and return everything the downloaders need.
+
+        Fresh cached snapshots are returned without a request, and callers
+        asking for a username that is already being fetched share that fetch.
+
+        Args:
+            username (str): Snapchat username.
+            use_cache (bool): Set to False to ignore a fresh cached snapshot.
+
+        Returns:
+            ProfileSnapshot: Stories, curated highlights and spotlights.
+
+        Raises:
+            APIResponseError: If the page could not be fetched or parsed.
+            UserNotFoundError: If the page carries no user profile.
+        """
+        if use_cache:
+            cached, fresh = self.profile_cache.lookup(username)
+        else:
+            cached, fresh = self.profile_cache.peek(username), False
+        if fresh:
+            snapshot = cached.snapshot
+        else:
+            snapshot = await self.profile_fetches.do(
+                username.lower(), self._refresh_profile, username, cached
+            )
+
+        # Store the additional data in the instance for later use
+        self._curated_highlights = snapshot.curated_highlights
+        self._spot_highlights = snapshot.spot_highlights
+        return snapshot
+
+    async def _refresh_profile(self, username, cached):
+        payload, etag, last_modified = await self._api_response(username, cached)
+        if payload is None:
+            logger.debug(f"[Profile] {username} not modified, reusing cached snapshot")
+            return self.profile_cache.revalidate(username, cached, etag, last_modified).snapshot
         try:
-            response_json = json.loads(response_json_raw[0])
-            def util_web_user_info(content: dict):
-                if "userProfile" in content["props"]["pageProps"]:
-                    user_profile = content["props"]["pageProps"]["userProfile"]
-                    field_id = user_profile["$case"]
-                    return user_profile[field_id]
-                else:
-                    raise UserNotFoundError
-            def util_web_story(content: dict):
-                if "story" in content["props"]["pageProps"]:
-                    return content["props"]["pageProps"]["story"]["snapList"]
-                return list()
-            def util_web_extract(content: dict, key: str):
-                if key in content["props"]["pageProps"]:
-                    return content["props"]["pageProps"][key]
-                return list()
-            
-            user_info = util_web_user_info(response_json)
-            stories = util_web_story(response_json)
-            curated_highlights = util_web_extract(response_json, "curatedHighlights")
-            spot_highlights = util_web_extract(response_json, "spotHighlights")
-            
-            # Yield each story as it's processed
-            for story in stories:
-                yield story, user_info
-            
-            # Store the additional data in the instance for later use
-            self._curated_highlights = curated_highlights
-            self._spot_highlights = spot_highlights
-            
-        except (IndexError, KeyError, ValueError):
-            raise APIResponseError
+            snapshot = ProfileSnapshot.from_payload(username, payload)
+        except (IndexError, KeyError, ValueError) as e:
+            raise APIResponseError(f"Unreadable profile page for {username}") from e
+        self.profile_cache.store(username, snapshot, etag, last_modified)
+        return snapshot
 
-    def _get_metadata_path(self, username, media_type):
-        return os.path.join(self.directory_prefix, username, media_type, ".media_metadata.json")
+    async def _web_fetch_story(self, username, snapshot=None):
+        if snapshot is None:
+            snapshot = await self.fetch_profile(username)
+
+        # Yield each story as it's processed
+        for story in snapshot.stories:
+            yield story, snapshot.user_info
 
     def _load_media_metadata(self, username, media_type):
-        metadata_file = self._get_metadata_path(username, media_type)
-        if not os.path.exists(metadata_file):
+        try:
+            return self.media_index.items(username, media_type)
+        except Exception as e:
+            logger.error(f"Error loading metadata for {username}/{media_type}: {e}")
             return []
-        with FileLock(metadata_file):
-            try:
-                with open(metadata_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON decode error in metadata file for {username}/{media_type}: {e}")
-                return []
-            except Exception as e:
-                logger.error(f"Error loading metadata for {username}/{media_type}: {e}")
-                return []
 
     def _save_media_metadata(self, username, media_type, metadata):
-        metadata_file = self._get_metadata_path(username, media_type)
-        temp_file = f"{metadata_file}.tmp"
-        os.makedirs(os.path.dirname(metadata_file), exist_ok=True)
-        with FileLock(metadata_file):
-            try:
-                with open(temp_file, 'w', encoding='utf-8') as f:
-                    json.dump(metadata, f, indent=2, ensure_ascii=False)
-                os.replace(temp_file, metadata_file)
-            except Exception as e:
-                logger.error(f"Error saving metadata for {username}/{media_type}: {e}")
-                if os.path.exists(temp_file):
-                    os.remove(temp_file)
-                raise
-
-    def _update_media_metadata(self, username, media_type, filename, status, progress=None):
-        with FileLock(self._get_metadata_path(username, media_type)):
-            metadata = self._load_media_metadata(username, media_type)
-            for item in metadata:
-                if item["filename"] == filename:
-                    item["download_status"] = status
-                    if progress is not None:
-                        item["progress"] = progress
-                    break
-            self._save_media_metadata(username, media_type, metadata)
+        try:
+            self.media_index.replace(username, media_type, metadata)
+        except Exception as e:
+            logger.error(f"Error saving metadata for {username}/{media_type}: {e}")
+            raise
+
+    def _update_media_metadata(self, username, media_type, filename, status, progress=None, defer=False):
+        self.media_index.update_status(username, media_type, filename, status, progress, defer=defer)
 
     def _create_progress_callback(self, username, media_type, filename, total, downloaded, progress_callback):
         last_progress = 0
@@ -230,8 +285,8 @@ class SnapchatDL:
             # Only update if enough time has passed or progress has changed significantly
             if current_time - last_update_time >= update_interval or (progress is not None and abs(progress - last_progress) >= 5):
                 try:
-                    # Update metadata
-                    self._update_media_metadata(username, media_type, filename, "in_progress", progress or 0)
+                    # Progress ticks are batched; complete/error flush them
+                    self._update_media_metadata(username, media_type, filename, "in_progress", progress or 0, defer=True)
                     
                     # Prepare WebSocket message
                     ws_message = {
@@ -253,10 +308,10 @@ class SnapchatDL:
                     
                     # Send metadata update less frequently
                     if current_time - last_metadata_update >= metadata_update_interval:
-                        metadata = self._load_media_metadata(username, media_type)
+                        item = self.media_index.get(username, media_type, filename)
                         metadata_message = {
                             "type": "metadata_update",
-                            "items": [item for item in metadata if item["filename"] == filename]
+                            "items": [item] if item else []
                         }
                         if progress_callback:
                             await progress_callback(metadata_message)
@@ -271,7 +326,252 @@ class SnapchatDL:
 
         return callback
 
-    async def download(self, username, progress_callback=None):
+    def _start_download(self, username, media_type, filename, media_url, media_output, file_progress_callback):
+        """Schedule one file download on the event loop and register it for cancellation.
+
+        A file that is already downloading is not started twice: its running
+        task is returned instead.
+        """
+        key = (username, media_type, filename)
+        task = self._download_tasks.get(key)
+        if task is not None and not task.done():
+            return task
+        task = asyncio.ensure_future(
+            self.fetch_media(media_url, media_output, file_progress_callback)
+        )
+        self._download_tasks[key] = task
+        task.add_done_callback(lambda done: self._forget_download(key, done))
+        return task
+
+    def _forget_download(self, key, task):
+        # A newer task may have been registered under the same key meanwhile
+        if self._download_tasks.get(key) is task:
+            del self._download_tasks[key]
+
+    @contextlib.asynccontextmanager
+    async def _output_lock(self, media_output):
+        """Hold the lock of ``media_output``, however long its download takes.
+
+        The lock times out after ``SNAPCHAT_LOCK_TIMEOUT`` seconds, but the
+        holder of an output path is usually downloading it. As long as its
+        ``.part`` file keeps growing the wait goes on; only a holder that
+        makes no progress for a whole timeout raises :class:`LockTimeout`.
+        """
+        lock = self.locks.lock(media_output)
+        while True:
+            try:
+                await lock.acquire_async()
+                break
+            except LockTimeout:
+                if not _part_written_within(media_output, lock.timeout):
+                    raise
+                logger.debug(f"[Download] {os.path.basename(media_output)} is downloading elsewhere, still waiting")
+        try:
+            yield
+        finally:
+            lock.release()
+
+    async def fetch_media(self, media_url, media_output, progress_callback=None):
+        """Place the media behind ``media_url`` at ``media_output``.
+
+        Media already in the store is linked without touching the network;
+        otherwise it is downloaded (at most ``max_workers`` at a time) and
+        added to the store. The output path is locked only while it is linked
+        or actually being downloaded, never while queued for a download slot:
+        other worker processes share lock stripes between paths, so a lock
+        held in the queue would keep their unrelated files waiting for the
+        whole queue. A second task or worker process asking for the same file
+        waits for the running download, however long it takes, and then
+        links the stored copy instead of writing the same ``.part`` file.
+
+        Returns:
+            str: The output filename.
+
+        Raises:
+            LockTimeout: If another holder keeps the file locked without
+                making download progress for ``SNAPCHAT_LOCK_TIMEOUT`` seconds.
+        """
+        async with self._output_lock(media_output):
+            if self.media_store.materialize(media_url, media_output):
+                return os.path.basename(media_output)
+        if self._download_slots is None:
+            # Created lazily so it binds to the loop that runs the downloads
+            self._download_slots = asyncio.Semaphore(self.max_workers)
+        async with self._download_slots:
+            async with self._output_lock(media_output):
+                # Another task or process may have stored it while this one queued
+                if self.media_store.materialize(media_url, media_output):
+                    return os.path.basename(media_output)
+                session = await self.get_session()
+                result = await download_url_async(
+                    session,
+                    media_url,
+                    media_output,
+                    self.sleep_interval,
+                    progress_callback,
+                )
+                self.media_store.adopt(media_output, media_url)
+                return result
+
+    def cancel_download(self, username, media_type=None, filename=None):
+        """Cancel running downloads for a user, optionally narrowed to one media type or file.
+
+        Args:
+            username (str): Snapchat username.
+            media_type (str): ``stories``, ``highlights`` or ``spotlights``.
+            filename (str): A single file to cancel.
+
+        Returns:
+            int: Number of downloads cancelled.
+        """
+        cancelled = 0
+        for (task_user, task_type, task_file), task in list(self._download_tasks.items()):
+            if task_user != username:
+                continue
+            if media_type is not None and task_type != media_type:
+                continue
+            if filename is not None and task_file != filename:
+                continue
+            if task.cancel():
+                cancelled += 1
+        return cancelled
+
+    async def recover_partial_downloads(self, max_age=None):
+        """Resume or purge ``.part`` files left behind by an interrupted run.
+
+        A part file is resumed when its metadata entry still has the source URL
+        and it is younger than ``max_age`` seconds (``SNAPCHAT_PART_MAX_AGE``,
+        default 6 hours); otherwise it is deleted and the entry marked as failed.
+
+        Returns:
+            dict: Counts of ``resumed`` and ``purged`` part files.
+        """
+        if max_age is None:
+            max_age = float(os.getenv("SNAPCHAT_PART_MAX_AGE", str(6 * 3600)))
+        resumed = 0
+        purged = 0
+        if not os.path.isdir(self.directory_prefix):
+            return {"resumed": resumed, "purged": purged}
+
+        now = time.time()
+        for username in os.listdir(self.directory_prefix):
+            for media_type in ("stories", "highlights", "spotlights"):
+                media_dir = os.path.join(self.directory_prefix, username, media_type)
+                if not os.path.isdir(media_dir):
+                    continue
+                parts = [name for name in os.listdir(media_dir) if name.endswith(PART_SUFFIX)]
+                if not parts:
+                    continue
+
+                entries = {item.get("filename"): item for item in self._load_media_metadata(username, media_type)}
+                futures = []
+                for part in parts:
+                    filename = part[:-len(PART_SUFFIX)]
+                    part_file = os.path.join(media_dir, part)
+                    item = entries.get(filename) or {}
+                    source_url = item.get("source_url")
+                    if (username, media_type, filename) in self._download_tasks:
+                        continue
+                    try:
+                        age = now - os.path.getmtime(part_file)
+                    except OSError:
+                        continue
+
+                    if source_url and age < max_age:
+                        logger.info(f"[Download] Resuming interrupted download {username}/{media_type}/{filename}")
+                        future = self._start_download(
+                            username, media_type, filename, source_url, os.path.join(media_dir, filename), None
+                        )
+                        futures.append((future, filename))
+                        resumed += 1
+                    else:
+                        logger.info(f"[Download] Purging stale partial file {username}/{media_type}/{part}")
+                        try:
+                            os.remove(part_file)
+                        except OSError:
+                            pass
+                        purged += 1
+                        if item and item.get("download_status") != "complete":
+                            self._update_media_metadata(username, media_type, filename, "error", 0)
+
+                if futures:
+                    await self._collect_downloads(username, media_type, futures, len(futures), 0, None)
+
+        return {"resumed": resumed, "purged": purged}
+
+    async def _collect_downloads(self, username, media_type, futures, total, downloaded, progress_callback):
+        """Wait for download tasks, reporting each one as it finishes.
+
+        Returns:
+            int: The updated ``downloaded`` count.
+        """
+        pending = {future: filename for future, filename in futures}
+        while pending:
+            done, _ = await asyncio.wait(list(pending), return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                filename = pending.pop(future)
+                try:
+                    if future.cancelled():
+                        raise DownloadError("Download cancelled")
+                    result = future.result()
+                    if result:
+                        downloaded += 1
+                        logger.info(f"[Download] Completed {result} ({downloaded}/{total})")
+                        self._update_media_metadata(username, media_type, result, "complete", 100)
+
+                        # Send completion update
+                        if progress_callback:
+                            ws_message = {
+                                "files": {
+                                    result: {
+                                        "status": "complete",
+                                        "progress": 100
+                                    }
+                                },
+                                "overall": {
+                                    "status": "complete" if downloaded == total else "in_progress",
+                                    "downloaded": downloaded,
+                                    "total_files": total,
+                                    "progress": (downloaded / total * 100) if total > 0 else 0
+                                }
+                            }
+                            await progress_callback(ws_message)
+                except Exception as e:
+                    logger.error(f"[Download] Error downloading {filename}: {e}")
+                    self._update_media_metadata(username, media_type, filename, "error", 0)
+                    if progress_callback:
+                        ws_message = {
+                            "files": {
+                                filename: {
+                                    "status": "error",
+                                    "progress": 0,
+                                    "error": str(e)
+                                }
+                            },
+                            "overall": {
+                                "status": "error",
+                                "downloaded": downloaded,
+                                "total_files": total,
+                                "progress": (downloaded / total * 100) if total > 0 else 0
+                            }
+                        }
+                        await progress_callback(ws_message)
+        return downloaded
+
+    async def download_all(self, username, progress_callback=None):
+        """Download stories, highlights and spotlights from a single profile fetch.
+
+        Returns:
+            dict: Media URLs keyed by ``stories``, ``highlights`` and ``spotlights``.
+        """
+        snapshot = await self.fetch_profile(username)
+        return {
+            "stories": await self.download(username, progress_callback, snapshot=snapshot),
+            "highlights": await self.download_highlights(username, progress_callback, snapshot=snapshot),
+            "spotlights": await self.download_spotlights(username, progress_callback, snapshot=snapshot),
+        }
+
+    async def download(self, username, progress_callback=None, snapshot=None):
         try:
             logger.info(f"[Download] Starting download for {username}")
             
@@ -283,8 +583,7 @@ class SnapchatDL:
             logger.info(f"[Download] Output directory: {dir_name}")
 
             # Load existing metadata (don't clear it - preserve previous downloads)
-            existing_metadata = self._load_media_metadata(username, "stories")
-            existing_filenames = {item.get("filename") for item in existing_metadata}
+            existing_filenames = self.media_index.filenames(username, "stories")
             
             # Send initial state
             if progress_callback:
@@ -302,7 +601,7 @@ class SnapchatDL:
             # Collect all stories first
             stories = []
             story_count = 0
-            async for story, user_info in self._web_fetch_story(username):
+            async for story, user_info in self._web_fetch_story(username, snapshot):
                 if self.limit_story > -1 and story_count >= self.limit_story:
                     break
                     
@@ -325,129 +624,81 @@ class SnapchatDL:
 
             # Process and download files concurrently
             media_urls = []  # Track URLs for return value
-            with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-                futures = []
-                for story, user_info in stories:
-                    snap_id = story["snapId"]["value"]
-                    media_url = story["snapUrls"]["mediaUrl"]
-                    media_urls.append(media_url)  # Collect URL
-                    media_type = story["snapMediaType"]
-                    timestamp = int(story["timestampInSec"]["value"])
-                    filename = strf_time(timestamp, "%Y-%m-%d_%H-%M-%S_{}_{}.{}").format(
-                        snap_id, username, MEDIA_TYPE[media_type]
-                    )
-                    thumbnail_url = story["snapUrls"].get("mediaPreviewUrl") or media_url
-                    
-                    # Skip if already exists in metadata (avoid duplicates)
-                    if filename in existing_filenames:
-                        logger.info(f"[Download] Skipping duplicate: {filename}")
-                        continue
-                    
-                    # Add to metadata immediately
-                    metadata = self._load_media_metadata(username, "stories")
-                    new_item = {
-                        "filename": filename,
-                        "type": "video" if MEDIA_TYPE[media_type] == "mp4" else "image",
-                        "thumbnail_url": thumbnail_url,
-                        "download_status": "not_started",
-                        "progress": 0,
-                        "download_url": f"/downloads/{username}/stories/{filename}"
+            futures = []
+            for story, user_info in stories:
+                snap_id = story["snapId"]["value"]
+                media_url = story["snapUrls"]["mediaUrl"]
+                media_urls.append(media_url)  # Collect URL
+                media_type = story["snapMediaType"]
+                timestamp = int(story["timestampInSec"]["value"])
+                filename = strf_time(timestamp, "%Y-%m-%d_%H-%M-%S_{}_{}.{}").format(
+                    snap_id, username, MEDIA_TYPE[media_type]
+                )
+                thumbnail_url = story["snapUrls"].get("mediaPreviewUrl") or media_url
+                
+                # Skip if already exists in metadata (avoid duplicates)
+                if filename in existing_filenames:
+                    logger.info(f"[Download] Skipping duplicate: {filename}")
+                    continue
+                
+                # Add to metadata immediately
+                new_item = {
+                    "filename": filename,
+                    "type": "video" if MEDIA_TYPE[media_type] == "mp4" else "image",
+                    "thumbnail_url": thumbnail_url,
+                    "download_status": "not_started",
+                    "progress": 0,
+                    "download_url": f"/downloads/{username}/stories/{filename}",
+                    "source_url": media_url
+                }
+                self.media_index.add(username, "stories", new_item)
+                existing_filenames.add(filename)  # Track to avoid duplicates in same session
+                
+                # Send metadata update
+                if progress_callback:
+                    metadata_message = {
+                        "type": "metadata_update",
+                        "items": [new_item]
                     }
-                    metadata.append(new_item)
-                    existing_filenames.add(filename)  # Track to avoid duplicates in same session
-                    self._save_media_metadata(username, "stories", metadata)
-                    
-                    # Send metadata update
-                    if progress_callback:
-                        metadata_message = {
-                            "type": "metadata_update",
-                            "items": [metadata[-1]]
-                        }
-                        await progress_callback(metadata_message)
+                    await progress_callback(metadata_message)
 
-                    media_output = os.path.join(dir_name, filename)
-                    logger.info(f"[Download] Starting download for {filename} to {media_output}")
+                media_output = os.path.join(dir_name, filename)
+                logger.info(f"[Download] Starting download for {filename} to {media_output}")
 
-                    # Create progress callback
-                    file_progress_callback = self._create_progress_callback(
-                        username, "stories", filename, total, downloaded, progress_callback
-                    )
+                # Create progress callback
+                file_progress_callback = self._create_progress_callback(
+                    username, "stories", filename, total, downloaded, progress_callback
+                )
 
-                    # Update status to in_progress before starting download
-                    self._update_media_metadata(username, "stories", filename, "in_progress", 0)
-                    if progress_callback:
-                        ws_message = {
-                            "files": {
-                                filename: {
-                                    "status": "in_progress",
-                                    "progress": 0
-                                }
-                            },
-                            "overall": {
+                # Update status to in_progress before starting download
+                self._update_media_metadata(username, "stories", filename, "in_progress", 0)
+                if progress_callback:
+                    ws_message = {
+                        "files": {
+                            filename: {
                                 "status": "in_progress",
-                                "downloaded": downloaded,
-                                "total_files": total,
-                                "progress": (downloaded / total * 100) if total > 0 else 0
+                                "progress": 0
                             }
+                        },
+                        "overall": {
+                            "status": "in_progress",
+                            "downloaded": downloaded,
+                            "total_files": total,
+                            "progress": (downloaded / total * 100) if total > 0 else 0
                         }
-                        await progress_callback(ws_message)
+                    }
+                    await progress_callback(ws_message)
 
-                    # Start download
-                    future = executor.submit(
-                        download_url,
-                        media_url,
-                        media_output,
-                        self.sleep_interval,
-                        file_progress_callback
-                    )
-                    futures.append((future, filename))
-
-                # Process completed downloads
-                for future, filename in futures:
-                    try:
-                        result = future.result()
-                        if result:
-                            downloaded += 1
-                            logger.info(f"[Download] Completed {result} ({downloaded}/{total})")
-                            self._update_media_metadata(username, "stories", result, "complete", 100)
-                            
-                            # Send completion update
-                            if progress_callback:
-                                ws_message = {
-                                    "files": {
-                                        result: {
-                                            "status": "complete",
-                                            "progress": 100
-                                        }
-                                    },
-                                    "overall": {
-                                        "status": "complete" if downloaded == total else "in_progress",
-                                        "downloaded": downloaded,
-                                        "total_files": total,
-                                        "progress": (downloaded / total * 100) if total > 0 else 0
-                                    }
-                                }
-                                await progress_callback(ws_message)
-                    except Exception as e:
-                        logger.error(f"[Download] Error downloading {filename}: {e}")
-                        self._update_media_metadata(username, "stories", filename, "error", 0)
-                        if progress_callback:
-                            ws_message = {
-                                "files": {
-                                    filename: {
-                                        "status": "error",
-                                        "progress": 0,
-                                        "error": str(e)
-                                    }
-                                },
-                                "overall": {
-                                    "status": "error",
-                                    "downloaded": downloaded,
-                                    "total_files": total,
-                                    "progress": (downloaded / total * 100) if total > 0 else 0
-                                }
-                            }
-                            await progress_callback(ws_message)
+                # Start download
+                future = self._start_download(
+                    username, "stories", filename, media_url, media_output, file_progress_callback
+                )
+                futures.append((future, filename))
+
+            # Process completed downloads
+            downloaded = await self._collect_downloads(
+                username, "stories", futures, total, downloaded, progress_callback
+            )
 
             if not self.quiet:
                 logger.info(f"[✓] {downloaded} stories downloaded for {username}")
@@ -470,19 +721,20 @@ class SnapchatDL:
                 await progress_callback(ws_message)
             raise
 
-    async def download_highlights(self, username, progress_callback=None):
+    async def download_highlights(self, username, progress_callback=None, snapshot=None):
+        total = 0
+        downloaded = 0
         try:
-            _, _, curated_highlights, _ = await self._web_fetch_story(username)
-            media_list = curated_highlights
+            if snapshot is None:
+                snapshot = await self.fetch_profile(username)
+            media_list = snapshot.highlight_snaps
             total = len(media_list)
-            downloaded = 0
             dir_name = os.path.join(self.directory_prefix, username, "highlights")
             os.makedirs(dir_name, exist_ok=True)
             logger.info(f"[Download] Output directory: {dir_name}")
 
             # Load existing metadata (don't clear it - preserve previous downloads)
-            existing_metadata = self._load_media_metadata(username, "highlights")
-            existing_filenames = {item.get("filename") for item in existing_metadata}
+            existing_filenames = self.media_index.filenames(username, "highlights")
             
             # Send initial state
             if progress_callback:
@@ -499,118 +751,70 @@ class SnapchatDL:
 
             # Process and download files
             media_urls = []  # Track URLs for return value
-            with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-                futures = []
-                for media in media_list:
-                    media_url = media.get("snapUrls", {}).get("mediaUrl")
-                    if not media_url:
-                        continue
-                    media_urls.append(media_url)  # Collect URL
-                    snap_id = media_url.split("/")[-1].split(".")[0]
-                    timestamp = int(os.path.getmtime(dir_name)) if os.path.exists(dir_name) else int(asyncio.get_event_loop().time())
-                    extension = "mp4" if "video" in media_url.lower() else "jpg"
-                    filename = strf_time(timestamp, "%Y-%m-%d_%H-%M-%S_{}_{}.{}").format(
-                        snap_id, username, extension
-                    )
-                    
-                    # Skip if already exists in metadata (avoid duplicates)
-                    if filename in existing_filenames:
-                        logger.info(f"[Download] Skipping duplicate: {filename}")
-                        continue
-                    
-                    thumbnail_url = media.get("snapUrls", {}).get("mediaPreviewUrl") or media_url
-                    
-                    # Add to metadata immediately
-                    metadata = self._load_media_metadata(username, "highlights")
-                    new_item = {
-                        "filename": filename,
-                        "type": "video" if extension == "mp4" else "image",
-                        "thumbnail_url": thumbnail_url,
-                        "download_status": "not_started",
-                        "progress": 0,
-                        "download_url": f"/downloads/{username}/highlights/{filename}"
+            futures = []
+            for media in media_list:
+                media_url = media.get("snapUrls", {}).get("mediaUrl")
+                if not media_url:
+                    continue
+                media_urls.append(media_url)  # Collect URL
+                snap_id = media_url.split("/")[-1].split(".")[0]
+                timestamp = int(os.path.getmtime(dir_name)) if os.path.exists(dir_name) else int(asyncio.get_event_loop().time())
+                extension = "mp4" if "video" in media_url.lower() else "jpg"
+                filename = strf_time(timestamp, "%Y-%m-%d_%H-%M-%S_{}_{}.{}").format(
+                    snap_id, username, extension
+                )
+                
+                # Skip if already exists in metadata (avoid duplicates)
+                if filename in existing_filenames:
+                    logger.info(f"[Download] Skipping duplicate: {filename}")
+                    continue
+                
+                thumbnail_url = media.get("snapUrls", {}).get("mediaPreviewUrl") or media_url
+                
+                # Add to metadata immediately
+                new_item = {
+                    "filename": filename,
+                    "type": "video" if extension == "mp4" else "image",
+                    "thumbnail_url": thumbnail_url,
+                    "download_status": "not_started",
+                    "progress": 0,
+                    "download_url": f"/downloads/{username}/highlights/{filename}",
+                    "source_url": media_url
+                }
+                self.media_index.add(username, "highlights", new_item)
+                existing_filenames.add(filename)  # Track to avoid duplicates in same session
+                
+                # Send metadata update
+                if progress_callback:
+                    metadata_message = {
+                        "type": "metadata_update",
+                        "items": [new_item]  # Send only the new item
                     }
-                    metadata.append(new_item)
-                    existing_filenames.add(filename)  # Track to avoid duplicates in same session
-                    self._save_media_metadata(username, "highlights", metadata)
-                    
-                    # Send metadata update
-                    if progress_callback:
-                        metadata_message = {
-                            "type": "metadata_update",
-                            "items": [metadata[-1]]  # Send only the new item
-                        }
-                        await progress_callback(metadata_message)
-
-                    media_output = os.path.join(dir_name, filename)
-                    logger.info(f"[Download] Starting download for {filename} to {media_output}")
-
-                    # Create progress callback
-                    file_progress_callback = self._create_progress_callback(
-                        username, "highlights", filename, total, downloaded, progress_callback
-                    )
-
-                    # Start download
-                    future = executor.submit(
-                        download_url,
-                        media_url,
-                        media_output,
-                        self.sleep_interval,
-                        file_progress_callback
-                    )
-                    futures.append((future, filename))
-
-                    if self.dump_json:
-                        media_json = {"url": media_url, "username": username, "type": "highlights"}
-                        filename_json = os.path.join(dir_name, filename + ".json")
-                        dump_response(media_json, filename_json)
-
-                # Process completed downloads
-                for future, filename in futures:
-                    try:
-                        result = future.result()
-                        if result:
-                            downloaded += 1
-                            logger.info(f"[Download] Completed {result} ({downloaded}/{total})")
-                            self._update_media_metadata(username, "highlights", result, "complete", 100)
-                            
-                            # Send completion update
-                            if progress_callback:
-                                ws_message = {
-                                    "files": {
-                                        result: {
-                                            "status": "complete",
-                                            "progress": 100
-                                        }
-                                    },
-                                    "overall": {
-                                        "status": "complete" if downloaded == total else "in_progress",
-                                        "downloaded": downloaded,
-                                        "total_files": total,
-                                        "progress": (downloaded / total * 100) if total > 0 else 0
-                                    }
-                                }
-                                await progress_callback(ws_message)
-                    except Exception as e:
-                        logger.error(f"[Download] Error downloading {filename}: {e}")
-                        self._update_media_metadata(username, "highlights", filename, "error", 0)
-                        if progress_callback:
-                            ws_message = {
-                                "files": {
-                                    filename: {
-                                        "status": "error",
-                                        "progress": 0,
-                                        "error": str(e)
-                                    }
-                                },
-                                "overall": {
-                                    "status": "error",
-                                    "downloaded": downloaded,
-                                    "total_files": total,
-                                    "progress": (downloaded / total * 100) if total > 0 else 0
-                                }
-                            }
-                            await progress_callback(ws_message)
+                    await progress_callback(metadata_message)
+
+                media_output = os.path.join(dir_name, filename)
+                logger.info(f"[Download] Starting download for {filename} to {media_output}")
+
+                # Create progress callback
+                file_progress_callback = self._create_progress_callback(
+                    username, "highlights", filename, total, downloaded, progress_callback
+                )
+
+                # Start download
+                future = self._start_download(
+                    username, "highlights", filename, media_url, media_output, file_progress_callback
+                )
+                futures.append((future, filename))
+
+                if self.dump_json:
+                    media_json = {"url": media_url, "username": username, "type": "highlights"}
+                    filename_json = os.path.join(dir_name, filename + ".json")
+                    dump_response(media_json, filename_json)
+
+            # Process completed downloads
+            downloaded = await self._collect_downloads(
+                username, "highlights", futures, total, downloaded, progress_callback
+            )
 
             if not self.quiet:
                 logger.info(f"[✓] {downloaded} highlights downloaded for {username}")
@@ -633,19 +837,20 @@ class SnapchatDL:
                 await progress_callback(ws_message)
             raise
 
-    async def download_spotlights(self, username, progress_callback=None):
+    async def download_spotlights(self, username, progress_callback=None, snapshot=None):
+        total = 0
+        downloaded = 0
         try:
-            _, _, _, spot_highlights = await self._web_fetch_story(username)
-            media_list = spot_highlights
+            if snapshot is None:
+                snapshot = await self.fetch_profile(username)
+            media_list = snapshot.spotlight_snaps
             total = len(media_list)
-            downloaded = 0
             dir_name = os.path.join(self.directory_prefix, username, "spotlights")
             os.makedirs(dir_name, exist_ok=True)
             logger.info(f"[Download] Output directory: {dir_name}")
 
             # Load existing metadata (don't clear it - preserve previous downloads)
-            existing_metadata = self._load_media_metadata(username, "spotlights")
-            existing_filenames = {item.get("filename") for item in existing_metadata}
+            existing_filenames = self.media_index.filenames(username, "spotlights")
             
             # Send initial state
             if progress_callback:
@@ -662,118 +867,70 @@ class SnapchatDL:
 
             # Process and download files
             media_urls = []  # Track URLs for return value
-            with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-                futures = []
-                for media in media_list:
-                    media_url = media.get("snapUrls", {}).get("mediaUrl")
-                    if not media_url:
-                        continue
-                    media_urls.append(media_url)  # Collect URL
-                    snap_id = media_url.split("/")[-1].split(".")[0]
-                    timestamp = int(os.path.getmtime(dir_name)) if os.path.exists(dir_name) else int(asyncio.get_event_loop().time())
-                    extension = "mp4" if "video" in media_url.lower() else "jpg"
-                    filename = strf_time(timestamp, "%Y-%m-%d_%H-%M-%S_{}_{}.{}").format(
-                        snap_id, username, extension
-                    )
-                    
-                    # Skip if already exists in metadata (avoid duplicates)
-                    if filename in existing_filenames:
-                        logger.info(f"[Download] Skipping duplicate: {filename}")
-                        continue
-                    
-                    thumbnail_url = media.get("snapUrls", {}).get("mediaPreviewUrl") or media_url
-                    
-                    # Add to metadata immediately
-                    metadata = self._load_media_metadata(username, "spotlights")
-                    new_item = {
-                        "filename": filename,
-                        "type": "video" if extension == "mp4" else "image",
-                        "thumbnail_url": thumbnail_url,
-                        "download_status": "not_started",
-                        "progress": 0,
-                        "download_url": f"/downloads/{username}/spotlights/{filename}"
+            futures = []
+            for media in media_list:
+                media_url = media.get("snapUrls", {}).get("mediaUrl")
+                if not media_url:
+                    continue
+                media_urls.append(media_url)  # Collect URL
+                snap_id = media_url.split("/")[-1].split(".")[0]
+                timestamp = int(os.path.getmtime(dir_name)) if os.path.exists(dir_name) else int(asyncio.get_event_loop().time())
+                extension = "mp4" if "video" in media_url.lower() else "jpg"
+                filename = strf_time(timestamp, "%Y-%m-%d_%H-%M-%S_{}_{}.{}").format(
+                    snap_id, username, extension
+                )
+                
+                # Skip if already exists in metadata (avoid duplicates)
+                if filename in existing_filenames:
+                    logger.info(f"[Download] Skipping duplicate: {filename}")
+                    continue
+                
+                thumbnail_url = media.get("snapUrls", {}).get("mediaPreviewUrl") or media_url
+                
+                # Add to metadata immediately
+                new_item = {
+                    "filename": filename,
+                    "type": "video" if extension == "mp4" else "image",
+                    "thumbnail_url": thumbnail_url,
+                    "download_status": "not_started",
+                    "progress": 0,
+                    "download_url": f"/downloads/{username}/spotlights/{filename}",
+                    "source_url": media_url
+                }
+                self.media_index.add(username, "spotlights", new_item)
+                existing_filenames.add(filename)  # Track to avoid duplicates in same session
+                
+                # Send metadata update
+                if progress_callback:
+                    metadata_message = {
+                        "type": "metadata_update",
+                        "items": [new_item]  # Send only the new item
                     }
-                    metadata.append(new_item)
-                    existing_filenames.add(filename)  # Track to avoid duplicates in same session
-                    self._save_media_metadata(username, "spotlights", metadata)
-                    
-                    # Send metadata update
-                    if progress_callback:
-                        metadata_message = {
-                            "type": "metadata_update",
-                            "items": [metadata[-1]]  # Send only the new item
-                        }
-                        await progress_callback(metadata_message)
-
-                    media_output = os.path.join(dir_name, filename)
-                    logger.info(f"[Download] Starting download for {filename} to {media_output}")
-
-                    # Create progress callback
-                    file_progress_callback = self._create_progress_callback(
-                        username, "spotlights", filename, total, downloaded, progress_callback
-                    )
-
-                    # Start download
-                    future = executor.submit(
-                        download_url,
-                        media_url,
-                        media_output,
-                        self.sleep_interval,
-                        file_progress_callback
-                    )
-                    futures.append((future, filename))
-
-                    if self.dump_json:
-                        media_json = {"url": media_url, "username": username, "type": "spotlights"}
-                        filename_json = os.path.join(dir_name, filename + ".json")
-                        dump_response(media_json, filename_json)
-
-                # Process completed downloads
-                for future, filename in futures:
-                    try:
-                        result = future.result()
-                        if result:
-                            downloaded += 1
-                            logger.info(f"[Download] Completed {result} ({downloaded}/{total})")
-                            self._update_media_metadata(username, "spotlights", result, "complete", 100)
-                            
-                            # Send completion update
-                            if progress_callback:
-                                ws_message = {
-                                    "files": {
-                                        result: {
-                                            "status": "complete",
-                                            "progress": 100
-                                        }
-                                    },
-                                    "overall": {
-                                        "status": "complete" if downloaded == total else "in_progress",
-                                        "downloaded": downloaded,
-                                        "total_files": total,
-                                        "progress": (downloaded / total * 100) if total > 0 else 0
-                                    }
-                                }
-                                await progress_callback(ws_message)
-                    except Exception as e:
-                        logger.error(f"[Download] Error downloading {filename}: {e}")
-                        self._update_media_metadata(username, "spotlights", filename, "error", 0)
-                        if progress_callback:
-                            ws_message = {
-                                "files": {
-                                    filename: {
-                                        "status": "error",
-                                        "progress": 0,
-                                        "error": str(e)
-                                    }
-                                },
-                                "overall": {
-                                    "status": "error",
-                                    "downloaded": downloaded,
-                                    "total_files": total,
-                                    "progress": (downloaded / total * 100) if total > 0 else 0
-                                }
-                            }
-                            await progress_callback(ws_message)
+                    await progress_callback(metadata_message)
+
+                media_output = os.path.join(dir_name, filename)
+                logger.info(f"[Download] Starting download for {filename} to {media_output}")
+
+                # Create progress callback
+                file_progress_callback = self._create_progress_callback(
+                    username, "spotlights", filename, total, downloaded, progress_callback
+                )
+
+                # Start download
+                future = self._start_download(
+                    username, "spotlights", filename, media_url, media_output, file_progress_callback
+                )
+                futures.append((future, filename))
+
+                if self.dump_json:
+                    media_json = {"url": media_url, "username": username, "type": "spotlights"}
+                    filename_json = os.path.join(dir_name, filename + ".json")
+                    dump_response(media_json, filename_json)
+
+            # Process completed downloads
+            downloaded = await self._collect_downloads(
+                username, "spotlights", futures, total, downloaded, progress_callback
+            )
 
             if not self.quiet:
                 logger.info(f"[✓] {downloaded} spotlights downloaded for {username}")
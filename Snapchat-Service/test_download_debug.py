@@ -3,13 +3,15 @@ import os
 import sys
 from loguru import logger
 
-# Add the snapchat_dl directory to the path
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'snapchat_dl'))
+import aiohttp
 
-from downloader import download_url
+# Add the project directory to the path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-def test_download_url():
-    """Test the download_url function to see what it returns"""
+from snapchat_dl.downloader import download_url_async
+
+async def test_download_url():
+    """Test the download_url_async function to see what it returns"""
     
     # Test with a valid URL
     test_url = "https://bolt-gcdn.sc-cdn.net/3/bsoMy860iVH5ArYNuieVb.1034.IRZXSOY?mo=GlQaFDIBfToBBEIGCPjTj8UGSAJQS2ABogE3CIoIEiUKIwiTkC8gATDgAzjUBkABSg4KCT4kLSUiGx8hIhD0A1DyTWgCIgsSACoHSVJaWFNPWZAD8k0%3D&uc=75"
@@ -19,7 +21,8 @@ def test_download_url():
     logger.info(f"🔍 Output file: {test_output}")
     
     try:
-        result = download_url(test_url, test_output, 0.1)
+        async with aiohttp.ClientSession() as session:
+            result = await download_url_async(session, test_url, test_output, 0.1)
         logger.info(f"✅ download_url returned: {result}")
         logger.info(f"✅ Return type: {type(result)}")
         logger.info(f"✅ File exists: {os.path.exists(test_output)}")
@@ -37,4 +40,4 @@ def test_download_url():
         logger.error(f"❌ Exception type: {type(e)}")
 
 if __name__ == "__main__":
-    test_download_url()
+    asyncio.run(test_download_url())
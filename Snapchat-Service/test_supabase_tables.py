@@ -36,7 +36,7 @@ async def test_supabase_tables():
     try:
         # Test snapchat_recent_stories_cache table
         logger.info("Testing snapchat_recent_stories_cache table...")
-        response = supabase_manager.client.table("snapchat_recent_stories_cache").select("*").limit(1).execute()
+        response = await supabase_manager.client.table("snapchat_recent_stories_cache").select("*").limit(1).execute()
         logger.info("✅ snapchat_recent_stories_cache table exists")
     except Exception as e:
         logger.error(f"❌ snapchat_recent_stories_cache table does not exist: {e}")
@@ -45,7 +45,7 @@ async def test_supabase_tables():
     try:
         # Test snapchat_processed_stories table
         logger.info("Testing snapchat_processed_stories table...")
-        response = supabase_manager.client.table("snapchat_processed_stories").select("*").limit(1).execute()
+        response = await supabase_manager.client.table("snapchat_processed_stories").select("*").limit(1).execute()
         logger.info("✅ snapchat_processed_stories table exists")
     except Exception as e:
         logger.error(f"❌ snapchat_processed_stories table does not exist: {e}")
@@ -54,7 +54,7 @@ async def test_supabase_tables():
     try:
         # Test snapchat_cache_cleanup_log table
         logger.info("Testing snapchat_cache_cleanup_log table...")
-        response = supabase_manager.client.table("snapchat_cache_cleanup_log").select("*").limit(1).execute()
+        response = await supabase_manager.client.table("snapchat_cache_cleanup_log").select("*").limit(1).execute()
         logger.info("✅ snapchat_cache_cleanup_log table exists")
     except Exception as e:
         logger.error(f"❌ snapchat_cache_cleanup_log table does not exist: {e}")
@@ -113,7 +113,7 @@ async def test_supabase_tables():
     
     # Test cache statistics
     logger.info("Testing cache statistics...")
-    stats = supabase_manager.get_snapchat_cache_stats()
+    stats = await supabase_manager.get_snapchat_cache_stats()
     logger.info(f"✅ Cache stats: {stats}")
     
     # Clean up test data
@@ -0,0 +1,168 @@
+import asyncio
+import json
+
+import pytest
+from aiohttp import web
+
+
+def _unquote(text):
+    if len(text) >= 2 and text[0] == text[-1] == '"':
+        return text[1:-1].replace('\\"', '"').replace("\\\\", "\\")
+    return text
+
+
+def _split_list(text):
+    """Values of an ``in.(a,"b,c")`` list"""
+    values, current, quoted, escaped = [], "", False, False
+    for char in text:
+        if escaped:
+            current += char
+            escaped = False
+        elif char == "\\" and quoted:
+            current += char
+            escaped = True
+        elif char == '"':
+            current += char
+            quoted = not quoted
+        elif char == "," and not quoted:
+            values.append(_unquote(current))
+            current = ""
+        else:
+            current += char
+    if current:
+        values.append(_unquote(current))
+    return values
+
+
+def _matches(row, column, condition):
+    operator, _, value = condition.partition(".")
+    cell = row.get(column)
+    if operator == "eq":
+        return cell is not None and str(cell) == value
+    if operator == "neq":
+        return cell is not None and str(cell) != value
+    if operator == "is":
+        return cell is None if value == "null" else str(cell).lower() == value
+    if operator == "in":
+        return cell is not None and str(cell) in _split_list(value[1:-1])
+    if operator in ("lt", "gt"):
+        if cell is None:
+            return False
+        return str(cell) < value if operator == "lt" else str(cell) > value
+    raise AssertionError(f"unsupported filter {column}={condition}")
+
+
+class FakePostgrest:
+    """An in-memory PostgREST: tables of dict rows, unique keys and scriptable failures.
+
+    Unique keys follow Postgres: a row with NULL in a key column never
+    conflicts. ``fail`` holds statuses to answer the next requests with
+    (None answers normally); ``stall`` makes that many requests hang for
+    ``stall_seconds`` (longer than the client timeout) and change nothing.
+    """
+
+    def __init__(self, unique=None):
+        self.tables = {}
+        self.unique = dict(unique or {})
+        self.requests = []
+        self.fail = []
+        self.stall = 0
+        self.stall_seconds = 0.3
+
+    def rows(self, table):
+        return self.tables.setdefault(table, [])
+
+    def _conflict(self, table, row, columns):
+        if any(row.get(column) is None for column in columns):
+            return None
+        for existing in self.rows(table):
+            if all(existing.get(column) == row.get(column) for column in columns):
+                return existing
+        return None
+
+    def _insert(self, table, rows, on_conflict, merge):
+        keys = [on_conflict] if on_conflict else list(self.unique.get(table, ()))
+        for row in rows:
+            for columns in keys:
+                existing = self._conflict(table, row, columns)
+                if existing is None:
+                    continue
+                if not merge:
+                    return web.json_response(
+                        {"code": "23505", "message": "duplicate key value violates unique constraint"}, status=409,
+                    )
+                existing.update(row)
+                break
+            else:
+                self.rows(table).append(dict(row))
+        return None
+
+    async def handle(self, request):
+        table = request.match_info["table"]
+        body = await request.text()
+        self.requests.append((request.method, table, list(request.query.items()), body))
+        if self.stall:
+            self.stall -= 1
+            await asyncio.sleep(self.stall_seconds)
+            return web.Response(status=503)
+        status = self.fail.pop(0) if self.fail else None
+        if status is not None:
+            return web.json_response({"message": "try again"}, status=status)
+
+        prefer = request.headers.get("Prefer", "")
+        params = [(key, value) for key, value in request.query.items()
+                  if key not in ("select", "limit", "offset", "order", "on_conflict")]
+        if request.method == "POST":
+            rows = json.loads(body)
+            rows = rows if isinstance(rows, list) else [rows]
+            on_conflict = request.query.get("on_conflict")
+            error = self._insert(
+                table, rows, tuple(on_conflict.split(",")) if on_conflict else None,
+                "resolution=merge-duplicates" in prefer,
+            )
+            if error is not None:
+                return error
+            return web.Response(status=201)
+
+        selected = [row for row in self.rows(table) if all(_matches(row, key, value) for key, value in params)]
+        if request.method == "DELETE":
+            self.tables[table] = [row for row in self.rows(table) if row not in selected]
+            return web.Response(status=204)
+
+        total = len(selected)
+        offset = int(request.query.get("offset", 0))
+        limit = request.query.get("limit")
+        page = selected[offset:offset + int(limit)] if limit else selected[offset:]
+        headers = {}
+        if "count=exact" in prefer:
+            last = f"{offset}-{offset + len(page) - 1}" if page else "*"
+            headers["Content-Range"] = f"{last}/{total}"
+        if request.method == "HEAD":
+            return web.Response(headers=headers)
+        return web.json_response(page, headers=headers)
+
+    def run(self, scenario):
+        """Run ``scenario(url)`` on a fresh event loop with the server listening at ``url``."""
+
+        async def main():
+            app = web.Application()
+            app.router.add_route("*", "/rest/v1/{table:.+}", self.handle)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]
+            try:
+                return await scenario(f"http://127.0.0.1:{port}")
+            finally:
+                await runner.cleanup()
+
+        return asyncio.run(main())
+
+
+@pytest.fixture
+def postgrest():
+    return FakePostgrest(unique={
+        "snapchat_recent_stories_cache": [("username", "snap_id")],
+        "snapchat_processed_stories": [("id",)],
+    })
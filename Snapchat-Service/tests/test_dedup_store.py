@@ -0,0 +1,157 @@
+import asyncio
+
+import pytest
+
+from server.dedup_store import DedupStore
+
+
+class FakeSupabase:
+    """The slice of SnapchatSupabaseManager DedupStore syncs through."""
+
+    def __init__(self, remote=None):
+        self.is_connected = True
+        self.remote = list(remote or [])
+        self.processed = {}
+        self.caches = {}
+        self.cleared = []
+        self.fail_processed = False
+        self.fail_cache = False
+        self.fail_clear = False
+
+    async def get_processed_stories(self):
+        return list(self.remote) if self.is_connected else None
+
+    async def mark_stories_processed(self, username, stories):
+        if self.fail_processed:
+            return 0
+        for story in stories:
+            self.processed[(username, story["snap_id"])] = story
+        return len(stories)
+
+    async def update_recent_stories_cache(self, username, stories):
+        if self.fail_cache:
+            return False
+        self.caches[username] = [story["snap_id"] for story in stories]
+        return True
+
+    async def clear_user_cache(self, username):
+        if self.fail_clear:
+            return None
+        self.cleared.append(("cache", username))
+        return len(self.caches.pop(username, ()))
+
+    async def clear_user_processed_stories(self, username):
+        if self.fail_clear:
+            return None
+        self.cleared.append(("processed", username))
+        kept = [row for row in self.remote if row["username"] != username]
+        deleted, self.remote = len(self.remote) - len(kept), kept
+        return deleted
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = DedupStore(str(tmp_path / "state" / "dedup.db"))
+    yield store
+    store.close()
+
+
+def story(snap_id):
+    return {"snap_id": snap_id, "url": f"https://cdn.example/{snap_id}", "type": "photo"}
+
+
+def test_local_state_survives_a_restart(store):
+    assert store.mark_processed("s1", "alice", "https://cdn.example/s1", "photo")
+    assert not store.mark_processed("s1", "alice", "https://cdn.example/s1", "photo")
+    assert store.mark_many("alice", [story("s1"), story("s2"), story("s2"), {"url": "no-id"}]) == 1
+    store.set_recent_stories("alice", [story("s2"), story("s1")])
+    store.close()
+
+    reopened = DedupStore(store.path)
+    try:
+        assert reopened.is_processed("s2", "alice")
+        assert [row["snap_id"] for row in reopened.recent_stories("alice")] == ["s2", "s1"]
+        stats = reopened.stats()
+        assert stats["pending_processed"] == 2
+        assert stats["pending_caches"] == 1
+    finally:
+        reopened.close()
+
+
+def test_sync_pushes_backlog_and_keeps_it_on_failure(store):
+    supabase = FakeSupabase(remote=[{"username": "bob", "snap_id": "r1"}])
+    store.mark_many("alice", [story("s1"), story("s2")])
+    store.set_recent_stories("alice", [story("s1")])
+
+    supabase.fail_processed = True
+    assert not asyncio.run(store.sync(supabase))
+    assert store.stats()["pending_processed"] == 2
+    assert store.is_processed("r1", "bob")  # seeded from Supabase on the first pass
+
+    supabase.fail_processed = False
+    supabase.fail_cache = True
+    assert not asyncio.run(store.sync(supabase))
+    assert store.stats()["pending_processed"] == 0
+    assert store.stats()["pending_caches"] == 1
+
+    supabase.fail_cache = False
+    assert asyncio.run(store.sync(supabase))
+    assert set(supabase.processed) == {("alice", "s1"), ("alice", "s2")}
+    assert supabase.caches == {"alice": ["s1"]}
+    assert not store.has_backlog
+
+    # An idle poll with the same stories writes nothing
+    store.set_recent_stories("alice", [story("s1")])
+    assert not store.has_backlog
+
+
+def test_offline_sync_does_nothing(store):
+    supabase = FakeSupabase()
+    supabase.is_connected = False
+    store.mark_processed("s1", "alice", None, "photo")
+    assert not asyncio.run(store.sync(supabase))
+    assert store.stats()["pending_processed"] == 1
+
+
+def test_pending_clear_reaches_supabase_before_seeding(store):
+    supabase = FakeSupabase(remote=[{"username": "alice", "snap_id": "old"}])
+    store.mark_processed("s1", "alice", None, "photo")
+    store.set_recent_stories("alice", [story("s1")])
+    result = store.clear_user("alice", pending=True)
+
+    assert result == {"processed_deleted": 1, "cache_deleted": 1}
+    assert store.has_backlog
+    assert asyncio.run(store.sync(supabase))
+    assert supabase.cleared == [("cache", "alice"), ("processed", "alice")]
+    assert not store.is_processed("s1", "alice")
+    assert not store.is_processed("old", "alice")
+    assert not store.has_recent("alice")
+
+
+def test_failed_clear_while_connected_is_retried_before_seeding(store):
+    supabase = FakeSupabase(remote=[{"username": "alice", "snap_id": "old"}])
+    supabase.fail_clear = True
+    store.clear_user("alice", pending=True)
+
+    # Supabase is reachable but the delete fails: the clear stays queued
+    assert asyncio.run(store.push_clear(supabase, "alice")) is None
+    assert store.has_backlog
+    assert not asyncio.run(store.sync(supabase))
+    assert not store.is_processed("old", "alice")  # not seeded back
+
+    supabase.fail_clear = False
+    assert asyncio.run(store.sync(supabase))
+    assert supabase.cleared == [("cache", "alice"), ("processed", "alice")]
+    assert not store.is_processed("old", "alice")
+    assert not store.has_backlog
+
+
+def test_partial_push_keeps_the_rest_of_the_queued_clear(store):
+    supabase = FakeSupabase(remote=[{"username": "alice", "snap_id": "old"}])
+    store.clear_user("alice", pending=True)
+
+    assert asyncio.run(store.push_clear(supabase, "alice", processed=False)) == {"processed_deleted": 0, "cache_deleted": 0}
+    assert store.has_backlog
+    assert asyncio.run(store.sync(supabase))
+    assert supabase.cleared == [("cache", "alice"), ("processed", "alice")]
+    assert not store.has_backlog
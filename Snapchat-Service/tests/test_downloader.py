@@ -0,0 +1,225 @@
+import asyncio
+import os
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from snapchat_dl import downloader
+from snapchat_dl.downloader import ChunkBatch, DownloadError, ProgressThrottle, download_url_async, part_path
+
+BODY = bytes(range(256)) * 4096  # 1 MB
+ETAG = '"v1"'
+
+
+class MediaServer:
+    """Serves BODY with Range support and scriptable misbehaviour."""
+
+    def __init__(self):
+        self.requests = []
+        self.cut_after = None      # bytes to send before dropping the connection
+        self.ignore_range = False
+        self.wrong_start = False
+        self.stall = None          # asyncio.Event the body waits on after the first chunk
+
+    async def handle(self, request):
+        self.requests.append(dict(request.headers))
+        start = 0
+        range_header = request.headers.get("Range")
+        if range_header and not self.ignore_range:
+            start = int(range_header.split("=")[1].rstrip("-"))
+            if self.wrong_start:
+                start = max(0, start - 10)
+        status = 206 if start or (range_header and not self.ignore_range) else 200
+        response = web.StreamResponse(status=status, headers={"ETag": ETAG})
+        response.content_length = len(BODY) - start
+        if status == 206:
+            response.headers["Content-Range"] = f"bytes {start}-{len(BODY) - 1}/{len(BODY)}"
+        await response.prepare(request)
+        body = BODY[start:]
+        if self.cut_after is not None:
+            cut, self.cut_after = self.cut_after, None
+            await response.write(body[:cut])
+            # Let the client read what was sent before the connection drops
+            await asyncio.sleep(0.2)
+            request.transport.close()
+            return response
+        if self.stall is not None:
+            await response.write(body[:64 * 1024])
+            await self.stall.wait()
+        await response.write(body)
+        return response
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(downloader, "backoff_delay", lambda attempt: 0)
+
+
+def run(server, scenario):
+    async def main():
+        app = web.Application()
+        app.router.add_get("/media.mp4", server.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            async with aiohttp.ClientSession() as session:
+                return await scenario(session, f"http://127.0.0.1:{port}/media.mp4")
+        finally:
+            await runner.cleanup()
+
+    return asyncio.run(main())
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_plain_download_is_renamed_into_place(tmp_path):
+    output = str(tmp_path / "a" / "media.mp4")
+    server = MediaServer()
+    result = run(server, lambda session, url: download_url_async(session, url, output))
+
+    assert result == "media.mp4"
+    assert read(output) == BODY
+    assert not os.path.exists(part_path(output))
+    assert "Range" not in server.requests[0]
+
+
+def test_dropped_connection_resumes_with_range(tmp_path):
+    output = str(tmp_path / "media.mp4")
+    server = MediaServer()
+    server.cut_after = 300_000
+    run(server, lambda session, url: download_url_async(session, url, output))
+
+    assert read(output) == BODY
+    assert len(server.requests) == 2
+    offset = int(server.requests[1]["Range"].split("=")[1].rstrip("-"))
+    assert 0 < offset <= 300_000
+    assert server.requests[1]["If-Range"] == ETAG
+
+
+def test_existing_part_file_is_resumed(tmp_path):
+    output = str(tmp_path / "media.mp4")
+    with open(part_path(output), "wb") as f:
+        f.write(BODY[:123_456])
+    server = MediaServer()
+    run(server, lambda session, url: download_url_async(session, url, output))
+
+    assert read(output) == BODY
+    assert server.requests[0]["Range"] == "bytes=123456-"
+
+
+def test_ignored_range_restarts_from_zero(tmp_path):
+    output = str(tmp_path / "media.mp4")
+    with open(part_path(output), "wb") as f:
+        f.write(b"stale bytes")
+    server = MediaServer()
+    server.ignore_range = True
+    run(server, lambda session, url: download_url_async(session, url, output))
+
+    assert read(output) == BODY
+
+
+def test_wrong_resume_offset_discards_part_and_retries(tmp_path):
+    output = str(tmp_path / "media.mp4")
+    with open(part_path(output), "wb") as f:
+        f.write(BODY[:50_000])
+    server = MediaServer()
+    server.wrong_start = True
+
+    async def scenario(session, url):
+        async def fix_server_after_first_request():
+            while not server.requests:
+                await asyncio.sleep(0.01)
+            server.wrong_start = False
+        fixer = asyncio.ensure_future(fix_server_after_first_request())
+        await download_url_async(session, url, output)
+        await fixer
+
+    run(server, scenario)
+    assert read(output) == BODY
+    assert "Range" not in server.requests[-1]
+
+
+def test_exhausted_retries_keep_the_part_file(tmp_path):
+    output = str(tmp_path / "media.mp4")
+    server = MediaServer()
+
+    async def scenario(session, url):
+        server.cut_after = 100_000
+        with pytest.raises(DownloadError):
+            await download_url_async(session, url, output, max_retries=1)
+
+    run(server, scenario)
+    assert not os.path.exists(output)
+    assert os.path.getsize(part_path(output)) > 0
+
+
+def test_cancel_keeps_the_part_file_for_resume(tmp_path):
+    output = str(tmp_path / "media.mp4")
+    server = MediaServer()
+    server.stall = asyncio.Event()
+
+    async def scenario(session, url):
+        task = asyncio.ensure_future(download_url_async(session, url, output))
+        while not os.path.exists(part_path(output)) or not os.path.getsize(part_path(output)):
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        kept = os.path.getsize(part_path(output))
+        assert kept > 0
+
+        server.stall.set()
+        server.stall = None
+        await download_url_async(session, url, output)
+        return kept
+
+    kept = run(server, scenario)
+    assert read(output) == BODY
+    assert server.requests[-1]["Range"] == f"bytes={kept}-"
+
+
+def test_client_error_status_is_not_retried(tmp_path):
+    async def scenario(session, url):
+        with pytest.raises(DownloadError):
+            await download_url_async(session, url.replace("media.mp4", "missing.mp4"), str(tmp_path / "x.mp4"))
+
+    server = MediaServer()
+    run(server, scenario)
+    assert server.requests == []
+
+
+def test_chunk_batch_holds_chunks_by_reference_and_grows():
+    batch = ChunkBatch(min_size=4, max_size=16)
+    chunk = b"abcd"
+    batch.add(chunk)
+    assert batch.full
+    taken = batch.take()
+    assert taken[0] is chunk
+    assert (batch.size, batch.filled) == (8, 0)
+    for _ in range(10):
+        batch.add(chunk)
+        if batch.full:
+            batch.take()
+    assert batch.size == 16
+
+
+def test_progress_throttle_reports_by_bytes_and_time(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(downloader.time, "monotonic", lambda: now[0])
+    throttle = ProgressThrottle(total_size=1000, min_bytes=100, min_interval=1.0)
+
+    assert not throttle.due(50)          # too few bytes
+    assert not throttle.due(200)         # too soon
+    now[0] += 1.5
+    assert throttle.due(200)
+    assert not throttle.due(250)
+    assert throttle.due(1000)            # completion is always reported once
+    assert not throttle.due(1000)
+    assert ProgressThrottle(total_size=0).due(10) is False
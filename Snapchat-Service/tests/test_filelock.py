@@ -0,0 +1,155 @@
+import asyncio
+import gc
+import threading
+import time
+
+import portalocker
+import pytest
+
+from snapchat_dl.filelock import LockManager
+from snapchat_dl.filelock import LockTimeout
+
+
+@pytest.fixture
+def manager(tmp_path):
+    return LockManager(str(tmp_path / "locks"), stripes=1, timeout=0.3)
+
+
+def hold_elsewhere(lock_file):
+    """Lock ``lock_file`` through a separate open file, as another process would."""
+    handle = open(lock_file, "a")
+    portalocker.lock(handle, portalocker.LOCK_EX | portalocker.LOCK_NB)
+    return handle
+
+
+def can_lock_elsewhere(lock_file):
+    try:
+        handle = hold_elsewhere(lock_file)
+    except portalocker.exceptions.LockException:
+        return False
+    portalocker.unlock(handle)
+    handle.close()
+    return True
+
+
+def test_same_name_is_one_lock_and_reentrant(manager, tmp_path):
+    lock = manager.lock(str(tmp_path / "a.mp4"))
+    assert manager.lock(str(tmp_path / "sub" / ".." / "a.mp4")) is lock
+    with lock:
+        with lock:
+            assert lock.locked
+        assert lock.locked
+    assert not lock.locked
+
+
+def test_threads_exclude_each_other_on_one_name(manager, tmp_path):
+    lock = manager.lock(str(tmp_path / "a.mp4"))
+    inside = []
+    overlaps = []
+
+    def worker():
+        for _ in range(20):
+            with lock:
+                inside.append(1)
+                overlaps.append(len(inside))
+                time.sleep(0.001)
+                inside.pop()
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(overlaps) == 1
+
+
+def test_names_sharing_a_stripe_do_not_wait_in_process(manager, tmp_path):
+    first = manager.lock(str(tmp_path / "a.mp4"))
+    second = manager.lock(str(tmp_path / "b.mp4"))
+    assert first is not second
+    assert first.lock_file == second.lock_file
+
+    async def scenario():
+        async with first:
+            await second.acquire_async(timeout=0)
+            second.release()
+
+    asyncio.run(scenario())
+    assert manager.stats()["contended"] == 0
+
+
+def test_os_lock_is_held_until_the_last_holder_leaves(manager, tmp_path):
+    first = manager.lock(str(tmp_path / "a.mp4"))
+    second = manager.lock(str(tmp_path / "b.mp4"))
+    first.acquire()
+    second.acquire()
+    first.release()
+    assert not can_lock_elsewhere(first.lock_file)
+    second.release()
+    assert can_lock_elsewhere(first.lock_file)
+
+
+def test_other_process_holding_the_stripe_times_out(manager, tmp_path):
+    lock = manager.lock(str(tmp_path / "a.mp4"))
+    handle = hold_elsewhere(lock.lock_file)
+    try:
+        with pytest.raises(LockTimeout):
+            lock.acquire(timeout=0.1)
+        with pytest.raises(LockTimeout):
+            asyncio.run(lock.acquire_async(timeout=0.1))
+    finally:
+        portalocker.unlock(handle)
+        handle.close()
+    stats = manager.stats()
+    assert stats["contended"] == 2
+    assert stats["timeouts"] == 2
+    with lock:
+        assert manager.stats()["held"] == 1
+
+
+def test_waiter_gets_the_lock_once_it_is_released(manager, tmp_path):
+    lock = manager.lock(str(tmp_path / "a.mp4"))
+    order = []
+
+    async def holder():
+        async with lock:
+            order.append("holder")
+            await asyncio.sleep(0.1)
+
+    async def waiter():
+        await asyncio.sleep(0.01)
+        async with lock:
+            order.append("waiter")
+
+    async def scenario():
+        await asyncio.gather(holder(), waiter())
+
+    asyncio.run(scenario())
+    assert order == ["holder", "waiter"]
+
+
+def test_release_by_another_owner_is_refused(manager, tmp_path):
+    lock = manager.lock(str(tmp_path / "a.mp4"))
+    lock.acquire()
+    errors = []
+
+    def release():
+        try:
+            lock.release()
+        except RuntimeError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=release)
+    thread.start()
+    thread.join()
+    lock.release()
+    assert len(errors) == 1
+
+
+def test_unused_locks_are_dropped(manager, tmp_path):
+    for i in range(50):
+        with manager.lock(str(tmp_path / f"{i}.mp4")):
+            pass
+    gc.collect()
+    assert len(manager._locks) == 0
+    assert manager.stats()["acquisitions"] == 50
@@ -0,0 +1,189 @@
+import asyncio
+import os
+import random
+
+import pytest
+
+from server.gallery_index import GalleryIndex
+from server.gallery_index import InvalidCursor
+from server.gallery_index import SORT_ORDERS
+from server.gallery_index import capture_timestamp
+from server.gallery_index import parse_day
+from snapchat_dl.media_index import MediaIndex
+
+
+USERS = ("alice", "bob")
+
+
+def media_item(filename):
+    kind = "video" if filename.endswith(".mp4") else "image"
+    return {"filename": filename, "type": kind, "download_status": "complete", "progress": 100}
+
+
+def make_names(count, seed=7):
+    rng = random.Random(seed)
+    names = []
+    for i in range(count):
+        username = USERS[i % len(USERS)]
+        ext = "mp4" if rng.random() < 0.4 else "jpg"
+        # Several captures share a second, so ties fall back to the filename
+        day = 1 + rng.randrange(20)
+        second = rng.randrange(3)
+        names.append((username, f"2024-05-{day:02d}_12-00-{second:02d}_snap{i:03d}_{username}.{ext}"))
+    names.append(("alice", f"Undated_{count}.jpg"))
+    return names
+
+
+class Gallery:
+    """A downloads tree, its media index and the gallery index over them."""
+
+    def __init__(self, root):
+        self.downloads_dir = str(root / "downloads")
+        self.media_index = MediaIndex(os.path.join(self.downloads_dir, ".media_index.db"), flush_interval=60)
+        self.index = GalleryIndex(self.media_index, self.downloads_dir)
+        self.names = []
+
+    def add(self, username, filename):
+        folder = os.path.join(self.downloads_dir, username, "stories")
+        os.makedirs(folder, exist_ok=True)
+        open(os.path.join(folder, filename), "wb").close()
+        self.media_index.add(username, "stories", media_item(filename))
+        self.names.append((username, filename))
+
+    def remove(self, username, filename):
+        os.remove(os.path.join(self.downloads_dir, username, "stories", filename))
+        self.media_index.remove(username, "stories", [filename])
+
+
+@pytest.fixture
+def gallery(tmp_path):
+    gallery = Gallery(tmp_path)
+    for username, filename in make_names(120):
+        gallery.add(username, filename)
+    gallery.index.rebuild()
+    yield gallery
+    gallery.media_index.close()
+
+
+def expected(names, sort_by, username=None, type_filter=None, date_from=None, date_to=None, search=None):
+    column, descending = SORT_ORDERS[sort_by]
+    rows = []
+    for user, filename in names:
+        kind = media_item(filename)["type"]
+        timestamp = capture_timestamp(filename)
+        if username and user != username:
+            continue
+        if type_filter and kind != type_filter:
+            continue
+        if date_from and (timestamp < parse_day(date_from)):
+            continue
+        if date_to and (timestamp >= parse_day(date_to) + 86400):
+            continue
+        if search and search.lower() not in (filename + " " + user).lower():
+            continue
+        if column == "date":
+            key = (timestamp, filename, user)
+        elif column == "name":
+            key = (filename.lower(), filename, user)
+        else:
+            key = (kind != "video", filename, user)
+        rows.append((key, filename))
+    rows.sort(reverse=descending)
+    return [filename for _, filename in rows]
+
+
+def walk_cursor(gallery, limit, **query):
+    pages = []
+    cursor = None
+    while True:
+        entries, total, cursor = gallery.index.page("stories", limit=limit, cursor=cursor, **query)
+        assert len(entries) <= limit
+        pages.append([entry.filename for entry in entries])
+        if cursor is None:
+            return pages, total
+        assert len(entries) == limit
+
+
+QUERIES = [
+    {},
+    {"username": "bob"},
+    {"type_filter": "video"},
+    {"date_from": "2024-05-05", "date_to": "2024-05-12"},
+    {"username": "alice", "type_filter": "image", "date_from": "2024-05-10"},
+    {"search": "snap01"},
+    {"search": "_bob", "type_filter": "video"},
+    {"search": "p"},
+]
+
+
+@pytest.mark.parametrize("sort_by", sorted(SORT_ORDERS))
+@pytest.mark.parametrize("query", QUERIES)
+def test_cursor_pages_cover_every_match_once_in_order(gallery, sort_by, query):
+    want = expected(gallery.names, sort_by, **query)
+    pages, total = walk_cursor(gallery, limit=7, sort_by=sort_by, **query)
+    served = [filename for page in pages for filename in page]
+
+    assert served == want
+    assert total == len(want)
+    assert [entry.filename for entry in gallery.index.select("stories", sort_by=sort_by, **query)] == want
+
+
+@pytest.mark.parametrize("query", QUERIES[:4])
+def test_offset_pages_match_cursor_pages(gallery, query):
+    want = expected(gallery.names, "date_desc", **query)
+    for offset in (0, 5, len(want) - 3, len(want) + 10):
+        entries, total, _ = gallery.index.page("stories", offset=offset, limit=5, **query)
+        assert [entry.filename for entry in entries] == want[offset:offset + 5]
+        assert total == len(want)
+
+
+def test_cursor_stays_stable_while_items_change(gallery):
+    first, _, cursor = gallery.index.page("stories", limit=10, sort_by="date_desc")
+    before = expected(gallery.names, "date_desc")
+    assert [entry.filename for entry in first] == before[:10]
+
+    # Newer items land before the cursor and must not shift the next page;
+    # the last served item disappearing must not either
+    gallery.add("bob", "2024-06-01_00-00-00_snapnew_bob.jpg")
+    gallery.add("alice", "2024-06-02_00-00-00_snapnew_alice.mp4")
+    gallery.remove(first[-1].username, first[-1].filename)
+
+    rest = []
+    while cursor:
+        entries, _, cursor = gallery.index.page("stories", limit=10, cursor=cursor, sort_by="date_desc")
+        rest.extend(entry.filename for entry in entries)
+    assert rest == before[10:]
+
+
+def test_cursor_of_another_sort_order_is_rejected(gallery):
+    _, _, cursor = gallery.index.page("stories", limit=5, sort_by="filename_asc")
+    assert gallery.index.page("stories", limit=5, cursor=cursor, sort_by="filename_desc")[0]
+    with pytest.raises(InvalidCursor):
+        gallery.index.page("stories", limit=5, cursor=cursor, sort_by="date_desc")
+    with pytest.raises(InvalidCursor):
+        gallery.index.page("stories", limit=5, cursor="not-a-cursor", sort_by="date_desc")
+
+
+def test_requests_wait_for_the_build_without_blocking_the_loop(tmp_path):
+    gallery = Gallery(tmp_path)
+    gallery.add("alice", "2024-05-01_12-00-00_snap_alice.jpg")
+    # The startup build is still running
+    gallery.index._build_lock.acquire()
+
+    async def scenario():
+        ticks = 0
+        waiter = asyncio.ensure_future(gallery.index.ready())
+        while ticks < 5:
+            await asyncio.sleep(0.01)
+            ticks += 1
+        assert not waiter.done()
+        gallery.index._build_lock.release()
+        await waiter
+        return gallery.index.page("stories")
+
+    try:
+        entries, total, _ = asyncio.run(scenario())
+    finally:
+        gallery.media_index.close()
+    assert total == 1
+    assert entries[0].username == "alice"
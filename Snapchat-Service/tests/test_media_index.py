@@ -0,0 +1,122 @@
+import json
+import os
+import time
+
+import pytest
+
+from snapchat_dl.media_index import LEGACY_METADATA_FILE, MIGRATED_SUFFIX, MediaIndex
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = MediaIndex(str(tmp_path / ".media_index.db"), flush_interval=60)
+    yield index
+    index.close()
+
+
+def item(filename, status="pending", **fields):
+    return {"filename": filename, "type": "video", "download_status": status, "progress": 0, **fields}
+
+
+def test_add_get_and_structured_fields(index):
+    assert index.add("alice", "stories", item("a.mp4", thumbnail_url={"value": "https://x/p.jpg"}, note="kept"))
+    assert not index.add("alice", "stories", item("a.mp4"))
+
+    stored = index.get("alice", "stories", "a.mp4")
+    assert stored["thumbnail_url"] == {"value": "https://x/p.jpg"}
+    assert stored["note"] == "kept"
+    assert index.filenames("alice", "stories") == {"a.mp4"}
+    assert index.get("alice", "stories", "missing.mp4") is None
+
+
+def test_deferred_updates_flush_in_one_batch(index):
+    for name in ("a.mp4", "b.mp4"):
+        index.add("alice", "stories", item(name))
+
+    for progress in (10, 20, 30):
+        assert index.update_status("alice", "stories", "a.mp4", "downloading", progress, defer=True)
+    index.update_status("alice", "stories", "b.mp4", "downloading", 50, defer=True)
+
+    # Reads see deferred values before they are written
+    assert index.get("alice", "stories", "a.mp4")["progress"] == 30
+    assert index.stats()["pending_updates"] == 2
+
+    assert index.flush() == 2
+    assert index.stats()["pending_updates"] == 0
+    reopened = MediaIndex(index.path)
+    try:
+        assert {i["filename"]: i["progress"] for i in reopened.items("alice", "stories")} == {"a.mp4": 30, "b.mp4": 50}
+    finally:
+        reopened.close()
+
+
+def test_final_status_flushes_pending_updates_of_the_group(index):
+    for name in ("a.mp4", "b.mp4"):
+        index.add("alice", "stories", item(name))
+    index.update_status("alice", "stories", "b.mp4", "downloading", 40, defer=True)
+
+    index.update_status("alice", "stories", "a.mp4", "complete", 100, defer=True)
+
+    assert index.stats()["pending_updates"] == 0
+    assert index.get("alice", "stories", "b.mp4")["progress"] == 40
+
+
+def test_update_of_unknown_item_reports_false(index):
+    assert not index.update_status("alice", "stories", "nope.mp4", "downloading", 5)
+
+
+def test_listeners_see_every_committed_write(index):
+    calls = []
+    index.add_listener(lambda username, media_type, filenames: calls.append((username, media_type, filenames)))
+
+    index.add("alice", "stories", item("a.mp4"))
+    index.update_status("alice", "stories", "a.mp4", "downloading", 10)
+    index.update_status("alice", "stories", "a.mp4", "downloading", 20, defer=True)
+    assert len(calls) == 2
+    index.flush()
+    index.update_status("alice", "stories", "a.mp4", "complete", 100)
+    index.remove("alice", "stories", ["a.mp4"])
+    index.replace("alice", "stories", [item("b.mp4")])
+
+    assert calls == [
+        ("alice", "stories", ["a.mp4"]),
+        ("alice", "stories", ["a.mp4"]),
+        ("alice", "stories", ["a.mp4"]),
+        ("alice", "stories", ["a.mp4"]),
+        ("alice", "stories", ["a.mp4"]),
+        ("alice", "stories", None),
+    ]
+
+
+def test_listener_may_read_the_index(index):
+    seen = []
+    index.add_listener(lambda username, media_type, filenames: seen.append(index.get(username, media_type, filenames[0])))
+    index.add("alice", "stories", item("a.mp4"))
+    index.update_status("alice", "stories", "a.mp4", "downloading", 70)
+    assert [entry["progress"] for entry in seen] == [0, 70]
+
+
+def test_stats_counts_are_reused_until_the_ttl_expires(index):
+    index.stats_ttl = 0.1
+    index.add("alice", "stories", item("a.mp4"))
+    index.add("alice", "spotlights", item("b.mp4"))
+    assert (index.stats()["items"], index.stats()["groups"]) == (2, 2)
+
+    index.add("bob", "stories", item("c.mp4"))
+    assert index.stats()["items"] == 2
+
+    time.sleep(0.15)
+    assert (index.stats()["items"], index.stats()["groups"]) == (3, 3)
+
+
+def test_migrate_json_imports_once(tmp_path, index):
+    folder = tmp_path / "alice" / "stories"
+    folder.mkdir(parents=True)
+    legacy = folder / LEGACY_METADATA_FILE
+    legacy.write_text(json.dumps([item("a.mp4"), item("b.mp4"), {"no": "filename"}]), encoding="utf-8")
+
+    assert index.migrate_json(str(tmp_path)) == 2
+    assert not legacy.exists()
+    assert os.path.isfile(str(legacy) + MIGRATED_SUFFIX)
+    assert index.filenames("alice", "stories") == {"a.mp4", "b.mp4"}
+    assert index.migrate_json(str(tmp_path)) == 0
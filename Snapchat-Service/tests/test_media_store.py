@@ -0,0 +1,24 @@
+from snapchat_dl.media_store import MediaStore
+
+
+def download(root, name, data=b"media"):
+    path = root / "alice" / "stories" / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_blob_count_follows_adopt_and_prune(tmp_path):
+    store = MediaStore(str(tmp_path))
+    store.adopt(download(tmp_path, "old.jpg"), "https://cdn.example/old")
+    assert store.stats()["blobs"] is None
+
+    assert store.count_blobs() == 1
+    store.adopt(download(tmp_path, "a.jpg"), "https://cdn.example/a")
+    store.adopt(download(tmp_path, "b.jpg"), "https://cdn.example/a")  # Same media, reused
+    assert store.stats()["blobs"] == 2
+
+    (tmp_path / "alice" / "stories" / "old.jpg").unlink()
+    assert store.prune() == (1, len(b"media"))
+    assert store.stats()["blobs"] == 1
+    assert store.count_blobs() == 1
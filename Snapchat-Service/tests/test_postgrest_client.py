@@ -0,0 +1,164 @@
+import asyncio
+
+import pytest
+
+from server.postgrest_client import CircuitBreaker
+from server.postgrest_client import CircuitOpenError
+from server.postgrest_client import PostgrestClient
+from server.postgrest_client import PostgrestError
+from server.postgrest_client import PostgrestNetworkError
+
+TABLE = "snapchat_processed_stories"
+
+
+def run(postgrest, scenario, **options):
+    async def main(url):
+        client = PostgrestClient(url, "key", **options)
+        try:
+            return await scenario(client)
+        finally:
+            await client.close()
+
+    return postgrest.run(main)
+
+
+def rows(count):
+    return [{"id": f"alice_s{i}", "username": "alice", "snap_id": f"s{i}"} for i in range(count)]
+
+
+def test_filters_and_exact_count(postgrest):
+    postgrest.rows(TABLE).extend(rows(30))
+    postgrest.rows(TABLE).append({"id": "odd", "username": "alice", "snap_id": 'a,"b" c'})
+
+    async def scenario(client):
+        page = await client.table(TABLE).select("id", count="exact").eq("username", "alice").range(0, 9).execute()
+        head = await client.table(TABLE).select("id", count="exact", head=True).execute()
+        quoted = await client.table(TABLE).select("id").in_("snap_id", ['a,"b" c', "s1"]).execute()
+        return page, head, quoted
+
+    page, head, quoted = run(postgrest, scenario)
+    assert len(page.data) == 10
+    assert page.count == 31
+    assert head.data == [] and head.count == 31
+    assert sorted(row["id"] for row in quoted.data) == ["alice_s1", "odd"]
+
+
+def test_idempotent_calls_retry_busy_answers(postgrest):
+    postgrest.rows(TABLE).extend(rows(1))
+    postgrest.fail = [503, 429]
+
+    async def scenario(client):
+        response = await client.table(TABLE).select("*").execute()
+        return response, client.stats()
+
+    response, stats = run(postgrest, scenario, retries=2)
+    assert len(response.data) == 1
+    assert stats["requests"] == 3
+    assert stats["retried"] == 2
+    assert stats["circuit"] == "closed"
+
+
+def test_plain_insert_is_never_resent(postgrest):
+    postgrest.fail = [503]
+
+    async def scenario(client):
+        with pytest.raises(PostgrestError) as failure:
+            await client.table(TABLE).insert(rows(1)).execute()
+        # An upsert can be resent safely
+        postgrest.fail = [503]
+        await client.table(TABLE).upsert(rows(1), returning="minimal").execute()
+        return failure.value
+
+    error = run(postgrest, scenario, retries=2)
+    assert error.status == 503
+    assert [method for method, *_ in postgrest.requests] == ["POST", "POST", "POST"]
+    assert len(postgrest.rows(TABLE)) == 1
+
+
+def test_client_errors_raise_without_retry(postgrest):
+    postgrest.rows(TABLE).extend(rows(1))
+
+    async def scenario(client):
+        with pytest.raises(PostgrestError) as failure:
+            await client.table(TABLE).insert(rows(1)).execute()
+        return failure.value, client.stats()
+
+    error, stats = run(postgrest, scenario, retries=2)
+    assert error.status == 409
+    assert error.code == "23505"
+    assert stats["requests"] == 1
+    assert stats["circuit"] == "closed"
+
+
+def test_network_failures_open_the_circuit_until_a_trial_call_succeeds(postgrest):
+    postgrest.stall = 3
+    breaker = CircuitBreaker(threshold=3, reset_timeout=0.2)
+
+    async def scenario(client):
+        with pytest.raises(PostgrestNetworkError):
+            await client.table(TABLE).select("*").execute()
+        assert breaker.state == "open"
+        # Open: fails fast without a request
+        requests = client.requests
+        with pytest.raises(CircuitOpenError):
+            await client.table(TABLE).select("*").execute()
+        assert client.requests == requests
+
+        await asyncio.sleep(0.25)
+        assert breaker.state == "half-open"
+        await client.table(TABLE).select("*").execute()
+        return client.stats()
+
+    stats = run(postgrest, scenario, timeout=0.1, retries=2, breaker=breaker)
+    assert stats["circuit"] == "closed"
+    assert stats["circuit_trips"] == 1
+    assert stats["failures"] == 3
+
+
+def test_failed_trial_call_reopens_the_circuit(postgrest):
+    breaker = CircuitBreaker(threshold=1, reset_timeout=0.1)
+    postgrest.stall = 2
+
+    async def scenario(client):
+        with pytest.raises(PostgrestNetworkError):
+            await client.table(TABLE).select("*").execute()
+        await asyncio.sleep(0.15)
+        with pytest.raises(PostgrestNetworkError):
+            await client.table(TABLE).select("*").execute()
+        return breaker.state
+
+    assert run(postgrest, scenario, timeout=0.1, retries=0, breaker=breaker) == "open"
+    assert breaker.trips == 1
+
+
+def test_half_open_circuit_lets_one_trial_call_through(postgrest):
+    breaker = CircuitBreaker(threshold=1, reset_timeout=0.1)
+    postgrest.stall = 1
+
+    async def scenario(client):
+        with pytest.raises(PostgrestNetworkError):
+            await client.table(TABLE).select("*").execute()
+        await asyncio.sleep(0.15)
+        requests = len(postgrest.requests)
+        # The first call becomes the trial; the others start while it is in flight
+        results = await asyncio.gather(
+            *(client.table(TABLE).select("*").execute() for _ in range(5)),
+            return_exceptions=True,
+        )
+        return results, len(postgrest.requests) - requests
+
+    results, sent = run(postgrest, scenario, timeout=0.1, retries=0, breaker=breaker)
+    assert sent == 1
+    assert sum(isinstance(result, CircuitOpenError) for result in results) == 4
+    assert breaker.state == "closed"
+
+
+def test_rpc_posts_parameters(postgrest):
+    async def scenario(client):
+        return await client.rpc("cache_stats", {"namespace": "test"})
+
+    response = run(postgrest, scenario)
+    method, path, _, body = postgrest.requests[0]
+    assert (method, path) == ("POST", "rpc/cache_stats")
+    assert body == '{"namespace": "test"}'
+    assert response.data == []
@@ -0,0 +1,97 @@
+import json
+
+import pytest
+
+from snapchat_dl import profile
+from snapchat_dl.profile import PROFILE_KEYS, ProfileSnapshot, extract_next_data, select_page_props
+from snapchat_dl.utils import UserNotFoundError
+
+
+@pytest.fixture(params=["selective", "json", "orjson"])
+def backend(request, monkeypatch):
+    if request.param != "orjson":
+        monkeypatch.setattr(profile, "orjson", None)
+        # The test payloads are small: force the walk for the selective backend
+        if request.param == "selective":
+            if profile._FILLER is None:
+                pytest.skip("selective walk needs Python 3.11")
+            monkeypatch.setattr(profile, "SELECTIVE_MIN_SIZE", 0)
+    elif profile.orjson is None:
+        pytest.skip("orjson not installed")
+    return request.param
+
+
+def _payload(**page_props):
+    return json.dumps({"props": {"pageProps": page_props, "__N_SSP": True}, "page": "/add/[username]"}).encode()
+
+
+def _profile_members():
+    snap = {"snapIndex": 0, "snapUrls": {"mediaUrl": "https://x/m.mp4", "mediaPreviewUrl": {"value": "https://x/p.jpg"}}}
+    return {
+        "userProfile": {"$case": "publicProfileInfo", "publicProfileInfo": {"username": "bob"}},
+        "story": {"snapList": [snap]},
+        "curatedHighlights": [{"snapList": [snap, snap]}],
+        "spotHighlights": [],
+    }
+
+
+def test_skips_tricky_members(backend):
+    skipped = {
+        "quotes": 'say "hi" \\ {not a bracket} [nor this]',
+        "nested": [{"a": [1, 2.5e3, None, True, False, {"b": "]}"}]}, [], {}],
+        "unicode": "café \U0001f600",
+        "escaped\"key": {"\\": "\\\\"},
+        "number": -12.5e-3,
+    }
+    payload = _payload(**skipped, **_profile_members(), trailing=[1, 2])
+
+    assert select_page_props(payload) == _profile_members()
+
+
+def test_keys_after_skipped_members_and_missing_keys(backend):
+    payload = _payload(messages={f"k{i}": "v" * 10 for i in range(100)}, story={"snapList": []})
+
+    assert select_page_props(payload, ("story", "absent")) == {"story": {"snapList": []}}
+
+
+def test_accepts_str_payload(backend):
+    payload = _payload(**_profile_members()).decode()
+    assert select_page_props(payload, PROFILE_KEYS) == _profile_members()
+
+
+@pytest.mark.parametrize("payload", [b'{"page": 1}', b'{"props": {"x": 1}}'])
+def test_missing_page_props(backend, payload):
+    with pytest.raises(ValueError):
+        select_page_props(payload)
+
+
+@pytest.mark.parametrize("payload", [
+    b'{"props": {"pageProps": {"junk": [1, "unterminated}}}',
+    b'{"props": {"pageProps": {"junk": [1, {"a": [2]}',
+    b'{"props": {"pageProps": {"story"',
+])
+def test_truncated_skipped_member_is_an_error(monkeypatch, payload):
+    # Both the walk and a full decode reject a truncated payload
+    monkeypatch.setattr(profile, "orjson", None)
+    monkeypatch.setattr(profile, "SELECTIVE_MIN_SIZE", 0)
+    with pytest.raises(ValueError):
+        select_page_props(payload)
+
+
+def test_snapshot_from_payload(backend):
+    snapshot = ProfileSnapshot.from_payload("bob", _payload(**_profile_members()))
+
+    assert snapshot.user_info == {"username": "bob"}
+    assert len(snapshot.stories) == 1
+    assert len(snapshot.highlight_snaps) == 2
+    assert snapshot.spotlight_snaps == []
+
+    with pytest.raises(UserNotFoundError):
+        ProfileSnapshot.from_payload("bob", _payload(story={}))
+
+
+def test_extract_next_data_across_chunks():
+    page = b'<html><script id="__NEXT_DATA__" type="application/json">{"a": 1}</script></html>'
+    chunks = [page[i:i + 7] for i in range(0, len(page), 7)]
+    assert extract_next_data(chunks) == b'{"a": 1}'
+    assert extract_next_data([b"<html></html>"]) is None
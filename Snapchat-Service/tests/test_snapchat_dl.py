@@ -0,0 +1,156 @@
+import asyncio
+import os
+
+import pytest
+
+from snapchat_dl import snapchat_dl as snapchat_dl_module
+from snapchat_dl.filelock import LockManager
+from snapchat_dl.filelock import LockTimeout
+from snapchat_dl.snapchat_dl import SnapchatDL
+
+
+@pytest.fixture
+def downloader(tmp_path):
+    dl = SnapchatDL(directory_prefix=str(tmp_path), sleep_interval=0)
+    yield dl
+    dl.media_index.close()
+
+
+def test_second_start_joins_the_running_download(downloader, monkeypatch):
+    release = asyncio.Event()
+    calls = []
+
+    async def fetch_media(media_url, media_output, progress_callback=None):
+        calls.append(media_url)
+        await release.wait()
+        return media_url
+
+    monkeypatch.setattr(downloader, "fetch_media", fetch_media)
+    key = ("alice", "stories", "a.mp4")
+
+    async def scenario():
+        first = downloader._start_download(*key, "first", "/unused", None)
+        assert downloader._start_download(*key, "again", "/unused", None) is first
+        release.set()
+        assert await first == "first"
+        await asyncio.sleep(0)
+        assert key not in downloader._download_tasks
+        # Finished downloads are not joined
+        later = downloader._start_download(*key, "later", "/unused", None)
+        assert later is not first
+        assert await later == "later"
+
+    asyncio.run(scenario())
+    assert calls == ["first", "later"]
+
+
+def test_queued_downloads_do_not_hold_colliding_locks(downloader, monkeypatch, tmp_path):
+    # One stripe: every path collides. A queued task used to hold the stripe
+    # while waiting for a slot, so the tail of the batch timed out.
+    downloader.locks = LockManager(str(tmp_path / "locks"), stripes=1, timeout=0.5)
+    downloader.max_workers = 2
+    active = []
+    peak = []
+
+    async def download_url_async(session, url, output, sleep_interval=0, progress_callback=None):
+        active.append(url)
+        peak.append(len(active))
+        await asyncio.sleep(0.2)
+        with open(output, "wb") as f:
+            f.write(url.encode())
+        active.remove(url)
+        return os.path.basename(output)
+
+    monkeypatch.setattr(snapchat_dl_module, "download_url_async", download_url_async)
+
+    async def scenario():
+        outputs = [str(tmp_path / "alice" / "stories" / f"{i}.jpg") for i in range(6)]
+        os.makedirs(os.path.dirname(outputs[0]))
+        results = await asyncio.gather(
+            *(downloader.fetch_media(f"https://cdn.example/{i}", out) for i, out in enumerate(outputs))
+        )
+        await downloader.close()
+        return outputs, results
+
+    outputs, results = asyncio.run(scenario())
+    assert results == [os.path.basename(out) for out in outputs]
+    assert max(peak) == 2  # bounded by the slots, not by the shared stripe
+    assert downloader.locks.stats()["timeouts"] == 0
+    assert all(downloader.media_store.find(f"https://cdn.example/{i}", ".jpg") for i in range(6))
+
+
+def test_second_fetch_links_the_stored_copy(downloader, monkeypatch, tmp_path):
+    calls = []
+
+    async def download_url_async(session, url, output, sleep_interval=0, progress_callback=None):
+        calls.append(output)
+        await asyncio.sleep(0.05)
+        with open(output, "wb") as f:
+            f.write(b"media")
+        return os.path.basename(output)
+
+    monkeypatch.setattr(snapchat_dl_module, "download_url_async", download_url_async)
+    output = str(tmp_path / "alice" / "stories" / "a.jpg")
+    os.makedirs(os.path.dirname(output))
+
+    async def scenario():
+        await asyncio.gather(
+            downloader.fetch_media("https://cdn.example/a", output),
+            downloader.fetch_media("https://cdn.example/a", output),
+        )
+        await downloader.close()
+
+    asyncio.run(scenario())
+    assert calls == [output]
+    with open(output, "rb") as f:
+        assert f.read() == b"media"
+
+
+def test_waits_past_the_lock_timeout_while_another_process_downloads(downloader, monkeypatch, tmp_path):
+    # A second LockManager on the same directory stands in for another worker process
+    downloader.locks = LockManager(str(tmp_path / "locks"), timeout=0.2)
+    other = LockManager(str(tmp_path / "locks"), timeout=0.2)
+    calls = []
+
+    async def download_url_async(session, url, output, sleep_interval=0, progress_callback=None):
+        calls.append(output)
+        return os.path.basename(output)
+
+    monkeypatch.setattr(snapchat_dl_module, "download_url_async", download_url_async)
+    output = str(tmp_path / "alice" / "stories" / "a.jpg")
+    os.makedirs(os.path.dirname(output))
+
+    async def other_process(started):
+        async with other.lock(output):
+            started.set()
+            for _ in range(8):
+                with open(output + ".part", "ab") as f:
+                    f.write(b"media")
+                await asyncio.sleep(0.1)
+            os.replace(output + ".part", output)
+            downloader.media_store.adopt(output, "https://cdn.example/a")
+
+    async def scenario():
+        started = asyncio.Event()
+        holder = asyncio.ensure_future(other_process(started))
+        await started.wait()
+        result = await downloader.fetch_media("https://cdn.example/a", output)
+        await holder
+        await downloader.close()
+        return result
+
+    assert asyncio.run(scenario()) == "a.jpg"
+    assert calls == []
+
+
+def test_stalled_holder_still_times_out(downloader, tmp_path):
+    downloader.locks = LockManager(str(tmp_path / "locks"), timeout=0.2)
+    other = LockManager(str(tmp_path / "locks"), timeout=0.2)
+    output = str(tmp_path / "alice" / "stories" / "a.jpg")
+
+    async def scenario():
+        with other.lock(output):
+            with pytest.raises(LockTimeout):
+                await downloader.fetch_media("https://cdn.example/a", output)
+
+    asyncio.run(scenario())
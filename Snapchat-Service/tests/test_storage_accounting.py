@@ -0,0 +1,68 @@
+import os
+import threading
+
+from server import storage_accounting as storage_module
+from server.storage_accounting import StorageAccounting
+
+
+def write(path, size):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+
+
+def test_counts_hardlinked_media_once(tmp_path):
+    blob = str(tmp_path / ".blobs" / "ab" / "ab12.jpg")
+    write(blob, 100)
+    for username in ("alice", "bob"):
+        os.makedirs(tmp_path / username / "stories")
+        os.link(blob, tmp_path / username / "stories" / "a.jpg")
+    accounting = StorageAccounting(str(tmp_path))
+
+    accounting.ensure_ready()
+
+    assert (accounting.total_bytes, accounting.total_files) == (100, 1)
+    assert accounting.usage() == {
+        ("alice", "stories"): {"files": 1, "bytes": 100, "videos": 0},
+        ("bob", "stories"): {"files": 1, "bytes": 100, "videos": 0},
+    }
+
+    os.remove(tmp_path / "alice" / "stories" / "a.jpg")
+    accounting.discard(str(tmp_path / "alice" / "stories" / "a.jpg"))
+    assert accounting.total_bytes == 100
+    assert ("alice", "stories") not in accounting.usage()
+
+
+def test_ensure_ready_waits_for_the_walk_in_flight(tmp_path, monkeypatch):
+    write(str(tmp_path / "alice" / "stories" / "a.jpg"), 100)
+    accounting = StorageAccounting(str(tmp_path))
+    walking = threading.Event()
+    resume = threading.Event()
+    real_walk = os.walk
+
+    def slow_walk(top):
+        walking.set()
+        resume.wait(5)
+        return real_walk(top)
+
+    monkeypatch.setattr(storage_module.os, "walk", slow_walk)
+    startup = threading.Thread(target=accounting.reconcile)
+    startup.start()
+    assert walking.wait(5)
+
+    seen = []
+    waiters = [
+        threading.Thread(target=lambda: (accounting.ensure_ready(), seen.append(accounting.total_bytes)))
+        for _ in range(3)
+    ]
+    for waiter in waiters:
+        waiter.start()
+    for waiter in waiters:
+        waiter.join(0.2)
+    assert seen == []  # still waiting, not returning with empty counters
+
+    resume.set()
+    for thread in [startup, *waiters]:
+        thread.join(5)
+    assert seen == [100, 100, 100]
+    assert accounting.reconciles == 1
@@ -0,0 +1,119 @@
+import pytest
+
+from server.postgrest_client import PostgrestClient
+from server.supabase_manager import SnapchatSupabaseManager
+
+CACHE = "snapchat_recent_stories_cache"
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    monkeypatch.setenv("PROJECT_NAMESPACE", "test")
+    return SnapchatSupabaseManager()
+
+
+def connect(manager, url):
+    manager.client = PostgrestClient(url, "key", timeout=0.1, retries=0)
+    manager.is_connected = True
+
+
+def story(url, snap_id=None, kind="photo"):
+    return {"url": url, "snap_id": snap_id, "type": kind}
+
+
+def cached(postgrest):
+    return sorted(
+        (row["story_order"], row["story_url"], row["snap_id"])
+        for row in postgrest.rows(CACHE)
+    )
+
+
+def test_url_keyed_stories_are_not_duplicated(postgrest, manager):
+    first = [story("https://cdn/a"), story("https://cdn/b", "b"), story("https://cdn/c")]
+    reordered = [story("https://cdn/c"), story("https://cdn/b", "b"), story("https://cdn/a")]
+
+    async def scenario(url):
+        connect(manager, url)
+        assert await manager.update_recent_stories_cache("alice", first)
+        assert await manager.update_recent_stories_cache("alice", reordered)
+        # A fresh process re-reads the rows instead of trusting a snapshot
+        manager._cache_snapshots.clear()
+        assert await manager.update_recent_stories_cache("alice", reordered)
+        await manager.client.close()
+
+    postgrest.run(scenario)
+    assert cached(postgrest) == [(1, "https://cdn/c", None), (2, "https://cdn/b", "b"), (3, "https://cdn/a", None)]
+
+
+def test_duplicated_url_rows_are_collapsed(postgrest, manager):
+    for _ in range(3):
+        postgrest.rows(CACHE).append({
+            "project_namespace": "test", "username": "alice", "story_url": "https://cdn/a",
+            "snap_id": None, "story_type": "photo", "story_order": 1,
+        })
+
+    async def scenario(url):
+        connect(manager, url)
+        assert await manager.update_recent_stories_cache("alice", [story("https://cdn/a")])
+        await manager.client.close()
+
+    postgrest.run(scenario)
+    assert cached(postgrest) == [(1, "https://cdn/a", None)]
+
+
+def test_unchanged_cache_is_not_written(postgrest, manager):
+    stories = [story("https://cdn/a"), story("https://cdn/b", "b")]
+
+    async def scenario(url):
+        connect(manager, url)
+        assert await manager.update_recent_stories_cache("alice", stories)
+        writes = len(postgrest.requests)
+        assert await manager.update_recent_stories_cache("alice", stories)
+        assert len(postgrest.requests) == writes
+        await manager.client.close()
+
+    postgrest.run(scenario)
+    assert manager.cache_writes_skipped == 1
+
+
+def test_mark_stories_processed_counts_distinct_rows(postgrest, manager):
+    stories = [story(f"https://cdn/{i}", f"s{i % 3}") for i in range(5)]
+
+    async def scenario(url):
+        connect(manager, url)
+        stored = await manager.mark_stories_processed("alice", stories, batch_size=2)
+        await manager.client.close()
+        return stored
+
+    assert postgrest.run(scenario) == 3
+    assert sorted(row["id"] for row in postgrest.rows("snapchat_processed_stories")) == [
+        "alice_s0", "alice_s1", "alice_s2",
+    ]
+
+
+def test_mark_stories_processed_stops_at_the_failed_batch(postgrest, manager):
+    stories = [story(f"https://cdn/{i}", f"s{i}") for i in range(5)]
+    postgrest.fail = [None, 400, 400]
+
+    async def scenario(url):
+        connect(manager, url)
+        stored = await manager.mark_stories_processed("alice", stories, batch_size=2, retries=2)
+        await manager.client.close()
+        return stored
+
+    assert postgrest.run(scenario) == 2
+    assert manager.is_connected
+    assert len(postgrest.rows("snapchat_processed_stories")) == 2
+
+
+def test_network_failure_disconnects(postgrest, manager):
+    postgrest.stall = 1
+
+    async def scenario(url):
+        connect(manager, url)
+        stored = await manager.mark_stories_processed("alice", [story("https://cdn/a", "a")])
+        await manager.client.close()
+        return stored
+
+    assert postgrest.run(scenario) == 0
+    assert not manager.is_connected
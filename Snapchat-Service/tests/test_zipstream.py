@@ -0,0 +1,128 @@
+import io
+import os
+import random
+import zipfile
+
+import pytest
+
+from server import zipstream
+from server.zipstream import ZipStream
+from server.zipstream import parse_range
+
+
+@pytest.fixture
+def media(tmp_path):
+    rng = random.Random(3)
+    files = []
+    for i, size in enumerate((0, 1, 700, 4096, 65537, 250000)):
+        path = tmp_path / f"{i}.mp4"
+        path.write_bytes(rng.randbytes(size))
+        files.append((str(path), f"alice/stories/{i}.mp4"))
+    path = tmp_path / "photo.jpg"
+    path.write_bytes(rng.randbytes(9000))
+    files.append((str(path), "bob/stories/café.jpg"))
+    return files
+
+
+@pytest.fixture(autouse=True)
+def fresh_crc_cache():
+    zipstream._crc_cache.clear()
+    yield
+    zipstream._crc_cache.clear()
+
+
+def build(files, start=0, end=None):
+    # A new stream per request, as the endpoints do; small chunks cross file boundaries
+    return b"".join(ZipStream(files, chunk_size=4096).chunks(start, end))
+
+
+def check_archive(data, files):
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == [arcname for _, arcname in files]
+        for path, arcname in files:
+            with open(path, "rb") as f:
+                assert archive.read(arcname) == f.read()
+
+
+def test_stored_archive_has_known_size_and_is_valid(media):
+    stream = ZipStream(media)
+    assert stream.size is not None
+    data = build(media)
+    assert len(data) == stream.size
+    check_archive(data, media)
+
+
+def test_mixed_archive_is_deflated_and_valid(media, tmp_path):
+    text = tmp_path / "notes.txt"
+    text.write_text("story metadata\n" * 5000)
+    files = media + [(str(text), "alice/notes.txt")]
+    stream = ZipStream(files)
+    assert stream.size is None
+    data = build(files)
+    check_archive(data, files)
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        info = archive.getinfo("alice/notes.txt")
+        assert info.compress_type == zipfile.ZIP_DEFLATED
+        assert info.compress_size < info.file_size
+    with pytest.raises(ValueError):
+        list(stream.chunks(10, 20))
+
+
+def test_missing_files_are_skipped(media, tmp_path):
+    files = media + [(str(tmp_path / "gone.mp4"), "alice/stories/gone.mp4")]
+    stream = ZipStream(files)
+    assert stream.missing == ["alice/stories/gone.mp4"]
+    check_archive(build(files), media)
+
+
+def test_random_ranges_match_the_full_archive(media):
+    full = build(media)
+    rng = random.Random(11)
+    for _ in range(50):
+        zipstream._crc_cache.clear()
+        start = rng.randrange(len(full))
+        end = rng.randrange(start + 1, len(full) + 1)
+        assert build(media, start, end) == full[start:end]
+
+
+def test_archive_resumed_over_random_ranges_is_valid(media):
+    size = ZipStream(media).size
+    rng = random.Random(5)
+    cuts = sorted(rng.sample(range(1, size), 49))
+    bounds = [0] + cuts + [size]
+    # 50 resumed requests, each starting wherever the previous one stopped
+    parts = []
+    for start, end in zip(bounds, bounds[1:]):
+        zipstream._crc_cache.clear()
+        parts.append(build(media, start, end))
+    check_archive(b"".join(parts), media)
+
+
+def test_etag_follows_the_selection(media):
+    before = ZipStream(media).etag
+    assert ZipStream(media).etag == before
+    assert ZipStream(media[1:]).etag != before
+    path, _ = media[3]
+    with open(path, "ab") as f:
+        f.write(b"more")
+    assert ZipStream(media).etag != before
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("bytes=0-99", (0, 100)),
+    ("bytes=100-", (100, 1000)),
+    ("bytes=-100", (900, 1000)),
+    ("bytes=990-2000", (990, 1000)),
+    ("bytes=0-1,5-9", None),
+    ("items=0-1", None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=5-2", "bytes=-0"])
+def test_unsatisfiable_range(header):
+    with pytest.raises(ValueError):
+        parse_range(header, 1000)